@@ -1,5 +1,6 @@
 from typing import Any
 from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+from utils import ExpressionError, evaluate_expression
 
 _calculator_add_tool_schema = {
     "type": "function",
@@ -85,6 +86,28 @@ _calculator_divide_tool_schema = {
     }
 }
 
+_calculator_evaluate_tool_schema = {
+    "type": "function",
+    "name": "calculator_evaluate",
+    "description": "Evaluate a whole calculation in one call and provide the result with its unit. " + \
+                    "Prefer this tool over the other calculator tools for anything beyond a single operation. " + \
+                    "Supports + - * / ** % and parentheses, units written after numbers (g, mg, ug, kg, L, mL, uL, mol, mmol, umol, M, mM, uM, nM, s, min, h, m, cm, mm, K), " + \
+                    "unit conversion with 'in' (e.g. '0.25 L in mL'), lists of values computed element by element (e.g. '[1, 2, 5] mM * 10 mL in umol'), " + \
+                    "molar_mass(\"CuSO4·5H2O\"), dilution(c1=..., v1=..., c2=..., v2=...) with exactly one of the four left out, " + \
+                    "percent(part, whole), percent_of(percent, whole), sqrt, log, log10, exp, round, sum, mean, min and max.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "expression": {
+                "type": "string",
+                "description": "The calculation, for example '(250*0.1)/3 + 2' or 'dilution(c1=1 M, c2=0.1 M, v2=250 mL)'"
+            }
+        },
+        "required": ["expression"],
+        "additionalProperties": False
+    }
+}
+
 async def _add_tool(args: Any) -> ToolResult:
     print(f"Adding {args['A']} and {args['B']}")
     return ToolResult(args["A"] + args["B"], ToolResultDirection.TO_SERVER)
@@ -104,8 +127,17 @@ async def _divide_tool(args: Any) -> ToolResult:
     result = float(args["A"]) / float(args["B"])
     return ToolResult(result, ToolResultDirection.TO_SERVER)
 
+async def _evaluate_tool(args: Any) -> ToolResult:
+    print(f"Evaluating {args['expression']}")
+    try:
+        result = evaluate_expression(args["expression"])
+    except ExpressionError as e:
+        return ToolResult(f"Error: {e}", ToolResultDirection.TO_SERVER)
+    return ToolResult(result, ToolResultDirection.TO_SERVER)
+
 def attach_calculator_tools(rtmt: RTMiddleTier) -> None:
     rtmt.tools["calculator_add"] = Tool(schema=_calculator_add_tool_schema, target=lambda args: _add_tool(args))
     rtmt.tools["calculator_subtract"] = Tool(schema=_calculator_subtract_tool_schema, target=lambda args: _subtract_tool(args))
     rtmt.tools["calculator_multiply"] = Tool(schema=_calculator_multiply_tool_schema, target=lambda args: _multiply_tool(args))
-    rtmt.tools["calculator_divide"] = Tool(schema=_calculator_divide_tool_schema, target=lambda args: _divide_tool(args))
\ No newline at end of file
+    rtmt.tools["calculator_divide"] = Tool(schema=_calculator_divide_tool_schema, target=lambda args: _divide_tool(args))
+    rtmt.tools["calculator_evaluate"] = Tool(schema=_calculator_evaluate_tool_schema, target=lambda args: _evaluate_tool(args))
\ No newline at end of file
@@ -1,5 +1,9 @@
-from typing import Any
+import time
+from typing import Any, Awaitable, Callable, Optional
+import numpy as np
 from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+from machine import MachineDevice, MachineHistory, MachineHistorySampler, MachinePoller, MachineSnapshot, MachineStateStore, MachineStatePublisher
+from machine import DIRECTIONS, STEADY_RATE, TRENDS, find_deviations
 from models.junior import JuniorMachineState, Deck, PositionReading
 
 # Simulated Junior machine state
@@ -8,7 +12,7 @@ from models.junior import JuniorMachineState, Deck, PositionReading
 # These variables would be replaced with actual hardware interaction code.
 # For example, you might use a library to communicate with the machine's API or hardware interface.
 
-# Simulated current state of the Junior machine with a global variable so that multiple sessions can access it
+# Simulated initial state of the Junior machine, loaded in the MachineStateStore that all sessions share
 global current_junior_state
 current_junior_state = JuniorMachineState(
     decks=[
@@ -32,6 +36,25 @@ current_junior_state = JuniorMachineState(
 param_deck = "deck"
 param_position = "position"
 param_setpoint = "setpoint"
+param_window_seconds = "window_seconds"
+param_decks = "decks"
+param_changes = "changes"
+param_min_deviation = "min_deviation"
+param_direction = "direction"
+param_trend = "trend"
+
+# Positions listed by machine_find_deviations, the count of the others is given
+DEVIATIONS_LISTED = 20
+
+# Points of the downsampled trend read back to the user
+HISTORY_TREND_POINTS = 6
+# Seconds of readings the heating / cooling rate is estimated from
+HISTORY_RATE_WINDOW = 60.0
+# A position within this many °C of its setpoint, and varying less than that over the rate window, is stable
+STABLE_TOLERANCE = 0.5
+
+# Applies setpoints to the machine, and to the store once the machine took them
+SetpointWriter = Callable[[list[int], list[float]], Awaitable[MachineSnapshot]]
 
 _machine_get_status_schema = {
     "type": "function",
@@ -87,73 +110,177 @@ _machine_set_values_schema = {
     }
 }
 
-async def _machine_get_status(args: Any) -> ToolResult:
+_machine_get_decks_status_schema = {
+    "type": "function",
+    "name": "machine_get_decks_status",
+    "description": "Check the status of all positions of one or more decks of the machine in a single call. " + \
+                    "Use it instead of calling machine_get_status for each position when the user asks about a whole deck or several positions. " + \
+                    "Deck names are numbers. Be sure to use the digit representation of the number, not the string.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "decks": {
+                "type": "array",
+                "items": {
+                    "type": "string"
+                },
+                "description": "The names of the decks. Leave empty for all decks."
+            }
+        },
+        "required": []
+    }
+}
+
+_machine_set_setpoints_schema = {
+    "type": "function",
+    "name": "machine_set_setpoints",
+    "description": "Set the setpoints of several positions of the machine in a single call. The changes are applied all together, or not at all if one of them is invalid. " + \
+                    "Use it instead of calling machine_set_values for each position. " + \
+                    "Deck and position names are numbers. Be sure to use the digit representation of the number, not the string. " + \
+                    "Before running this tool, make sure to repeat the collected setpoints. Ask the user to confirm the action, then proceed with the execution of the API",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "changes": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "deck": {
+                            "type": "string",
+                            "description": "The name of the deck."
+                        },
+                        "position": {
+                            "type": "string",
+                            "description": "The name of the position on the deck."
+                        },
+                        "setpoint": {
+                            "type": "string",
+                            "description": "The setpoint temperature for the position."
+                        }
+                    },
+                    "required": ["deck", "position", "setpoint"]
+                },
+                "description": "The setpoint changes to apply."
+            }
+        },
+        "required": ["changes"]
+    }
+}
+
+_machine_find_deviations_schema = {
+    "type": "function",
+    "name": "machine_find_deviations",
+    "description": "Find the positions of the machine matching conditions on their temperature, in a single call over all decks. " + \
+                    "Use it for questions like 'which positions are more than 2 °C off setpoint', 'which positions are still heating' " + \
+                    "or 'is anything colder than its setpoint on deck 3', instead of checking each position. " + \
+                    "Positions are listed from the furthest from their setpoint.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "min_deviation": {
+                "type": "number",
+                "description": "Minimum difference in °C between the temperature and the setpoint. Defaults to 0, all positions."
+            },
+            "direction": {
+                "type": "string",
+                "enum": list(DIRECTIONS),
+                "description": "Whether the temperature must be above or below the setpoint. Defaults to any."
+            },
+            "trend": {
+                "type": "string",
+                "enum": list(TRENDS),
+                "description": "Whether the temperature must be rising (heating), falling (cooling) or steady (stable) over the last minute. Defaults to any."
+            },
+            "decks": {
+                "type": "array",
+                "items": {
+                    "type": "string"
+                },
+                "description": "Only look at these decks. Leave empty for all decks."
+            }
+        },
+        "required": []
+    }
+}
+
+_machine_get_history_schema = {
+    "type": "function",
+    "name": "machine_get_history",
+    "description": "Get the recent temperature history of a position of the machine: minimum, maximum and mean temperature, " + \
+                    "the trend over the time window, whether it is heating, cooling or stable, and the estimated time to reach the setpoint. " + \
+                    "Use it for questions like 'has deck 2 stabilized' or 'how fast is position 1 heating'. " + \
+                    "Deck and position names are numbers. Be sure to use the digit representation of the number, not the string.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "deck": {
+                "type": "string",
+                "description": "The name of the deck."
+            },
+            "position": {
+                "type": "string",
+                "description": "The name of the position on the deck."
+            },
+            "window_seconds": {
+                "type": "number",
+                "description": "How far back to look, in seconds. Defaults to 300 (5 minutes)."
+            }
+        },
+        "required": ["deck", "position"]
+    }
+}
+
+def _read_age(snapshot: MachineSnapshot) -> str:
+    """How old the temperatures read from the device are, for the model to tell if they're outdated."""
+    if snapshot.read_at is None:
+        return ""
+    return f" Temperatures were read {max(time.time() - snapshot.read_at, 0.0):.1f} seconds ago."
+
+def _locate(store: MachineStateStore, args: Any) -> tuple[Optional[int], Optional[str]]:
+    """Index of the deck / position named in the tool arguments, or the message to return to the model."""
+    deck_name = str(args[param_deck])
+    position_name = str(args[param_position])
+    if not deck_name.isdigit() or not position_name.isdigit():
+        return None, "Deck and position names must be numeric. Please retry with valid numbers."
+    if not store.has_deck(deck_name):
+        return None, f"Deck {deck_name} not found."
+    index = store.index_of(deck_name, position_name)
+    if index is None:
+        return None, f"Position {position_name} not found on deck {deck_name}."
+    return index, None
+
+async def _machine_get_status(store: MachineStateStore, args: Any) -> ToolResult:
     """
     Check the status of the machine.
     """
     if (args.get(param_deck) is None) or (args.get(param_position) is None):
         return ToolResult("No deck or position provided. Please retry", ToolResultDirection.TO_SERVER)
-    
-    deck_name = str(args[param_deck])
-    position_name = str(args[param_position])
-    if not deck_name.isdigit() or not position_name.isdigit():
-        return ToolResult("Deck and position names must be numeric. Please retry with valid numbers.", ToolResultDirection.TO_SERVER)
 
-    # Locate deck and position
-    deck: Deck | None = next(
-        (d for d in current_junior_state.decks if d.name == deck_name), None
-    )
-    if deck is None:
-        return ToolResult(f"Deck {deck_name} not found.", ToolResultDirection.TO_SERVER)
-
-    pos: PositionReading | None = next(
-        (p for p in deck.positions if p.name == position_name), None
-    )
-    if pos is None:
-        return ToolResult(f"Position {position_name} not found on deck {deck_name}.", ToolResultDirection.TO_SERVER)
+    index, error = _locate(store, args)
+    if error is not None:
+        return ToolResult(error, ToolResultDirection.TO_SERVER)
 
-    # Compose response
-    parts: list[str] = []
-    if pos.setpoint is not None:
-        parts.append(f"Setpoint is {pos.setpoint} °C")
-    if pos.temperature is not None:
-        parts.append(f"Current temperature is {pos.temperature} °C")
+    # Compose response from a single snapshot so setpoint and temperature are consistent
+    snapshot = store.snapshot
+    parts: list[str] = [
+        f"Setpoint is {float(snapshot.setpoints[index])} °C",
+        f"Current temperature is {float(snapshot.temperatures[index])} °C",
+    ]
 
-    result_text = (f"Position {position_name} on deck {deck_name}: " + " and ".join(parts) + ".")
+    result_text = (f"Position {args[param_position]} on deck {args[param_deck]}: " + " and ".join(parts) + "." + _read_age(snapshot))
     return ToolResult(result_text, ToolResultDirection.TO_SERVER)
 
-async def _machine_set_values(args: Any) -> ToolResult:
+async def _machine_set_values(store: MachineStateStore, write_setpoints: SetpointWriter, args: Any) -> ToolResult:
     """
-    Update set-point and / or temperature for a given deck / position.
-    The caller may supply either or both of the parameters “setpoint” and “temperature”.
+    Update the set-point for a given deck / position.
     """
     if (args.get(param_deck) is None) or (args.get(param_position) is None):
         return ToolResult("No deck or position provided. Please retry.", ToolResultDirection.TO_SERVER)
 
-    deck_name = str(args[param_deck])
-    position_name = str(args[param_position])
-
-    if not deck_name.isdigit() or not position_name.isdigit():
-        return ToolResult(
-            "Deck and position names must be numeric. Please retry with valid numbers.",
-            ToolResultDirection.TO_SERVER,
-        )
-
-    # Locate deck and position
-    deck: Deck | None = next(
-        (d for d in current_junior_state.decks if d.name == deck_name), None
-    )
-    if deck is None:
-        return ToolResult(f"Deck {deck_name} not found.", ToolResultDirection.TO_SERVER)
-
-    pos: PositionReading | None = next(
-        (p for p in deck.positions if p.name == position_name), None
-    )
-    if pos is None:
-        return ToolResult(
-            f"Position {position_name} not found on deck {deck_name}.",
-            ToolResultDirection.TO_SERVER,
-        )
+    index, error = _locate(store, args)
+    if error is not None:
+        return ToolResult(error, ToolResultDirection.TO_SERVER)
 
     # Validate and apply new setpoint
     if param_setpoint not in args:
@@ -164,14 +291,208 @@ async def _machine_set_values(args: Any) -> ToolResult:
     except ValueError:
         return ToolResult("Invalid setpoint value; must be a number.", ToolResultDirection.TO_SERVER)
 
-    pos.setpoint = new_setpoint
-    result_text = f"Updated position {position_name} on deck {deck_name}: new setpoint is {new_setpoint} °C."
+    try:
+        await write_setpoints([index], [new_setpoint])
+    except Exception as e:
+        return ToolResult(f"The machine didn't take the new setpoint: {e}", ToolResultDirection.TO_SERVER)
+    result_text = f"Updated position {args[param_position]} on deck {args[param_deck]}: new setpoint is {new_setpoint} °C."
     return ToolResult(result_text, ToolResultDirection.TO_SERVER)
 
-def attach_machine_tools(rtmt: RTMiddleTier) -> None:
+async def _machine_get_decks_status(store: MachineStateStore, args: Any) -> ToolResult:
+    """
+    Check the status of every position of the requested decks, from a single snapshot.
+    """
+    deck_names = [str(d) for d in args.get(param_decks) or store.deck_names]
+    unknown = [d for d in deck_names if not store.has_deck(d)]
+    if unknown:
+        return ToolResult(f"Deck{'s' if len(unknown) > 1 else ''} {', '.join(unknown)} not found.", ToolResultDirection.TO_SERVER)
+
+    snapshot = store.snapshot
+    lines: list[str] = []
+    for deck_name in deck_names:
+        positions = store.deck_positions(deck_name)
+        readings = ", ".join(
+            f"position {store.position_names[i]} {float(snapshot.temperatures[i])} °C (setpoint {float(snapshot.setpoints[i])} °C)"
+            for i in range(positions.start, positions.stop)
+        )
+        lines.append(f"Deck {deck_name}: {readings}.")
+    return ToolResult("\n".join(lines) + _read_age(snapshot), ToolResultDirection.TO_SERVER)
+
+async def _machine_set_setpoints(store: MachineStateStore, write_setpoints: SetpointWriter, args: Any) -> ToolResult:
+    """
+    Update the set-points of several deck / positions at once, all or nothing.
+    """
+    changes = args.get(param_changes)
+    if not changes:
+        return ToolResult("No setpoint changes provided. Please retry.", ToolResultDirection.TO_SERVER)
+
+    indexes: list[int] = []
+    setpoints: list[float] = []
+    errors: list[str] = []
+    for change in changes:
+        if (change.get(param_deck) is None) or (change.get(param_position) is None) or (change.get(param_setpoint) is None):
+            errors.append("A change is missing its deck, position or setpoint.")
+            continue
+        index, error = _locate(store, change)
+        if error is None:
+            try:
+                setpoints.append(float(change[param_setpoint]))
+                indexes.append(index)
+            except ValueError:
+                error = f"Invalid setpoint value {change[param_setpoint]} for position {change[param_position]} on deck {change[param_deck]}; must be a number."
+        if error is not None:
+            errors.append(error)
+    if errors:
+        return ToolResult("No setpoint was changed. " + " ".join(errors) + " Please retry.", ToolResultDirection.TO_SERVER)
+
+    try:
+        await write_setpoints(indexes, setpoints)
+    except Exception as e:
+        return ToolResult(f"No setpoint was changed, the machine didn't take them: {e}", ToolResultDirection.TO_SERVER)
+    updated = ", ".join(f"position {c[param_position]} on deck {c[param_deck]} to {s} °C" for c, s in zip(changes, setpoints))
+    return ToolResult(f"Updated {len(indexes)} setpoint{'s' if len(indexes) > 1 else ''}: {updated}.", ToolResultDirection.TO_SERVER)
+
+async def _machine_find_deviations(store: MachineStateStore, history: MachineHistory, args: Any) -> ToolResult:
+    """
+    List the positions matching conditions on their temperature, setpoint and trend.
+    """
+    try:
+        min_deviation = float(args.get(param_min_deviation) or 0)
+    except ValueError:
+        return ToolResult("Invalid minimum deviation; must be a number.", ToolResultDirection.TO_SERVER)
+    direction = args.get(param_direction) or "any"
+    trend = args.get(param_trend) or "any"
+    if direction not in DIRECTIONS or trend not in TRENDS:
+        return ToolResult(f"Direction must be one of {', '.join(DIRECTIONS)} and trend one of {', '.join(TRENDS)}.", ToolResultDirection.TO_SERVER)
+
+    positions = None
+    deck_names = [str(d) for d in args.get(param_decks) or []]
+    if deck_names:
+        unknown = [d for d in deck_names if not store.has_deck(d)]
+        if unknown:
+            return ToolResult(f"Deck{'s' if len(unknown) > 1 else ''} {', '.join(unknown)} not found.", ToolResultDirection.TO_SERVER)
+        positions = np.zeros(len(store), dtype=bool)
+        for deck_name in deck_names:
+            positions[store.deck_positions(deck_name)] = True
+
+    snapshot = store.snapshot
+    rates = history.rates(time.time() - HISTORY_RATE_WINDOW)
+    if trend != "any" and rates is None:
+        return ToolResult("There isn't enough temperature history yet to tell which positions are heating or cooling.", ToolResultDirection.TO_SERVER)
+    found = find_deviations(snapshot, rates, positions, min_deviation, direction, trend)
+
+    considered = len(store) if positions is None else int(positions.sum())
+    if len(found) == 0:
+        return ToolResult(f"None of the {considered} positions match." + _read_age(snapshot), ToolResultDirection.TO_SERVER)
+    lines: list[str] = [f"{len(found)} of the {considered} positions match:"]
+    for i in found[:DEVIATIONS_LISTED].tolist():
+        deviation = float(snapshot.temperatures[i] - snapshot.setpoints[i])
+        line = (f"deck {store.position_decks[i]} position {store.position_names[i]}: {float(snapshot.temperatures[i]):.1f} °C, "
+                f"{abs(deviation):.1f} °C {'above' if deviation > 0 else 'below'} its setpoint of {float(snapshot.setpoints[i])} °C")
+        if rates is not None and abs(rates[i]) > STEADY_RATE:
+            line += f", {'heating' if rates[i] > 0 else 'cooling'} at {abs(rates[i]) * 60:.2f} °C per minute"
+        lines.append(line)
+    if len(found) > DEVIATIONS_LISTED:
+        lines.append(f"and {len(found) - DEVIATIONS_LISTED} more.")
+    return ToolResult("\n".join(lines) + _read_age(snapshot), ToolResultDirection.TO_SERVER)
+
+def _duration(seconds: float) -> str:
+    return f"{seconds:.0f} seconds" if seconds < 120 else f"{seconds / 60:.1f} minutes"
+
+async def _machine_get_history(store: MachineStateStore, history: MachineHistory, args: Any) -> ToolResult:
+    """
+    Summarize the temperature history of a deck / position.
+    """
+    if (args.get(param_deck) is None) or (args.get(param_position) is None):
+        return ToolResult("No deck or position provided. Please retry", ToolResultDirection.TO_SERVER)
+
+    index, error = _locate(store, args)
+    if error is not None:
+        return ToolResult(error, ToolResultDirection.TO_SERVER)
+
+    try:
+        window = float(args.get(param_window_seconds) or 300)
+    except ValueError:
+        return ToolResult("Invalid time window; must be a number of seconds.", ToolResultDirection.TO_SERVER)
+
+    where = f"position {args[param_position]} on deck {args[param_deck]}"
+    readings = history.position(index, time.time() - window)
+    if len(readings) == 0:
+        return ToolResult(f"No temperature readings of {where} in the last {_duration(window)}.", ToolResultDirection.TO_SERVER)
+
+    temperatures = readings.temperatures
+    current = temperatures[-1]
+    setpoint = float(store.snapshot.setpoints[index])
+    parts: list[str] = [
+        f"{len(readings)} reading{'s' if len(readings) > 1 else ''} of {where} over the last {_duration(window)}",
+        f"min {temperatures.min():.1f} °C, max {temperatures.max():.1f} °C, mean {temperatures.mean():.1f} °C",
+        "trend " + ", ".join(f"{t:.1f}" for t in readings.downsample(HISTORY_TREND_POINTS)) + " °C",
+    ]
+
+    recent = temperatures[readings.times >= readings.times[-1] - HISTORY_RATE_WINDOW]
+    rate = readings.rate(HISTORY_RATE_WINDOW)
+    if abs(current - setpoint) <= STABLE_TOLERANCE and recent.max() - recent.min() <= STABLE_TOLERANCE:
+        parts.append(f"stable at the setpoint of {setpoint} °C")
+    elif rate is None or abs(rate) <= STEADY_RATE:
+        parts.append(f"currently {current:.1f} °C and not moving, the setpoint is {setpoint} °C")
+    else:
+        trend = f"{'heating' if rate > 0 else 'cooling'} at {abs(rate) * 60:.2f} °C per minute"
+        if (setpoint - current) * rate > 0:
+            parts.append(f"{trend}, the setpoint of {setpoint} °C should be reached in about {_duration((setpoint - current) / rate)}")
+        else:
+            parts.append(f"{trend}, away from the setpoint of {setpoint} °C")
+
+    result_text = "; ".join(parts) + "."
+    return ToolResult(result_text[0].upper() + result_text[1:], ToolResultDirection.TO_SERVER)
+
+def attach_machine_tools(rtmt: RTMiddleTier,
+    store: Optional[MachineStateStore] = None,
+    history_size: int = 3600,
+    device: Optional[MachineDevice] = None,
+    poll_interval: float = 1.0,
+    push_min_interval: float = 1.0
+    ) -> MachineStateStore:
+    """
+    Attach the machine tools, by default over the simulated state above. The store is shared by all sessions,
+    and the last history_size temperature updates are kept for machine_get_history.
+
+    With a device, the store is refreshed from it every poll_interval seconds in the background and setpoints
+    are written to it through a queue, tools never wait on a device read. Without one, the current temperatures
+    are recorded into the history every poll_interval seconds.
+
+    Clients can subscribe to state changes, pushed at most every push_min_interval seconds (see MachineStatePublisher).
+    """
+    store = store or MachineStateStore.from_state(current_junior_state)
+    history = MachineHistory(len(store), history_size)
+    history.on_snapshot(store.snapshot)
+    store.listeners.append(history.on_snapshot)
+
+    write_setpoints: SetpointWriter = store.set_setpoints
+    if device is not None:
+        poller = MachinePoller(store, device, poll_interval)
+        rtmt.cleanup_ctx.append(poller.cleanup_ctx())
+        write_setpoints = poller.set_setpoints
+    else:
+        # Nothing refreshes the temperatures, sample them so the history keeps covering the recent window
+        rtmt.cleanup_ctx.append(MachineHistorySampler(store, history, poll_interval).cleanup_ctx())
+
+    MachineStatePublisher(store, push_min_interval).attach(rtmt)
     rtmt.tools["machine_get_status"] = Tool(
-        schema=_machine_get_status_schema, target=lambda args: _machine_get_status(args)
+        schema=_machine_get_status_schema, target=lambda args: _machine_get_status(store, args)
     )
     rtmt.tools["machine_set_values"] = Tool(
-        schema=_machine_set_values_schema, target=lambda args: _machine_set_values(args)
-    )
\ No newline at end of file
+        schema=_machine_set_values_schema, target=lambda args: _machine_set_values(store, write_setpoints, args)
+    )
+    rtmt.tools["machine_get_decks_status"] = Tool(
+        schema=_machine_get_decks_status_schema, target=lambda args: _machine_get_decks_status(store, args)
+    )
+    rtmt.tools["machine_set_setpoints"] = Tool(
+        schema=_machine_set_setpoints_schema, target=lambda args: _machine_set_setpoints(store, write_setpoints, args)
+    )
+    rtmt.tools["machine_get_history"] = Tool(
+        schema=_machine_get_history_schema, target=lambda args: _machine_get_history(store, history, args)
+    )
+    rtmt.tools["machine_find_deviations"] = Tool(
+        schema=_machine_find_deviations_schema, target=lambda args: _machine_find_deviations(store, history, args)
+    )
+    return store
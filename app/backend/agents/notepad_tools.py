@@ -1,10 +1,12 @@
+import asyncio
 import logging
 import os
-from typing import Any
-import aiohttp
+from pathlib import Path
+from typing import Any, Optional
 
-from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
-from utils import decode_url_string, is_float
+from retrieval import FileNameIndex
+from rtmt import RTMiddleTier, RTSession, Tool, ToolResult, ToolResultDirection
+from utils import DurableQueue, ToolHttpClient, WriteBehindQueue, is_float
 
 logger = logging.getLogger("voiceassistant")
 temperature_param = "temperature"
@@ -72,29 +74,43 @@ _notepad_get_file_name_schema = {
     }
 }
 
-async def _save_note(args: Any) -> ToolResult:
+async def _append_notes(http_client: ToolHttpClient, base_url: str, append_file_content_url: str, file_name: str, texts: list[str]) -> None:
     """
-    Save the note provided by the user on a file related to the current session.
+    Append the notes queued for a file in a single request, one note per line.
+    """
+    async with http_client.post(
+        "notepad_save_note",
+        append_file_content_url,
+        json={
+            "baseUrl": base_url,
+            "fileName": file_name,
+            "text": "\n".join(texts)
+        }
+    ) as response:
+        response.raise_for_status()
+
+async def _save_note(notes: WriteBehindQueue, file_names: FileNameIndex, args: Any) -> ToolResult:
+    """
+    Save the note provided by the user on a file related to the current session. The note is spooled
+    locally and appended to the file in the background, so the answer doesn't wait for the Logic App.
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                # Decode the API URL from environment variable in case it's base64 encoded
-                decode_url_string(os.environ.get("NOTEPAD_APPEND_FILE_CONTENT_API_URL")),
-                json={
-                    "baseUrl": os.environ.get("NOTEPAD_BASE_URL"),
-                    "fileName": f"{args["session_id"]}.txt", # the session ID is used as the file name
-                    "text": args["text"]
-                }
-            ) as response:
-                response.raise_for_status()
-            return ToolResult(f"Note saved successfully", ToolResultDirection.TO_SERVER)
+        text = args["text"]
+        # the session ID is used as the file name
+        file_name = f"{args['session_id']}.txt"
+        await notes.put(file_name, text, len(text.encode()))
+        file_names.add(file_name)
+        return ToolResult(f"Note saved successfully", ToolResultDirection.TO_SERVER)
     except Exception as e:
-        logger.error(f"An error occurred while modifying the file: {str(e)}")
-        return ToolResult(f"An error occurred while modifying the file. Please try again later.", ToolResultDirection.TO_SERVER)
+        logger.error(f"An error occurred while saving the note: {str(e)}")
+        return ToolResult(f"An error occurred while saving the note. Please try again later.", ToolResultDirection.TO_SERVER)
+
+async def _flush_session_notes(notes: WriteBehindQueue, session: RTSession) -> None:
+    if session.session_id:
+        notes.flush(f"{session.session_id}.txt")
 
 
-async def _modify_text_file(args: Any) -> ToolResult:
+async def _modify_text_file(http_client: ToolHttpClient, base_url: str, replace_file_content_url: str, args: Any) -> ToolResult:
     """
     Modify a text file by replacing all occurrences of oldText with newText.
     """
@@ -122,47 +138,99 @@ async def _modify_text_file(args: Any) -> ToolResult:
             return ToolResult("No valid parameter provided for temperature and hours. Please retry", ToolResultDirection.TO_SERVER)
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                # Decode the API URL from environment variable in case it's base64 encoded
-                decode_url_string(os.environ.get("NOTEPAD_REPLACE_FILE_CONTENT_API_URL")),
-                json={
-                    "filePath": f"{os.environ.get('NOTEPAD_BASE_URL')}/{args['fileName']}",
-                    "oldText": oldText,
-                    "newText": newText
-                }
-            ) as response:
-                response.raise_for_status()
+        async with http_client.post(
+            "notepad_modify_file",
+            replace_file_content_url,
+            json={
+                "filePath": f"{base_url}/{args['fileName']}",
+                "oldText": oldText,
+                "newText": newText
+            }
+        ) as response:
+            response.raise_for_status()
         return ToolResult(f"File modified successfully", ToolResultDirection.TO_SERVER)
     except Exception as e:
         logger.error(f"An error occurred while modifying the file: {str(e)}")
         return ToolResult(f"An error occurred while modifying the file: {str(e)}", ToolResultDirection.TO_SERVER)
     
-async def _get_file_name(args: Any) -> ToolResult:
+async def _list_file_names(http_client: ToolHttpClient, base_url: str, list_files_url: Optional[str]) -> list[str]:
+    """
+    Names of the files under the base URL, listed by the Logic App or, for a local folder, read from disk.
     """
-    Get the file name of a text file using the input provided by the user.
+    if not list_files_url:
+        return await asyncio.to_thread(lambda: [entry.name for entry in os.scandir(base_url) if entry.is_file()])
+    async with http_client.post(
+        "notepad_list_files",
+        list_files_url,
+        json={
+            "baseUrl": base_url
+        }
+    ) as response:
+        response.raise_for_status()
+        data = await response.json()
+        return data["fileNames"]
+
+async def _get_file_name(http_client: ToolHttpClient, file_names: FileNameIndex, base_url: str, get_file_name_url: str, args: Any) -> ToolResult:
     """
+    Get the file name of a text file using the input provided by the user. The local index of the file
+    names answers when a single file matches, the Logic App is only called on a miss or an ambiguity.
+    """
+    if (file_name := file_names.resolve(args["text"])) is not None:
+        return ToolResult(file_name, ToolResultDirection.TO_SERVER)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                # Decode the API URL from environment variable in case it's base64 encoded
-                decode_url_string(os.environ.get("NOTEPAD_GET_FILE_NAME_API_URL")),
-                json={
-                    "baseUrl": os.environ.get("NOTEPAD_BASE_URL"),
-                    "text": args["text"].lower()
-                }
-            ) as response:
-                response.raise_for_status()
-                data = await response.json()
-                if not data or "fileName" not in data or data["fileName"] == None:
-                    return ToolResult("No file name found. Please retry", ToolResultDirection.TO_SERVER)
-                return ToolResult(data["fileName"], ToolResultDirection.TO_SERVER)
+        async with http_client.post(
+            "notepad_get_file_name",
+            get_file_name_url,
+            json={
+                "baseUrl": base_url,
+                "text": args["text"].lower()
+            }
+        ) as response:
+            response.raise_for_status()
+            data = await response.json()
+            if not data or "fileName" not in data or data["fileName"] == None:
+                return ToolResult("No file name found. Please retry", ToolResultDirection.TO_SERVER)
+            if file_names.complete and data["fileName"] not in file_names:
+                # The listing is stale, the file was created since
+                file_names.refresh_soon()
+            file_names.remember(args["text"], data["fileName"])
+            return ToolResult(data["fileName"], ToolResultDirection.TO_SERVER)
     except Exception as e:
         logger.error(f"An error occurred while retrieving the file name: {str(e)}")
         return ToolResult(f"An error occurred while retrieving the file name. Please try again later.", ToolResultDirection.TO_SERVER)
 
     
-def attach_notepad_tools(rtmt: RTMiddleTier) -> None:
-    rtmt.tools["notepad_modify_file"] = Tool(schema=_notepad_modify_file_schema, target=lambda args: _modify_text_file(args))
-    rtmt.tools["notepad_get_file_name"] = Tool(schema=_notepad_get_file_name_schema, target=lambda args: _get_file_name(args))
-    rtmt.tools["notepad_save_note"] = Tool(schema=_notepad_save_note_name_schema, target=lambda args: _save_note(args))
\ No newline at end of file
+def attach_notepad_tools(rtmt: RTMiddleTier,
+    http_client: ToolHttpClient,
+    base_url: str,
+    append_file_content_url: str,
+    replace_file_content_url: str,
+    get_file_name_url: str,
+    spool_path: Path | str = ".spool/notepad.db",
+    flush_delay: float = 2.0,
+    flush_bytes: int = 4096,
+    list_files_url: Optional[str] = None,
+    file_names_refresh_interval: float = 300.0
+    ) -> None:
+    # Notes are appended by a write-behind queue: consecutive notes of a session go out in one request after
+    # flush_delay seconds, once flush_bytes are queued or when the session closes
+    notes = WriteBehindQueue(
+        DurableQueue(spool_path),
+        deliver=lambda file_name, texts: _append_notes(http_client, base_url, append_file_content_url, file_name, texts),
+        max_delay=flush_delay,
+        max_bytes=flush_bytes)
+    rtmt.cleanup_ctx.append(notes.cleanup_ctx())
+    rtmt.session_closed_listeners.append(lambda session: _flush_session_notes(notes, session))
+    rtmt.metrics.gauge("notepad_notes_queued", "Notes saved and not appended to their file yet.", lambda: len(notes))
+    rtmt.metrics.gauge("notepad_notes_dropped_total", "Notes the Logic App rejected for good, not appended.", lambda: notes.dropped, "counter")
+    # File names are listed with the Logic App if there is one, or from disk if the base URL is a local folder.
+    # Otherwise the index only remembers the names the Logic App resolved
+    list_names = None
+    if list_files_url or (base_url and os.path.isdir(base_url)):
+        list_names = lambda: _list_file_names(http_client, base_url, list_files_url)
+    file_names = FileNameIndex(list_names, refresh_interval=file_names_refresh_interval)
+    rtmt.cleanup_ctx.append(file_names.cleanup_ctx())
+    rtmt.metrics.gauge("notepad_file_names_local_total", "File name lookups answered by the local index.", lambda: file_names.hits, "counter")
+    rtmt.tools["notepad_modify_file"] = Tool(schema=_notepad_modify_file_schema, target=lambda args: _modify_text_file(http_client, base_url, replace_file_content_url, args))
+    rtmt.tools["notepad_get_file_name"] = Tool(schema=_notepad_get_file_name_schema, target=lambda args: _get_file_name(http_client, file_names, base_url, get_file_name_url, args))
+    rtmt.tools["notepad_save_note"] = Tool(schema=_notepad_save_note_name_schema, target=lambda args: _save_note(notes, file_names, args))
\ No newline at end of file
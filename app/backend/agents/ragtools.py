@@ -1,12 +1,21 @@
+import asyncio
+import logging
 import re
-from typing import Any
+import time
+from typing import Any, Optional
 
+from aiohttp import web
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError
 from azure.identity import DefaultAzureCredential
 from azure.search.documents.aio import SearchClient
-from azure.search.documents.models import VectorizableTextQuery
+from azure.search.documents.indexes.aio import SearchIndexerClient
 
-from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+from retrieval import AzureSearchBackend, Chunk, RetrievalBackend, format_chunks, pack_chunks
+from rtmt import RTMiddleTier, RTSession, Tool, ToolResult, ToolResultDirection, get_current_session
+from utils import AsyncTokenManager, TTLCache
+
+logger = logging.getLogger("voiceassistant")
 
 _search_tool_schema = {
     "type": "function",
@@ -47,70 +56,262 @@ _grounding_tool_schema = {
     }
 }
 
+# Chunks returned by each search
+SEARCH_TOP = 5
+
+class SearchResultCache(TTLCache[tuple, list[Chunk]]):
+    """Search results keyed on the normalized query and the search options, with hit/miss counters."""
+    # Time spent on the backend queries of cache misses, used to estimate the latency saved by hits
+    query_seconds: float = 0.0
+    queries: int = 0
+
+    def record_query(self, seconds: float) -> None:
+        self.query_seconds += seconds
+        self.queries += 1
+
+    def estimated_saved_seconds(self) -> float:
+        return self.hits * self.query_seconds / self.queries if self.queries > 0 else 0.0
+
+_QUERY_NOISE_PATTERN = re.compile(r"[^\w\s.]+")
+
+def _normalize_query(query: str) -> str:
+    # "What's the next step?" and "what's the next step" are the same question
+    # Dots are kept for decimals ("2.5 ml") but not at the end of a word
+    return " ".join(word.strip(".") for word in _QUERY_NOISE_PATTERN.sub(" ", query.lower()).split())
+
+# Words that don't tell two experiment questions apart
+_STOPWORDS = frozenset("a about an and are at be can could do does for from give how i in is it me my of on or please "
+                       "should tell the to we what when where which with would you".split())
+
+def _content_words(text: str) -> frozenset[str]:
+    return frozenset(word for word in _normalize_query(text).split() if word not in _STOPWORDS)
+
+class _Prefetch:
+    words: frozenset[str]
+    task: asyncio.Task
+    used: bool
+
+    def __init__(self, words: frozenset[str], task: asyncio.Task):
+        self.words = words
+        self.task = task
+        self.used = False
+
+class SpeculativePrefetcher:
+    """
+    Starts the search for what the user just said as soon as its transcript arrives, since for experiment
+    questions the model almost always calls the search tool with a paraphrase of it right afterwards. A search
+    call whose query is similar enough to a prefetched transcript is then answered with the prefetched results.
+    """
+    # Fraction of the query's content words that must appear in the transcript
+    similarity: float
+    # Prefetches kept per session, older unused ones count as wasted
+    max_per_session: int
+    started: int = 0
+    hits: int = 0
+    misses: int = 0
+    wasted: int = 0
+
+    def __init__(self, backend: RetrievalBackend, similarity: float = 0.6, max_per_session: int = 2):
+        self.backend = backend
+        self.similarity = similarity
+        self.max_per_session = max_per_session
+
+    def on_transcript(self, session: RTSession, transcript: str) -> None:
+        words = _content_words(transcript)
+        if len(words) < 2:
+            # "yes", "go on", "stop"... not worth a search
+            return
+        prefetches: list[_Prefetch] = session.tool_context.setdefault("search_prefetches", [])
+        while len(prefetches) >= self.max_per_session:
+            self._retire(prefetches.pop(0))
+        prefetches.append(_Prefetch(words, session.run_in_background(self._search(transcript))))
+        self.started += 1
+
+    async def take(self, query: str) -> Optional[list[Chunk]]:
+        """Prefetched results for a query similar enough to a recent transcript of the current session, if any."""
+        session = get_current_session()
+        prefetches: list[_Prefetch] = session.tool_context.get("search_prefetches", []) if session is not None else []
+        words = _content_words(query)
+        candidates = [prefetch for prefetch in prefetches if not prefetch.task.cancelled()]
+        best = max(candidates, key=lambda p: self._similarity(words, p.words), default=None)
+        rows = None
+        if best is not None and self._similarity(words, best.words) >= self.similarity:
+            # Used prefetches aren't retired, so a newer transcript can't cancel the search we're waiting for
+            best.used = True
+            try:
+                rows = await asyncio.shield(best.task)
+            except asyncio.CancelledError:
+                if not best.task.cancelled():
+                    # The tool call itself was cancelled
+                    raise
+                # Retired anyway, e.g. the session is closing, the caller searches normally
+        if rows is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logger.info("Search prefetch hit (%d hits, %d misses, %d wasted of %d started)", self.hits, self.misses, self.wasted, self.started)
+        return rows
+
+    async def on_session_closed(self, session: RTSession) -> None:
+        for prefetch in session.tool_context.get("search_prefetches", []):
+            self._retire(prefetch)
+
+    @staticmethod
+    def _similarity(query_words: frozenset[str], transcript_words: frozenset[str]) -> float:
+        return len(query_words & transcript_words) / len(query_words) if query_words else 0.0
+
+    def _retire(self, prefetch: _Prefetch) -> None:
+        if not prefetch.used:
+            self.wasted += 1
+            prefetch.task.cancel()
+
+    async def _search(self, transcript: str) -> Optional[list[Chunk]]:
+        try:
+            return await self.backend.search(transcript, top=SEARCH_TOP)
+        except Exception as e:
+            logger.warning(f"Speculative search failed: {e}")
+            return None
+
+# Bound on the chunks each session remembers for report_grounding, a few turns worth of search results
+SESSION_CHUNKS_SIZE = 50
+
+def _session_chunks() -> Optional[TTLCache[str, Chunk]]:
+    """Chunks recently returned by the search tool in the current session, keyed by identifier."""
+    session = get_current_session()
+    if session is None:
+        return None
+    return session.tool_context.setdefault("search_chunks", TTLCache(max_size=SESSION_CHUNKS_SIZE, ttl=30 * 60))
+
 async def _search_tool(
-    search_client: SearchClient, 
-    semantic_configuration: str | None,
-    identifier_field: str,
-    content_field: str,
-    embedding_field: str,
-    use_vector_query: bool,
+    backend: RetrievalBackend, 
+    cache: SearchResultCache,
+    prefetcher: Optional[SpeculativePrefetcher],
+    context_token_budget: int,
     args: Any) -> ToolResult:
     print(f"Searching for '{args['query']}' in the knowledge base.")
-    # Hybrid query using Azure AI Search with (optional) Semantic Ranker
-    vector_queries = []
-    if use_vector_query:
-        vector_queries.append(VectorizableTextQuery(text=args['query'], k_nearest_neighbors=50, fields=embedding_field))
-    search_results = await search_client.search(
-        search_text=args["query"], 
-        query_type="semantic" if semantic_configuration else "simple",
-        semantic_configuration_name=semantic_configuration,
-        top=5,
-        vector_queries=vector_queries,
-        select=", ".join([identifier_field, content_field])
-    )
-    result = ""
-    async for r in search_results:
-        result += f"[{r[identifier_field]}]: {r[content_field]}\n-----\n"
-    return ToolResult(result, ToolResultDirection.TO_SERVER)
+    cache_key = (_normalize_query(args["query"]), backend.options_key())
+    rows = cache.get(cache_key)
+    if rows is not None:
+        logger.info("Search cache hit (%d hits, %d misses, ~%.1f s saved)", cache.hits, cache.misses, cache.estimated_saved_seconds())
+    else:
+        rows = await prefetcher.take(args["query"]) if prefetcher is not None else None
+        if rows is None:
+            started = time.perf_counter()
+            rows = await backend.search(args["query"], top=SEARCH_TOP)
+            cache.record_query(time.perf_counter() - started)
+        cache.put(cache_key, rows)
+    session_chunks = _session_chunks()
+    if session_chunks is not None:
+        for chunk in rows:
+            session_chunks.put(chunk[0], chunk)
+    # Overlapping pages and anything past the budget only delay the model's answer
+    return ToolResult(format_chunks(pack_chunks(rows, context_token_budget)), ToolResultDirection.TO_SERVER)
+
+# Indexer status errors that won't go away by retrying: the indexer doesn't exist or can't be read
+_INDEXER_STATUS_PERMANENT_ERRORS = (403, 404)
+
+def _invalidate_on_indexer_run(indexer_client: SearchIndexerClient, indexer_name: str, cache: SearchResultCache, interval: float,
+                               max_retry_interval: float = 10 * 60):
+    """
+    Clears the cache whenever the indexer (see setup_intvect.py) completes a new run. Failed status reads are
+    retried with exponential backoff up to max_retry_interval seconds, a run completed meanwhile is noticed
+    once the status can be read again.
+    """
+    async def watch():
+        last_run = None
+        failures = 0
+        while True:
+            try:
+                status = await indexer_client.get_indexer_status(indexer_name)
+            except Exception as e:
+                if isinstance(e, HttpResponseError) and e.status_code in _INDEXER_STATUS_PERMANENT_ERRORS:
+                    logger.warning(f"Can't read the status of indexer {indexer_name}, search results will only expire by TTL: {e}")
+                    return
+                failures += 1
+                delay = min(max_retry_interval, interval * 2 ** (failures - 1))
+                logger.warning(f"Can't read the status of indexer {indexer_name}, retrying in {delay:.0f} s: {e}")
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            run = status.last_result.end_time if status.last_result is not None else None
+            if last_run is not None and run != last_run:
+                logger.info("Indexer %s ran again, clearing %d cached search results", indexer_name, len(cache))
+                cache.clear()
+            last_run = run
+            await asyncio.sleep(interval)
+
+    async def cleanup_ctx(app: web.Application):
+        task = asyncio.create_task(watch())
+        yield
+        task.cancel()
+        await indexer_client.close()
+    return cleanup_ctx
 
 KEY_PATTERN = re.compile(r'^[a-zA-Z0-9_=\-]+$')
 
 # TODO: move from sending all chunks used for grounding eagerly to only sending links to 
 # the original content in storage, it'll be more efficient overall
-async def _report_grounding_tool(search_client: SearchClient, identifier_field: str, title_field: str, content_field: str, args: Any) -> None:
+async def _report_grounding_tool(backend: RetrievalBackend, args: Any) -> None:
     sources = [s for s in args["sources"] if KEY_PATTERN.match(s)]
-    list = " OR ".join(sources)
-    print(f"Grounding source: {list}")
-    # Use search instead of filter to align with how detailt integrated vectorization indexes
-    # are generated, where chunk_id is searchable with a keyword tokenizer, not filterable 
-    search_results = await search_client.search(search_text=list, 
-                                                search_fields=[identifier_field], 
-                                                select=[identifier_field, title_field, content_field], 
-                                                top=len(sources), 
-                                                query_type="full")
-    
-    # If your index has a key field that's filterable but not searchable and with the keyword analyzer, you can 
-    # use a filter instead (and you can remove the regex check above, just ensure you escape single quotes)
-    # search_results = await search_client.search(filter=f"search.in(chunk_id, '{list}')", select=["chunk_id", "title", "chunk"])
+    print(f"Grounding source: {' OR '.join(sources)}")
+    # Sources are normally chunks the search tool just returned in this session, only go back to the index for the others
+    session_chunks = _session_chunks()
+    found: dict[str, Chunk] = {}
+    if session_chunks is not None:
+        for source in sources:
+            chunk = session_chunks.get(source)
+            if chunk is not None:
+                found[source] = chunk
+    missing = [s for s in sources if s not in found]
+    if missing:
+        for chunk in await backend.get_chunks(missing):
+            found[chunk[0]] = chunk
 
     docs = []
-    async for r in search_results:
-        docs.append({"chunk_id": r[identifier_field], "title": r[title_field], "chunk": r[content_field]})
+    for source in sources:
+        if source in found:
+            identifier, title, content = found[source]
+            docs.append({"chunk_id": identifier, "title": title, "chunk": content})
     return ToolResult({"sources": docs}, ToolResultDirection.TO_CLIENT)
 
 def attach_rag_tools(rtmt: RTMiddleTier,
-    credentials: AzureKeyCredential | DefaultAzureCredential,
-    search_endpoint: str, search_index: str,
+    credentials: AzureKeyCredential | DefaultAzureCredential | AsyncTokenManager | None,
+    search_endpoint: str | None, search_index: str | None,
     semantic_configuration: str | None,
     identifier_field: str,
     content_field: str,
     embedding_field: str,
     title_field: str,
-    use_vector_query: bool
+    use_vector_query: bool,
+    search_indexer: str | None = None,
+    cache_size: int = 256,
+    cache_ttl: float = 10 * 60,
+    indexer_check_interval: float = 60.0,
+    backend: RetrievalBackend | None = None,
+    speculative_prefetch: bool = False,
+    context_token_budget: int = 1500
     ) -> None:
-    if not isinstance(credentials, AzureKeyCredential):
-        credentials.get_token("https://search.azure.com/.default") # warm this up before we start getting requests
-    search_client = SearchClient(search_endpoint, search_index, credentials, user_agent="RTMiddleTier")
+    """Attach the search and report_grounding tools, backed by Azure AI Search unless another backend is given."""
+    cache = SearchResultCache(max_size=cache_size, ttl=cache_ttl)
+    if backend is None:
+        if not isinstance(credentials, AzureKeyCredential):
+            # The aio SearchClient needs an async credential, which also keeps token refreshes off the event loop
+            if not isinstance(credentials, AsyncTokenManager):
+                credentials = AsyncTokenManager(credentials)
+            credentials.warm_up("https://search.azure.com/.default") # warm this up before we start getting requests
+        search_client = SearchClient(search_endpoint, search_index, credentials, user_agent="RTMiddleTier")
+        backend = AzureSearchBackend(search_client, semantic_configuration, identifier_field, title_field, content_field, embedding_field, use_vector_query)
+        if search_indexer:
+            indexer_client = SearchIndexerClient(search_endpoint, credentials, user_agent="RTMiddleTier")
+            rtmt.cleanup_ctx.append(_invalidate_on_indexer_run(indexer_client, search_indexer, cache, indexer_check_interval))
+
+    prefetcher = None
+    if speculative_prefetch:
+        prefetcher = SpeculativePrefetcher(backend)
+        rtmt.transcription_listeners.append(prefetcher.on_transcript)
+        rtmt.session_closed_listeners.append(prefetcher.on_session_closed)
 
-    rtmt.tools["search"] = Tool(schema=_search_tool_schema, target=lambda args: _search_tool(search_client, semantic_configuration, identifier_field, content_field, embedding_field, use_vector_query, args))
-    rtmt.tools["report_grounding"] = Tool(schema=_grounding_tool_schema, target=lambda args: _report_grounding_tool(search_client, identifier_field, title_field, content_field, args))
\ No newline at end of file
+    rtmt.metrics.gauge("search_cache_hits_total", "Searches answered from the result cache.", lambda: cache.hits, "counter")
+    rtmt.metrics.gauge("search_cache_misses_total", "Searches sent to the search backend.", lambda: cache.misses, "counter")
+    rtmt.tools["search"] = Tool(schema=_search_tool_schema, target=lambda args: _search_tool(backend, cache, prefetcher, context_token_budget, args))
+    rtmt.tools["report_grounding"] = Tool(schema=_grounding_tool_schema, target=lambda args: _report_grounding_tool(backend, args))
\ No newline at end of file
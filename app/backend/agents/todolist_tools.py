@@ -1,10 +1,11 @@
+import hashlib
 import logging
-import os
+import re
+from pathlib import Path
 from typing import Any
-import aiohttp
 
-from utils import decode_url_string
-from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+from utils import DurableQueue, PartialDeliveryError, ToolHttpClient, WriteBehindQueue
+from rtmt import RTMiddleTier, RTSession, Tool, ToolResult, ToolResultDirection
 
 logger = logging.getLogger("voiceassistant")
 
@@ -28,28 +29,69 @@ _todolist_create_task_name_schema = {
     }
 }
 
-async def _create_task(args: Any) -> ToolResult:
+def _idempotency_key(task_list: str, text: str) -> str:
     """
-    Create a task based on the input provided by the user on a Google Task related to the current session.
+    Same key for the same task dictated again in the session, e.g. when the model retries the tool call.
     """
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                # Decode the API URL from environment variable in case it's base64 encoded
-                decode_url_string(os.environ.get("TODOLIST_CREATE_TASK_API_URL")),
+    normalized = " ".join(re.findall(r"\w+", text.lower()))
+    return hashlib.sha256(f"{task_list}\n{normalized}".encode()).hexdigest()
+
+async def _deliver_tasks(http_client: ToolHttpClient, create_task_url: str, task_list: str, tasks: list[dict[str, str]]) -> None:
+    """
+    Create the tasks queued for a task list, one request each as the Logic App creates a single task.
+    """
+    for delivered, task in enumerate(tasks):
+        try:
+            async with http_client.post(
+                "todolist_create_task",
+                create_task_url,
+                headers={"Idempotency-Key": task["idempotency_key"]},
                 json={
-                    "taskList": args["session_id"], # the session ID is used as task list name
+                    "taskList": task_list,
                     "taskTitle": "Created by Glovebox Assistant",
-                    "taskText": args["text"]
+                    "taskText": task["text"]
                 }
             ) as response:
                 response.raise_for_status()
-            return ToolResult(f"Task created successfully", ToolResultDirection.TO_SERVER)
+        except Exception as e:
+            raise PartialDeliveryError(delivered, e) from e
+
+async def _create_task(outbox: WriteBehindQueue, args: Any) -> ToolResult:
+    """
+    Create a task based on the input provided by the user on a Google Task related to the current session.
+    The task is queued in a local outbox and created in the background, so the answer doesn't wait for the
+    Logic App.
+    """
+    try:
+        task_list = args["session_id"] # the session ID is used as task list name
+        idempotency_key = _idempotency_key(task_list, args["text"])
+        queued = await outbox.put(task_list, {"text": args["text"], "idempotency_key": idempotency_key}, dedupe_key=idempotency_key)
+        if not queued:
+            return ToolResult(f"This task was already created, it won't be created twice", ToolResultDirection.TO_SERVER)
+        return ToolResult(f"Task created successfully", ToolResultDirection.TO_SERVER)
     except Exception as e:
         logger.error(f"An error occurred while creating the task: {str(e)}")
         return ToolResult(f"An error occurred while creating the task. Please try again later.", ToolResultDirection.TO_SERVER)
 
+async def _flush_session_tasks(outbox: WriteBehindQueue, session: RTSession) -> None:
+    if session.session_id:
+        outbox.flush(session.session_id)
+
     
 def attach_todolist_tools(
-        rtmt: RTMiddleTier) -> None:
-    rtmt.tools["todolist_create_task"] = Tool(schema=_todolist_create_task_name_schema, target=lambda args: _create_task(args))
\ No newline at end of file
+        rtmt: RTMiddleTier,
+        http_client: ToolHttpClient,
+        create_task_url: str,
+        outbox_path: Path | str = ".spool/todolist.db",
+        flush_delay: float = 1.0) -> None:
+    # Tasks go through a durable outbox: the tasks dictated for a task list within flush_delay seconds are
+    # delivered together, retried with backoff, and a task dictated twice is only created once
+    outbox = WriteBehindQueue(
+        DurableQueue(outbox_path),
+        deliver=lambda task_list, tasks: _deliver_tasks(http_client, create_task_url, task_list, tasks),
+        max_delay=flush_delay)
+    rtmt.cleanup_ctx.append(outbox.cleanup_ctx())
+    rtmt.session_closed_listeners.append(lambda session: _flush_session_tasks(outbox, session))
+    rtmt.metrics.gauge("todolist_tasks_queued", "Tasks in the outbox not created yet.", lambda: len(outbox))
+    rtmt.metrics.gauge("todolist_tasks_dropped_total", "Tasks the Logic App rejected for good, not created.", lambda: outbox.dropped, "counter")
+    rtmt.tools["todolist_create_task"] = Tool(schema=_todolist_create_task_name_schema, target=lambda args: _create_task(outbox, args))
\ No newline at end of file
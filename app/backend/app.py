@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 from pathlib import Path
@@ -8,12 +9,17 @@ from azure.identity import AzureDeveloperCliCredential, DefaultAzureCredential
 from dotenv import load_dotenv
 
 from agents.ragtools import attach_rag_tools
-from agents.machine_tools import attach_machine_tools
+from agents.machine_tools import attach_machine_tools, current_junior_state
 from agents.calculator_tools import attach_calculator_tools
 from agents.notepad_tools import attach_notepad_tools
 from agents.todolist_tools import attach_todolist_tools
+from capture import SessionRecorder
+from machine import MachineStateStore, SimulatedDevice
+from retrieval import LocalIndex
 from rtmt import RTMiddleTier
+from tracing import FileSpanExporter, OtlpHttpSpanExporter, TurnTracer
 from speech_service import get_speech_token
+from utils import AsyncTokenManager, EventLoopLagMonitor, ToolHttpClient, decode_url_string
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("voiceassistant")
@@ -35,16 +41,34 @@ async def create_app():
         else:
             logger.info("Using DefaultAzureCredential")
             credential = DefaultAzureCredential()
-    llm_credential = AzureKeyCredential(llm_key) if llm_key else credential
-    search_credential = AzureKeyCredential(search_key) if search_key else credential
+    # A single token manager serves both the realtime and the search paths without blocking the event loop
+    token_manager = AsyncTokenManager(credential) if credential is not None else None
+    llm_credential = AzureKeyCredential(llm_key) if llm_key else token_manager
+    search_credential = AzureKeyCredential(search_key) if search_key else token_manager
     
     app = web.Application()
+    if token_manager is not None:
+        app.on_cleanup.append(lambda _: token_manager.close())
+
+    # Pooled HTTP client shared by the tools calling the Logic Apps, closed with the app
+    http_client = ToolHttpClient(
+        default_timeout=15.0,
+        tool_timeouts={
+            "notepad_get_file_name": 10.0,
+            "notepad_list_files": 10.0,
+            "notepad_save_note": 20.0,
+            "notepad_modify_file": 20.0,
+            "todolist_create_task": 20.0,
+        })
+    app.cleanup_ctx.append(http_client.cleanup_ctx)
 
     rtmt = RTMiddleTier(
         credentials=llm_credential,
         endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
         deployment=os.environ["AZURE_OPENAI_REALTIME_DEPLOYMENT"],
-        voice_choice=os.environ.get("AZURE_OPENAI_REALTIME_VOICE_CHOICE") or "alloy"
+        voice_choice=os.environ.get("AZURE_OPENAI_REALTIME_VOICE_CHOICE") or "alloy",
+        upstream_pool_size=int(os.environ.get("AZURE_OPENAI_REALTIME_POOL_SIZE") or 1),
+        upstream_max_idle_age=float(os.environ.get("AZURE_OPENAI_REALTIME_POOL_MAX_IDLE_SECONDS") or 300)
         )
     rtmt.system_message = """
         You are a helpful assistant helping scientists when they are working in a lab using a glovebox machine. When asking to retrieve data about an experiment, only answer questions based on information you searched in the knowledge base, accessible with the 'search' tool. 
@@ -62,6 +86,12 @@ async def create_app():
     """.strip()
 
     # attach RAG agent
+    search_backend = None
+    if os.environ.get("SEARCH_BACKEND") == "local":
+        # In-process index of the experiment documents instead of Azure AI Search, for labs with poor connectivity
+        search_backend = await asyncio.to_thread(LocalIndex.load_or_build,
+            data_dir=Path(os.environ.get("LOCAL_SEARCH_DATA_DIR") or Path(__file__).parent / "../../data"),
+            index_dir=Path(os.environ.get("LOCAL_SEARCH_INDEX_DIR") or Path(__file__).parent / ".local_index"))
     attach_rag_tools(rtmt,
         credentials=search_credential,
         search_endpoint=os.environ.get("AZURE_SEARCH_ENDPOINT"),
@@ -71,27 +101,80 @@ async def create_app():
         content_field=os.environ.get("AZURE_SEARCH_CONTENT_FIELD") or "chunk",
         embedding_field=os.environ.get("AZURE_SEARCH_EMBEDDING_FIELD") or "text_vector",
         title_field=os.environ.get("AZURE_SEARCH_TITLE_FIELD") or "title",
-        use_vector_query=(os.environ.get("AZURE_SEARCH_USE_VECTOR_QUERY") == "true") or True
+        use_vector_query=(os.environ.get("AZURE_SEARCH_USE_VECTOR_QUERY") == "true") or True,
+        # setup_intvect.py names the indexer after the index
+        search_indexer=os.environ.get("AZURE_SEARCH_INDEXER") or os.environ.get("AZURE_SEARCH_INDEX"),
+        cache_size=int(os.environ.get("AZURE_SEARCH_CACHE_SIZE") or 256),
+        cache_ttl=float(os.environ.get("AZURE_SEARCH_CACHE_TTL_SECONDS") or 600),
+        backend=search_backend,
+        speculative_prefetch=os.environ.get("SEARCH_SPECULATIVE_PREFETCH") == "true",
+        context_token_budget=int(os.environ.get("SEARCH_CONTEXT_TOKEN_BUDGET") or 1500)
         )
 
     # attach Machine agent
-    attach_machine_tools(rtmt)
+    machine_store = MachineStateStore.from_state(current_junior_state)
+    machine_device = None
+    if os.environ.get("MACHINE_DEVICE") == "simulated":
+        machine_device = SimulatedDevice.from_snapshot(
+            machine_store.snapshot,
+            latency=float(os.environ.get("MACHINE_SIMULATED_LATENCY_SECONDS") or 0.2)
+            )
+    attach_machine_tools(
+        rtmt,
+        machine_store,
+        history_size=int(os.environ.get("MACHINE_HISTORY_SIZE") or 3600),
+        device=machine_device,
+        poll_interval=float(os.environ.get("MACHINE_POLL_INTERVAL_SECONDS") or 1.0),
+        push_min_interval=float(os.environ.get("MACHINE_PUSH_MIN_INTERVAL_SECONDS") or 1.0)
+        )
 
     # attach Calculator agent
     attach_calculator_tools(rtmt)
 
     # attach Notepad agent
-    attach_notepad_tools(rtmt)
+    # Logic App URLs are decoded once here, in case they're URL encoded in the environment variables
+    attach_notepad_tools(rtmt,
+        http_client=http_client,
+        base_url=os.environ.get("NOTEPAD_BASE_URL"),
+        append_file_content_url=decode_url_string(os.environ.get("NOTEPAD_APPEND_FILE_CONTENT_API_URL")),
+        replace_file_content_url=decode_url_string(os.environ.get("NOTEPAD_REPLACE_FILE_CONTENT_API_URL")),
+        get_file_name_url=decode_url_string(os.environ.get("NOTEPAD_GET_FILE_NAME_API_URL")),
+        spool_path=os.environ.get("NOTEPAD_SPOOL_PATH") or Path(__file__).parent / ".spool/notepad.db",
+        flush_delay=float(os.environ.get("NOTEPAD_FLUSH_DELAY_SECONDS") or 2.0),
+        flush_bytes=int(os.environ.get("NOTEPAD_FLUSH_BYTES") or 4096),
+        list_files_url=decode_url_string(os.environ.get("NOTEPAD_LIST_FILES_API_URL")),
+        file_names_refresh_interval=float(os.environ.get("NOTEPAD_FILE_NAMES_REFRESH_SECONDS") or 300)
+        )
 
     # attach ToDoList agent
-    attach_todolist_tools(rtmt)
+    attach_todolist_tools(rtmt,
+        http_client=http_client,
+        create_task_url=decode_url_string(os.environ.get("TODOLIST_CREATE_TASK_API_URL")),
+        outbox_path=os.environ.get("TODOLIST_OUTBOX_PATH") or Path(__file__).parent / ".spool/todolist.db",
+        flush_delay=float(os.environ.get("TODOLIST_FLUSH_DELAY_SECONDS") or 1.0)
+        )
+
+    # Per-turn latency traces, as OTLP JSON lines in a file or posted to an OpenTelemetry collector
+    if trace_export_url := os.environ.get("TRACE_EXPORT_URL"):
+        rtmt.tracer = TurnTracer(OtlpHttpSpanExporter(trace_export_url), rtmt.metrics)
+    elif trace_export_file := os.environ.get("TRACE_EXPORT_FILE"):
+        rtmt.tracer = TurnTracer(FileSpanExporter(trace_export_file), rtmt.metrics)
+    if rtmt.tracer is not None:
+        rtmt.cleanup_ctx.append(rtmt.tracer.cleanup_ctx)
+    # Session captures for offline replay, they hold what the users said so keep them off in production
+    if capture_dir := os.environ.get("CAPTURE_DIR"):
+        rtmt.recorder = SessionRecorder(capture_dir, audio=os.environ.get("CAPTURE_AUDIO") or "raw")
+        rtmt.cleanup_ctx.append(rtmt.recorder.cleanup_ctx)
 
     rtmt.attach_to_app(app, "/realtime")
+    # The relay and tool metrics, with the event loop lag, are scraped on /metrics
+    app.cleanup_ctx.append(EventLoopLagMonitor(rtmt.metrics).cleanup_ctx)
 
     current_directory = Path(__file__).parent
     app.add_routes([
         web.get('/', lambda _: web.FileResponse(current_directory / 'static/index.html')),
-        web.get('/speech/token', get_speech_token)])
+        web.get('/speech/token', get_speech_token),
+        web.get('/metrics', rtmt.metrics.handle)])
     app.router.add_static('/', path=current_directory / 'static', name='static')
     
     return app
@@ -0,0 +1,81 @@
+"""
+Benchmark of calculator_evaluate against the binary calculator tools.
+
+Each scenario is a calculation a lab user asks for, solved both ways: as the chain of binary tool calls the
+model has to make one after the other (each one a model round trip), and as a single calculator_evaluate
+call. Checks that both agree and reports the round trips and the voice latency they cost.
+
+Run from app/backend:  python -m benchmarks.bench_calculator
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import time
+
+from agents.calculator_tools import _add_tool, _divide_tool, _evaluate_tool, _multiply_tool, _subtract_tool
+
+BINARY_TOOLS = {"add": _add_tool, "subtract": _subtract_tool, "multiply": _multiply_tool, "divide": _divide_tool}
+
+# (request, expression, binary tool calls), "_" stands for the result of the previous call
+SCENARIOS = [
+    ("a third of 250 ml at 10 percent, plus 2",
+     "(250*0.1)/3 + 2",
+     [("multiply", 250, 0.1), ("divide", "_", 3), ("add", "_", 2)]),
+    ("how much 1 M stock for 250 ml at 0.1 M",
+     "dilution(c1=1 M, c2=0.1 M, v2=250 mL)",
+     [("multiply", 0.1, 250), ("divide", "_", 1)]),
+    ("0.35 litres in millilitres",
+     "0.35 L in mL",
+     [("multiply", 0.35, 1000)]),
+    ("grams of NaCl for 500 ml at 0.2 M",
+     '0.2 M * 500 mL * molar_mass("NaCl") in g',
+     [("add", 22.990, 35.45), ("multiply", 0.2, 0.5), ("multiply", "_", 58.44)]),
+    ("molar mass of glucose",
+     'molar_mass("C6H12O6")',
+     [("multiply", 6, 12.011), ("multiply", 12, 1.008), ("add", 72.066, 12.096), ("multiply", 6, 15.999),
+      ("add", 84.162, "_")]),
+    ("what percent is 12 ml of 250 ml",
+     "percent(12 mL, 250 mL)",
+     [("divide", 12, 250), ("multiply", "_", 100)]),
+    ("micromoles in 10 ml of 1, 2 and 5 mM",
+     "[1, 2, 5] mM * 10 mL in umol",
+     [("multiply", 1, 10), ("multiply", 2, 10), ("multiply", 5, 10)]),
+    ("average of three readings",
+     "mean([27.1, 27.3, 26.9])",
+     [("add", 27.1, 27.3), ("add", "_", 26.9), ("divide", "_", 3)]),
+]
+
+async def run_chain(steps) -> float:
+    result = None
+    for name, a, b in steps:
+        args = {"A": result if a == "_" else a, "B": result if b == "_" else b}
+        result = (await BINARY_TOOLS[name](args)).text
+    return float(result)
+
+async def main(round_trip_ms: float) -> None:
+    total_binary, total_evaluate = 0, 0
+    print(f"{'request':<42} {'binary calls':>12} {'evaluate':>9}  result")
+    for request, expression, steps in SCENARIOS:
+        # The tools print each call, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            chain_result = await run_chain(steps)
+            start = time.perf_counter()
+            result = (await _evaluate_tool({"expression": expression})).text
+            evaluate_ms = (time.perf_counter() - start) * 1000
+        # The chains end on the unit of the expression result, for lists on its last value
+        value = float(result.rsplit(",", 1)[-1].split()[0])
+        agree = "ok" if abs(value - chain_result) <= 1e-3 * max(1.0, abs(value)) else f"MISMATCH {chain_result}"
+        total_binary += len(steps)
+        total_evaluate += 1
+        print(f"{request:<42} {len(steps):>12} {1:>9}  {result} ({agree}, {evaluate_ms:.2f} ms)")
+
+    saved = (total_binary - total_evaluate) * round_trip_ms / 1000
+    print(f"\n{len(SCENARIOS)} requests: {total_binary} binary tool round trips vs {total_evaluate} with calculator_evaluate, "
+          f"~{saved:.1f} s of voice latency saved at {round_trip_ms:.0f} ms per round trip")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--round-trip-ms", type=float, default=400, help="Latency of one model tool call round trip")
+    args = parser.parse_args()
+    asyncio.run(main(args.round_trip_ms))
@@ -0,0 +1,75 @@
+"""
+Benchmark of the search tool output packing.
+
+The bundled experiment documents fit in a single page each, so by default this writes long synthetic
+procedures to a temporary folder (or indexes --data-dir), runs the queries against the local index and
+compares the size of the raw search tool output with the packed one, per query.
+
+Run from app/backend:  python -m benchmarks.bench_context_packing
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+from pathlib import Path
+
+from retrieval import HashingEmbedding, LocalIndex, estimate_tokens, format_chunks, pack_chunks
+
+QUERIES = [
+    "what's the next step after adding the nitric acid",
+    "what temperature should the water bath be",
+    "how long do I stir the mixture",
+    "how much buffer do I add to the first tube",
+    "when do I take the absorbance reading",
+    "how do I dispose of the waste",
+]
+
+ACTIONS = ["Add", "Slowly pour", "Pipette", "Weigh", "Dissolve", "Transfer", "Cool", "Heat", "Stir", "Filter"]
+REAGENTS = ["nitric acid", "sulfuric acid", "benzene", "phosphate buffer", "enzyme solution", "distilled water",
+            "hydrogen peroxide", "sodium bicarbonate", "ethanol", "potato extract"]
+VESSELS = ["the round bottom flask", "the first test tube", "a 250 ml beaker", "the water bath", "the separating funnel"]
+NOTES = ["Take the absorbance reading at 420 nm.", "Record the temperature every minute.",
+         "Keep the mixture below 55 °C.", "Wear gloves and goggles.", "Dispose of the waste in the labelled container.",
+         "Wait until the solution turns pale yellow.", "Stir the mixture for 10 minutes."]
+
+def write_corpus(data_dir: Path, documents: int, steps: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    for d in range(documents):
+        lines = [f"Experiment {d + 1} - procedure", ""]
+        for s in range(steps):
+            lines.append(f"Step {s + 1}: {rng.choice(ACTIONS)} {rng.randint(1, 50)} ml of {rng.choice(REAGENTS)} "
+                         f"to {rng.choice(VESSELS)} at {rng.randint(4, 80)} °C. {rng.choice(NOTES)}")
+        (data_dir / f"Experiment {d + 1}.txt").write_text("\n".join(lines), encoding="utf-8")
+
+async def main(data_dir: Path | None, budget: int, top: int) -> None:
+    with tempfile.TemporaryDirectory() as work_dir:
+        if data_dir is None:
+            data_dir = Path(work_dir) / "data"
+            data_dir.mkdir()
+            write_corpus(data_dir, documents=6, steps=120)
+        index = LocalIndex.load_or_build(data_dir, Path(work_dir) / "index", HashingEmbedding())
+        print(f"{len(index)} chunks from {data_dir}, top {top}, budget {budget} tokens\n")
+        print(f"{'query':<52} {'raw bytes':>10} {'packed':>8} {'raw tok':>8} {'packed':>7} {'saved':>6}")
+
+        total_raw, total_packed, total_saved_tokens = 0, 0, 0
+        for query in QUERIES:
+            chunks = await index.search(query, top=top)
+            raw, packed = format_chunks(chunks), format_chunks(pack_chunks(chunks, budget))
+            assert estimate_tokens(packed) <= budget, f"{estimate_tokens(packed)} tokens packed for {query!r}, over the budget of {budget}"
+            raw_bytes, packed_bytes = len(raw.encode("utf-8")), len(packed.encode("utf-8"))
+            total_raw += raw_bytes
+            total_packed += packed_bytes
+            total_saved_tokens += estimate_tokens(raw) - estimate_tokens(packed)
+            saved = 1 - packed_bytes / raw_bytes if raw_bytes else 0.0
+            print(f"{query[:52]:<52} {raw_bytes:>10} {packed_bytes:>8} {estimate_tokens(raw):>8} {estimate_tokens(packed):>7} {saved:>6.0%}")
+
+        print(f"\n{'total':<52} {total_raw:>10} {total_packed:>8} saved {total_raw - total_packed} bytes, "
+              f"~{total_saved_tokens // len(QUERIES)} tokens per query")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", type=Path, help="Folder of .txt documents to index instead of the synthetic corpus")
+    parser.add_argument("--budget", type=int, default=1500, help="Token budget of the search tool output")
+    parser.add_argument("--top", type=int, default=5, help="Chunks returned by each search")
+    args = parser.parse_args()
+    asyncio.run(main(args.data_dir, args.budget, args.top))
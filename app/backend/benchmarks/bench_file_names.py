@@ -0,0 +1,66 @@
+"""
+Benchmark of the local file name index of notepad_get_file_name.
+
+Indexes --files generated file names like "Experiment12_Sample_B.txt", then resolves spoken keywords for
+random files ("experiment twelve sample b", with some misspelled words and some keywords matching several
+files) and reports the resolution time, the share of lookups answered locally, their accuracy, and the time
+the remote lookups would have cost at --round-trip-ms each.
+
+Run from app/backend:  python -m benchmarks.bench_file_names
+"""
+import argparse
+import random
+import time
+
+from retrieval import FileNameIndex
+
+KINDS = ["sample", "control", "titration", "calibration", "notes", "protocol", "synthesis", "analysis"]
+NUMBER_WORDS = "zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen sixteen seventeen eighteen nineteen".split()
+
+def spoken(number: int) -> str:
+    if number < 20:
+        return NUMBER_WORDS[number]
+    tens = ["twenty", "thirty", "forty", "fifty", "sixty", "seventy", "eighty", "ninety"][number // 10 - 2]
+    return tens if number % 10 == 0 else f"{tens} {NUMBER_WORDS[number % 10]}"
+
+def misspell(word: str) -> str:
+    position = random.randrange(1, len(word))
+    return word[:position] + word[position + 1:]
+
+def main(files: int, lookups: int, round_trip_ms: float) -> None:
+    random.seed(0)
+    names = [f"Experiment{e}_{kind.capitalize()}_{variant}.txt"
+             for e in range(1, 100) for kind in KINDS for variant in "ABC"][:files]
+    index = FileNameIndex()
+    start = time.perf_counter()
+    index.replace(names)
+    print(f"indexed {len(index)} names in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    queries = []
+    for _ in range(lookups):
+        name = random.choice(names)
+        experiment, kind, variant = name[len("Experiment"):-len(".txt")].split("_")
+        kind = kind.lower()
+        if random.random() < 0.2:
+            kind = misspell(kind)
+        # Some users don't say the variant, several files then match
+        words = ["experiment", spoken(int(experiment)), kind] + ([variant.lower()] if random.random() < 0.8 else [])
+        queries.append((" ".join(words), name))
+
+    start = time.perf_counter()
+    results = [index.resolve(query) for query, _ in queries]
+    elapsed = time.perf_counter() - start
+    local = [(result, name) for result, (_, name) in zip(results, queries) if result is not None]
+    correct = sum(result == name for result, name in local)
+    print(f"resolve           {elapsed / lookups * 1e6:8.1f} µs per lookup")
+    print(f"answered locally  {len(local) / lookups:8.1%} ({index.misses} misses, {index.ambiguous} ambiguous sent to the Logic App)")
+    print(f"correct           {correct / max(len(local), 1):8.1%} of the local answers")
+    print(f"latency saved     {len(local) * round_trip_ms / 1000:8.1f} s over {lookups} lookups at {round_trip_ms:.0f} ms per Logic App call")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--round-trip-ms", type=float, default=600, help="Latency of one call of the get file name Logic App")
+    args = parser.parse_args()
+    main(args.files, args.lookups, args.round_trip_ms)
@@ -0,0 +1,226 @@
+"""
+Load test of an aiohttp worker running RTMiddleTier, against the fake realtime API of fake_realtime.py.
+
+Starts the fake realtime server, runs the middle tier in a separate worker process (pointed at the fake, with
+a stub "lookup" tool answering after --tool-latency seconds), and connects synthetic clients that stream PCM16
+audio in real time like the frontend, for every concurrency of --concurrency. Reports, per concurrency:
+
+  - throughput: frames relayed per second in both directions, and completed turns per second
+  - relay latency: p50/p99 of the age of the audio frames when they reach the fake server (client to server)
+    and the client (server to client)
+  - CPU and memory of the worker per session, from its CPU time and resident memory over the run
+
+--direct connects the clients straight to the fake server instead, giving the latency of the harness itself.
+--capture-dir captures the sessions of the worker, to replay them with bench_replay.py.
+
+Run from app/backend:  python -m benchmarks.bench_load --concurrency 1,10,50,100
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+from typing import Optional
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+from azure.core.credentials import AzureKeyCredential
+
+from benchmarks.fake_realtime import TOOL_NAME, FakeRealtimeServer, audio_payloads, frame_age, stamp
+from capture import SessionRecorder
+from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection
+
+_lookup_tool_schema = {
+    "type": "function",
+    "name": TOOL_NAME,
+    "description": "Look up lab data",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "query": {
+                "type": "string",
+                "description": "Query"
+            }
+        },
+        "required": ["query"],
+        "additionalProperties": False
+    }
+}
+
+def _resident_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak rather than current memory where /proc isn't available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+def run_worker(port: int, upstream: str, tool_latency: float, capture_dir: Optional[str]) -> None:
+    """The middle tier under test, as the app runs it, plus /bench/usage reporting the process usage."""
+    rtmt = RTMiddleTier(endpoint=upstream, deployment="bench", credentials=AzureKeyCredential("bench"))
+    if capture_dir:
+        rtmt.recorder = SessionRecorder(capture_dir)
+        rtmt.cleanup_ctx.append(rtmt.recorder.cleanup_ctx)
+
+    async def lookup(args) -> ToolResult:
+        await asyncio.sleep(tool_latency)
+        return ToolResult("The glovebox was at 21 degrees during experiment 12.", ToolResultDirection.TO_SERVER)
+
+    rtmt.tools[TOOL_NAME] = Tool(schema=_lookup_tool_schema, target=lookup)
+
+    async def usage(request: web.Request) -> web.Response:
+        cpu = resource.getrusage(resource.RUSAGE_SELF)
+        return web.json_response({"cpu_seconds": cpu.ru_utime + cpu.ru_stime, "resident_bytes": _resident_bytes(), "sessions": len(rtmt.sessions)})
+
+    app = web.Application()
+    rtmt.attach_to_app(app, "/realtime")
+    app.router.add_get("/bench/usage", usage)
+    web.run_app(app, host="127.0.0.1", port=port, print=None)
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentiles(values: list[float]) -> str:
+    if not values:
+        return "      -       -"
+    values = np.array(values) * 1000
+    return f"{np.percentile(values, 50):7.2f} {np.percentile(values, 99):7.2f}"
+
+class ClientStats:
+    def __init__(self):
+        self.latencies: list[float] = []
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.turns = 0
+        self.errors = 0
+
+async def run_client(http: aiohttp.ClientSession, url: str, duration: float, frame_ms: int, payloads: list[str], stats: ClientStats) -> None:
+    try:
+        async with http.ws_connect(url, max_msg_size=0) as ws:
+            await ws.send_str(json.dumps({"type": "session.update", "session": {
+                "turn_detection": {"type": "server_vad"}, "input_audio_transcription": {"model": "whisper-1"}}}))
+
+            async def stream_audio():
+                # The microphone stays open for the whole session, answers included
+                start = time.monotonic()
+                for n in range(int(duration * 1000 / frame_ms)):
+                    await ws.send_str('{"type":"input_audio_buffer.append","event_id":"' + stamp() + '","audio":"' + payloads[n % len(payloads)] + '"}')
+                    stats.frames_sent += 1
+                    delay = start + (n + 1) * frame_ms / 1000 - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                await ws.close()
+
+            async def receive():
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.TEXT:
+                        continue
+                    stats.frames_received += 1
+                    if msg.data.startswith('{"type":"response.audio.delta"'):
+                        if (age := frame_age(msg.data)) is not None:
+                            stats.latencies.append(age)
+                    elif msg.data.startswith('{"type": "response.done"') or msg.data.startswith('{"type":"response.done"'):
+                        if '"type": "message"' in msg.data:
+                            stats.turns += 1
+                    elif msg.data.startswith('{"type": "error"'):
+                        stats.errors += 1
+
+            await asyncio.gather(stream_audio(), receive())
+    except Exception:
+        stats.errors += 1
+
+async def _usage(http: aiohttp.ClientSession, worker_url: Optional[str]) -> Optional[dict]:
+    if worker_url is None:
+        return None
+    async with http.get(f"{worker_url}/bench/usage") as response:
+        return await response.json()
+
+async def run_level(http: aiohttp.ClientSession, fake: FakeRealtimeServer, url: str, worker_url: Optional[str],
+                    sessions: int, duration: float, frame_ms: int, payloads: list[str]) -> None:
+    fake.stats.latencies.clear()
+    stats = ClientStats()
+    before = await _usage(http, worker_url)
+    started = time.monotonic()
+    clients = asyncio.gather(*(run_client(http, url, duration, frame_ms, payloads, stats) for _ in range(sessions)))
+    # Resident memory with every session open, near the end of the run
+    await asyncio.sleep(duration * 0.9)
+    during = await _usage(http, worker_url)
+    await clients
+    elapsed = time.monotonic() - started
+    after = await _usage(http, worker_url)
+
+    throughput = (stats.frames_sent + stats.frames_received) / elapsed
+    row = f"{sessions:8} {throughput:9.0f} {stats.turns / elapsed:7.2f}   {percentiles(fake.stats.latencies)}   {percentiles(stats.latencies)}"
+    if before is not None:
+        cpu_share = (after["cpu_seconds"] - before["cpu_seconds"]) / elapsed / sessions
+        memory = (during["resident_bytes"] - before["resident_bytes"]) / sessions
+        row += f"   {cpu_share * 100:8.2f} {memory / 1024:9.0f}"
+    print(row + f"   {stats.errors:6}", flush=True)
+
+async def main(concurrency: list[int], duration: float, frame_ms: int, direct: bool, tool_latency: float, capture_dir: Optional[str], fake_options: dict) -> None:
+    fake = FakeRealtimeServer(frame_ms=frame_ms, **fake_options)
+    upstream = await fake.start()
+    worker = None
+    worker_url = None
+    if direct:
+        url = f"{upstream}/openai/realtime"
+    else:
+        port = _free_port()
+        worker = subprocess.Popen([sys.executable, "-m", "benchmarks.bench_load", "--worker", str(port), "--upstream", upstream,
+                                   "--tool-latency", str(tool_latency), *(["--capture-dir", capture_dir] if capture_dir else [])], env={**os.environ, "PYTHONUNBUFFERED": "1"})
+        worker_url = f"http://127.0.0.1:{port}"
+        url = f"{worker_url}/realtime"
+    payloads = audio_payloads(frame_ms)
+    try:
+        async with aiohttp.ClientSession() as http:
+            if worker_url is not None:
+                for _ in range(100):
+                    try:
+                        await _usage(http, worker_url)
+                        break
+                    except aiohttp.ClientConnectionError:
+                        await asyncio.sleep(0.1)
+            print(f"{'direct to the fake server' if direct else 'through the middle tier worker'}, {duration:.0f} s sessions streaming {frame_ms} ms audio frames")
+            header = f"{'sessions':>8} {'frames/s':>9} {'turns/s':>7}   {'up p50':>7} {'up p99':>7}   {'down p50':>7} {'p99':>7}"
+            if not direct:
+                header += f"   {'CPU %':>8} {'KiB/sess':>9}"
+            print(header + f"   {'errors':>6}")
+            for sessions in concurrency:
+                await run_level(http, fake, url, worker_url, sessions, duration, frame_ms, payloads)
+    finally:
+        if worker is not None:
+            worker.terminate()
+            worker.wait()
+        await fake.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,10,50,100", help="Comma separated numbers of concurrent sessions")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds each session streams audio")
+    parser.add_argument("--frame-ms", type=int, default=100, help="Audio carried by each frame")
+    parser.add_argument("--direct", action="store_true", help="Connect the clients to the fake server without the middle tier")
+    parser.add_argument("--tool-latency", type=float, default=0.1, help="Seconds the stub tool takes")
+    parser.add_argument("--capture-dir", help="Directory to capture the sessions of the worker to")
+    parser.add_argument("--turn-audio-seconds", type=float, default=3.0, help="Client audio making up a user utterance")
+    parser.add_argument("--response-audio-seconds", type=float, default=2.0)
+    parser.add_argument("--audio-speed", type=float, default=1.0, help="Answer audio pace relative to real time, 0 for unpaced")
+    parser.add_argument("--tool-call-rate", type=float, default=0.3, help="Share of the answers calling a tool first")
+    parser.add_argument("--worker", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    parser.add_argument("--upstream", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker is not None:
+        run_worker(args.worker, args.upstream, args.tool_latency, args.capture_dir)
+    else:
+        asyncio.run(main([int(n) for n in args.concurrency.split(",")], args.duration, args.frame_ms, args.direct, args.tool_latency, args.capture_dir, {
+            "turn_audio_seconds": args.turn_audio_seconds,
+            "response_audio_seconds": args.response_audio_seconds,
+            "audio_speed": args.audio_speed,
+            "tool_call_rate": args.tool_call_rate,
+        }))
@@ -0,0 +1,58 @@
+"""
+Benchmark of the in-process search backend.
+
+Builds the local index of the experiment documents (or of --data-dir) in a temporary folder, then reports
+build time, memory-mapped load time and hybrid query latency.
+
+Run from app/backend:  python -m benchmarks.bench_local_search
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from retrieval import HashingEmbedding, LocalIndex
+
+QUERIES = [
+    "what's the next step",
+    "what temperature for experiment 2",
+    "how much nitric acid do I add",
+    "enzyme concentration for the first sample",
+    "how long do I stir the mixture",
+    "which buffer should I use",
+]
+
+async def main(data_dir: Path, repeat: int) -> None:
+    with tempfile.TemporaryDirectory() as index_dir:
+        start = time.perf_counter()
+        LocalIndex.load_or_build(data_dir, Path(index_dir), HashingEmbedding())
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        index = LocalIndex.load_or_build(data_dir, Path(index_dir), HashingEmbedding())
+        load = time.perf_counter() - start
+
+        latencies = []
+        for _ in range(repeat):
+            for query in QUERIES:
+                start = time.perf_counter()
+                await index.search(query, top=5)
+                latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+
+        print(f"{len(index)} chunks from {data_dir}")
+        print(f"build          {build * 1000:8.1f} ms")
+        print(f"load (mmap)    {load * 1000:8.1f} ms")
+        print(f"query p50      {np.percentile(latencies, 50):8.2f} ms")
+        print(f"query p99      {np.percentile(latencies, 99):8.2f} ms")
+        print(f"best match for '{QUERIES[2]}': {(await index.search(QUERIES[2], top=1))[0][1]}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data-dir", type=Path, default=Path(__file__).parent / "../../../data", help="Folder of .txt documents to index")
+    parser.add_argument("--repeat", type=int, default=200, help="Passes over the benchmark queries")
+    args = parser.parse_args()
+    asyncio.run(main(args.data_dir, args.repeat))
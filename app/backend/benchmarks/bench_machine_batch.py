@@ -0,0 +1,54 @@
+"""
+Benchmark of the batch machine tools against the per-position ones.
+
+Runs multi-position workflows on a machine of --decks decks of --positions positions, once with a
+machine_get_status / machine_set_values call per position (each one a model round trip) and once with a
+single machine_get_decks_status / machine_set_setpoints call, and reports the round trips and the voice
+latency they cost.
+
+Run from app/backend:  python -m benchmarks.bench_machine_batch
+"""
+import argparse
+import asyncio
+import time
+
+from agents.machine_tools import _machine_get_decks_status, _machine_get_status, _machine_set_setpoints, _machine_set_values
+from benchmarks.bench_machine_store import make_state
+from machine import MachineStateStore
+
+async def timed(calls) -> float:
+    start = time.perf_counter()
+    for call in calls:
+        await call
+    return (time.perf_counter() - start) * 1000
+
+async def main(decks: int, positions: int, round_trip_ms: float) -> None:
+    store = MachineStateStore.from_state(make_state(decks, positions))
+    deck_positions = [str(p + 1) for p in range(positions)]
+    changes = [{"deck": "1", "position": p, "setpoint": "37"} for p in deck_positions]
+    workflows = [
+        ("check all positions of deck 2",
+         [_machine_get_status(store, {"deck": "2", "position": p}) for p in deck_positions],
+         [_machine_get_decks_status(store, {"decks": ["2"]})]),
+        ("check decks 1 to 3",
+         [_machine_get_status(store, {"deck": str(d), "position": p}) for d in (1, 2, 3) for p in deck_positions],
+         [_machine_get_decks_status(store, {"decks": ["1", "2", "3"]})]),
+        ("set 37 °C on all positions of deck 1",
+         [_machine_set_values(store, store.set_setpoints, c) for c in changes],
+         [_machine_set_setpoints(store, store.set_setpoints, {"changes": changes})]),
+    ]
+
+    print(f"{'workflow':<38} {'single calls':>12} {'batch':>6} {'tools ms':>9} {'latency saved':>14}")
+    for name, single, batch in workflows:
+        single_ms, batch_ms = await timed(single), await timed(batch)
+        saved = (len(single) - len(batch)) * round_trip_ms / 1000
+        print(f"{name:<38} {len(single):>12} {len(batch):>6} {single_ms:>4.1f}/{batch_ms:<4.1f} {saved:>12.1f} s")
+    print(f"\nlatency at {round_trip_ms:.0f} ms per model tool round trip")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--decks", type=int, default=8)
+    parser.add_argument("--positions", type=int, default=12, help="Positions per deck")
+    parser.add_argument("--round-trip-ms", type=float, default=400, help="Latency of one model tool call round trip")
+    args = parser.parse_args()
+    asyncio.run(main(args.decks, args.positions, args.round_trip_ms))
@@ -0,0 +1,77 @@
+"""
+Benchmark of machine tool calls against a slow device.
+
+Uses the SimulatedDevice with --latency seconds per call. Compares machine_get_status reading the device on
+every call with reading the snapshot the MachinePoller keeps fresh, reports how stale those snapshots are,
+and the latency of setpoint writes going through the serialized command queue.
+
+Run from app/backend:  python -m benchmarks.bench_machine_device
+"""
+import argparse
+import asyncio
+import random
+import time
+
+import numpy as np
+
+from agents.machine_tools import _machine_get_status, _machine_set_values
+from benchmarks.bench_machine_store import make_state
+from machine import MachinePoller, MachineStateStore, SimulatedDevice
+
+def percentiles(values: list[float]) -> str:
+    values = np.array(values) * 1000
+    return f"p50 {np.percentile(values, 50):7.2f} ms  p99 {np.percentile(values, 99):7.2f} ms"
+
+async def main(latency: float, interval: float, requests: int, writers: int) -> None:
+    store = MachineStateStore.from_state(make_state(8, 12))
+    device = SimulatedDevice.from_snapshot(store.snapshot, latency=latency, time_constant=5.0, max_rate=5.0, seed=0)
+    args = [{"deck": str(random.randint(1, 8)), "position": str(random.randint(1, 12))} for _ in range(requests)]
+
+    # Naive: every status request reads the device
+    naive = []
+    for _ in range(min(requests, 20)):
+        start = time.perf_counter()
+        await device.read_temperatures()
+        naive.append(time.perf_counter() - start)
+
+    poller = MachinePoller(store, device, interval)
+    poller.start()
+    await asyncio.sleep(latency * 2)
+    polled, ages = [], []
+    for a in args:
+        start = time.perf_counter()
+        await _machine_get_status(store, a)
+        polled.append(time.perf_counter() - start)
+        ages.append(time.time() - store.snapshot.read_at)
+        await asyncio.sleep(random.uniform(0, interval / 5))
+
+    async def write(i: int) -> float:
+        start = time.perf_counter()
+        await _machine_set_values(store, poller.set_setpoints, {"deck": "1", "position": str(i % 12 + 1), "setpoint": "37"})
+        return time.perf_counter() - start
+    single = [await write(0)]
+    concurrent = await asyncio.gather(*(write(i) for i in range(writers)))
+
+    index = store.index_of("1", "1")
+    start = time.perf_counter()
+    while abs(store.snapshot.temperatures[index] - 37) > 0.5 and time.perf_counter() - start < 60:
+        await asyncio.sleep(interval)
+    settled = time.perf_counter() - start
+    await poller.close()
+
+    print(f"device latency {latency * 1000:.0f} ms, polled every {interval:.2f} s, {poller.reads} reads")
+    print(f"status, device read per call   {percentiles(naive)}")
+    print(f"status, from polled snapshot   {percentiles(polled)}")
+    print(f"snapshot age                   mean {np.mean(ages):.2f} s  max {np.max(ages):.2f} s")
+    print(f"setpoint write                 {percentiles(single)}")
+    print(f"{f'{writers} concurrent writes':<30} {percentiles(list(concurrent))} (serialized)")
+    print(f"deck 1 position 1 within 0.5 °C of 37 °C {settled:.1f} s after the write")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds each device call takes")
+    parser.add_argument("--interval", type=float, default=0.5, help="Seconds between device reads")
+    parser.add_argument("--requests", type=int, default=200, help="Status requests")
+    parser.add_argument("--writers", type=int, default=5, help="Concurrent setpoint writes")
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.interval, args.requests, args.writers))
@@ -0,0 +1,59 @@
+"""
+Benchmark of the machine deviation queries.
+
+Fills the history of a machine of --decks decks of --positions positions with --readings readings, then times
+find_deviations over every position (with and without the heating / cooling trend, which needs the rates of
+the whole history window) against a per-position Python loop answering the same question.
+
+Run from app/backend:  python -m benchmarks.bench_machine_query
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.bench_machine_store import make_state
+from machine import MachineHistory, MachineStateStore, find_deviations
+
+def per_position(store: MachineStateStore, history: MachineHistory, since: float, min_deviation: float) -> list[int]:
+    snapshot = store.snapshot
+    found = []
+    for index in range(len(store)):
+        deviation = float(snapshot.temperatures[index]) - float(snapshot.setpoints[index])
+        rate = history.position(index, since).rate(float("inf"))
+        if abs(deviation) >= min_deviation and rate is not None and rate > 0.05 / 60:
+            found.append(index)
+    return sorted(found, key=lambda i: -abs(float(snapshot.temperatures[i]) - float(snapshot.setpoints[i])))
+
+def timed_ms(function, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def main(decks: int, positions: int, readings: int, repeat: int) -> None:
+    store = MachineStateStore.from_state(make_state(decks, positions))
+    history = MachineHistory(len(store), capacity=readings)
+    drift = np.random.default_rng(0).normal(0, 0.02, len(store))
+    now = time.time()
+    for k in range(readings):
+        history.record(now - readings + k, store.snapshot.temperatures + drift * k)
+    since = now - 60
+
+    snapshot = store.snapshot
+    vectorized = lambda: find_deviations(snapshot, history.rates(since), min_deviation=0.5, trend="heating")
+    assert vectorized().tolist() == per_position(store, history, since, 0.5)
+
+    print(f"{len(store)} positions, {readings} readings in the history")
+    print(f"deviation only          {timed_ms(lambda: find_deviations(snapshot, min_deviation=0.5), repeat):8.3f} ms")
+    print(f"deviation and trend     {timed_ms(vectorized, repeat):8.3f} ms")
+    print(f"per-position loop       {timed_ms(lambda: per_position(store, history, since, 0.5), 3):8.3f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--decks", type=int, default=50)
+    parser.add_argument("--positions", type=int, default=100, help="Positions per deck")
+    parser.add_argument("--readings", type=int, default=120, help="Readings kept in the history")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.decks, args.positions, args.readings, args.repeat)
@@ -0,0 +1,68 @@
+"""
+Benchmark of machine position lookups.
+
+Compares the former linear scan of the pydantic JuniorMachineState (decks, then positions of the deck) with
+the indexed MachineStateStore, on a machine of --decks decks of --positions positions each, and measures the
+throughput of setpoint writes from concurrent sessions.
+
+Run from app/backend:  python -m benchmarks.bench_machine_store
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from machine import MachineStateStore
+from models.junior import Deck, JuniorMachineState, PositionReading
+
+def make_state(decks: int, positions: int) -> JuniorMachineState:
+    return JuniorMachineState(decks=[
+        Deck(name=str(d + 1), positions=[
+            PositionReading(name=str(p + 1), setpoint=25.0, temperature=25.0 + random.random()) for p in range(positions)
+        ])
+        for d in range(decks)
+    ])
+
+def scan(state: JuniorMachineState, deck_name: str, position_name: str) -> tuple[float, float]:
+    deck = next((d for d in state.decks if d.name == deck_name), None)
+    position = next((p for p in deck.positions if p.name == position_name), None)
+    return position.setpoint, position.temperature
+
+def indexed(store: MachineStateStore, deck_name: str, position_name: str) -> tuple[float, float]:
+    index = store.index_of(deck_name, position_name)
+    snapshot = store.snapshot
+    return float(snapshot.setpoints[index]), float(snapshot.temperatures[index])
+
+async def main(decks: int, positions: int, lookups: int, sessions: int) -> None:
+    state = make_state(decks, positions)
+    store = MachineStateStore.from_state(state)
+    targets = [(str(random.randint(1, decks)), str(random.randint(1, positions))) for _ in range(lookups)]
+    assert all(scan(state, *t) == indexed(store, *t) for t in targets[:100])
+
+    print(f"{len(store)} positions on {decks} decks, {lookups} lookups")
+    for name, lookup, target in (("linear scan", scan, state), ("indexed store", indexed, store)):
+        start = time.perf_counter()
+        for deck_name, position_name in targets:
+            lookup(target, deck_name, position_name)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<16} {elapsed / lookups * 1e6:8.2f} µs per lookup")
+
+    writes_per_session = 200
+    async def session():
+        for _ in range(writes_per_session):
+            await store.set_setpoints([random.randrange(len(store))], [random.uniform(0, 100)])
+            await asyncio.sleep(0)
+    start = time.perf_counter()
+    await asyncio.gather(*(session() for _ in range(sessions)))
+    elapsed = time.perf_counter() - start
+    print(f"{sessions} sessions writing: {sessions * writes_per_session / elapsed:,.0f} setpoint writes/s, "
+          f"version {store.snapshot.version} (expected {sessions * writes_per_session})")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--decks", type=int, default=48)
+    parser.add_argument("--positions", type=int, default=24, help="Positions per deck")
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--sessions", type=int, default=20, help="Concurrent sessions writing setpoints")
+    args = parser.parse_args()
+    asyncio.run(main(args.decks, args.positions, args.lookups, args.sessions))
@@ -0,0 +1,45 @@
+"""
+Micro-benchmark of the metrics recorded on the relay hot path.
+
+Measures the cost of counting a relayed frame by event type, of observing a tool latency, and of rendering
+/metrics, next to the cost of relaying an audio frame through the fast path (see bench_relay.py).
+
+Run from app/backend:  python -m benchmarks.bench_metrics
+"""
+import argparse
+import asyncio
+import time
+
+from azure.core.credentials import AzureKeyCredential
+
+from benchmarks.bench_relay import _audio_frames
+from rtmt import RTMiddleTier, RTSession
+
+def per_call_ns(function, calls: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter_ns() - start) / calls
+
+async def main(calls: int) -> None:
+    rtmt = RTMiddleTier(endpoint="https://localhost", deployment="gpt-4o-realtime-preview", credentials=AzureKeyCredential("key"))
+    message = _audio_frames("input_audio_buffer.append", "audio", 100, 1)[0]
+    session = RTSession(None)
+
+    relay_start = time.perf_counter_ns()
+    for _ in range(calls):
+        await rtmt._process_message_to_server(session, message, None)
+    relay_ns = (time.perf_counter_ns() - relay_start) / calls
+
+    frames = rtmt._frames_to_server
+    tool_seconds = rtmt._tool_seconds.labels("search", "ok")
+    print(f"relay of a 100 ms audio frame   {relay_ns:8.0f} ns (including the frame count)")
+    print(f"frame count by event type       {per_call_ns(lambda: frames.record('input_audio_buffer.append', 6432), calls):8.0f} ns")
+    print(f"tool latency observation        {per_call_ns(lambda: tool_seconds.observe(0.042), calls):8.0f} ns")
+    print(f"/metrics rendering              {per_call_ns(rtmt.metrics.render, 1000) / 1000:8.1f} µs")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200000)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls))
@@ -0,0 +1,109 @@
+"""
+Benchmark of notepad_save_note with the write-behind queue.
+
+Starts a stand-in for the append Logic App on localhost that answers after --latency seconds and fails a
+--failure-rate share of the requests. --sessions concurrent sessions each dictate --notes notes. Compares
+the tool latency of posting every note before answering (the former behaviour, where a failure loses the
+note) with spooling the note and appending it in the background, and reports the requests the Logic App got
+and the notes that reached it.
+
+Run from app/backend:  python -m benchmarks.bench_notepad_write_behind
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from aiohttp import web
+
+from agents.notepad_tools import _append_notes, _save_note
+from retrieval import FileNameIndex
+from rtmt import ToolResult, ToolResultDirection
+from utils import DurableQueue, ToolHttpClient, WriteBehindQueue
+
+def percentiles(values: list[float]) -> str:
+    values = np.array(values) * 1000
+    return f"p50 {np.percentile(values, 50):7.2f} ms  p99 {np.percentile(values, 99):7.2f} ms"
+
+class FakeLogicApp:
+    def __init__(self, latency: float, failure_rate: float):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self.lines = 0
+
+    async def append(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            return web.Response(status=503)
+        self.lines += len(body["text"].split("\n"))
+        return web.Response()
+
+async def dictate(save, session: int, notes: int, pause: float) -> list[float]:
+    durations = []
+    for n in range(notes):
+        start = time.perf_counter()
+        await save({"session_id": f"session{session}", "text": f"Sample {n} taken at 37 degrees"})
+        durations.append(time.perf_counter() - start)
+        await asyncio.sleep(pause)
+    return durations
+
+async def run(http_client: ToolHttpClient, logic_app: FakeLogicApp, url: str, sessions: int, notes: int, pause: float) -> None:
+    async def direct_save(args) -> ToolResult:
+        # Former behaviour: the answer waits for the Logic App
+        try:
+            await _append_notes(http_client, "/notes", url, f"{args['session_id']}.txt", [args["text"]])
+            return ToolResult("Note saved successfully", ToolResultDirection.TO_SERVER)
+        except Exception:
+            return ToolResult("An error occurred while saving the note", ToolResultDirection.TO_SERVER)
+
+    durations = sum(await asyncio.gather(*(dictate(direct_save, s, notes, pause) for s in range(sessions))), [])
+    print(f"direct        {percentiles(durations)}  requests {logic_app.requests:4}  notes saved {logic_app.lines}/{sessions * notes}")
+
+    logic_app.requests = logic_app.lines = 0
+    with tempfile.TemporaryDirectory() as spool_dir:
+        queue = WriteBehindQueue(
+            DurableQueue(Path(spool_dir) / "notepad.db"),
+            deliver=lambda file_name, texts: _append_notes(http_client, "/notes", url, file_name, texts),
+            max_delay=2.0,
+            retry_base=0.2)
+        file_names = FileNameIndex()
+        await queue.start()
+        durations = sum(await asyncio.gather(*(dictate(lambda args: _save_note(queue, file_names, args), s, notes, pause) for s in range(sessions))), [])
+        for s in range(sessions):
+            queue.flush(f"session{s}.txt")
+        while len(queue) > 0:
+            await asyncio.sleep(0.05)
+        await queue.close()
+    print(f"write-behind  {percentiles(durations)}  requests {logic_app.requests:4}  notes saved {logic_app.lines}/{sessions * notes}")
+
+async def main(latency: float, failure_rate: float, sessions: int, notes: int, pause: float) -> None:
+    logic_app = FakeLogicApp(latency, failure_rate)
+    app = web.Application()
+    app.router.add_post("/append", logic_app.append)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/append"
+    http_client = ToolHttpClient()
+    try:
+        await run(http_client, logic_app, url, sessions, notes, pause)
+    finally:
+        await http_client.close()
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.8, help="Seconds the Logic App takes to answer")
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--notes", type=int, default=5, help="Notes dictated per session")
+    parser.add_argument("--pause", type=float, default=0.3, help="Seconds between the notes of a session")
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.failure_rate, args.sessions, args.notes, args.pause))
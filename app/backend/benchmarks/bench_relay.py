@@ -0,0 +1,73 @@
+"""
+Micro-benchmark of the RTMiddleTier message relay for audio frames.
+
+Compares the CPU time needed to relay one second of audio (in both directions) when every frame is
+fully parsed, as the relay used to do, with the current type-prefix fast path.
+
+Run from app/backend:  python -m benchmarks.bench_relay
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import time
+
+from azure.core.credentials import AzureKeyCredential
+
+from rtmt import RTMiddleTier, RTSession
+
+SAMPLE_RATE = 24000  # PCM16 mono, as recorded by the frontend
+BYTES_PER_SAMPLE = 2
+
+class _FakeMessage:
+    def __init__(self, data: str):
+        self.data = data
+
+def _audio_frames(event_type: str, payload_field: str, frame_ms: int, seconds: int) -> list[_FakeMessage]:
+    frame_bytes = SAMPLE_RATE * BYTES_PER_SAMPLE * frame_ms // 1000
+    frames = []
+    for i in range(seconds * 1000 // frame_ms):
+        audio = base64.b64encode(os.urandom(frame_bytes)).decode("ascii")
+        frames.append(_FakeMessage(json.dumps({"type": event_type, "event_id": f"event_{i}", payload_field: audio})))
+    return frames
+
+async def _full_parse(msg: _FakeMessage) -> str:
+    # What the relay did for every frame before the fast path
+    message = json.loads(msg.data)
+    match message["type"]:
+        case "session.created" | "response.done":
+            return json.dumps(message)
+    return msg.data
+
+async def _measure(process, frames: list[_FakeMessage], repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        for frame in frames:
+            await process(frame)
+    return time.process_time() - start
+
+async def main(frame_ms: int, seconds: int, repeat: int) -> None:
+    rtmt = RTMiddleTier("https://localhost", "bench", AzureKeyCredential("bench"))
+    session = RTSession(None)
+    to_server = _audio_frames("input_audio_buffer.append", "audio", frame_ms, seconds)
+    to_client = _audio_frames("response.audio.delta", "delta", frame_ms, seconds)
+    audio_seconds = seconds * repeat
+
+    rows = [
+        ("client -> server (full parse)", await _measure(_full_parse, to_server, repeat)),
+        ("client -> server (fast path)", await _measure(lambda m: rtmt._process_message_to_server(session, m, None), to_server, repeat)),
+        ("server -> client (full parse)", await _measure(_full_parse, to_client, repeat)),
+        ("server -> client (fast path)", await _measure(lambda m: rtmt._process_message_to_client(session, m, None, None), to_client, repeat)),
+    ]
+    print(f"{frame_ms} ms frames, {audio_seconds} audio seconds per direction")
+    for name, cpu in rows:
+        print(f"{name:32} {cpu / audio_seconds * 1e6:10.1f} us CPU per audio second")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--frame-ms", type=int, default=100, help="Duration of audio carried by each frame")
+    parser.add_argument("--seconds", type=int, default=10, help="Seconds of distinct audio frames to generate")
+    parser.add_argument("--repeat", type=int, default=20, help="Number of passes over the generated frames")
+    args = parser.parse_args()
+    asyncio.run(main(args.frame_ms, args.seconds, args.repeat))
@@ -0,0 +1,167 @@
+"""
+Deterministic replay of session captures against RTMiddleTier.
+
+Replays the frames of captures written by the SessionRecorder (CAPTURE_DIR in the app, or --capture-dir of
+bench_load.py) through the middle tier, with the upstream and the client replaced by sockets recording what
+the middle tier sends, and the tools replaced by stubs returning the captured results. --speed 1 keeps the
+captured timing, tool durations included; --speed 0 replays as fast as possible, waiting for the tool calls
+at the point they returned in the capture so that the output is the same on every run.
+
+Reports the relay time per frame (p50/p99, by direction), the CPU time per audio second, and a digest of the
+frames the middle tier sent to each side, to compare against a previous run: a different digest means the
+relay behaves differently on the same traffic. --dump writes those frames as JSON lines to debug a session.
+
+Run from app/backend:  python -m benchmarks.bench_replay .captures --speed 0
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+from azure.core.credentials import AzureKeyCredential
+
+from benchmarks.fake_realtime import BYTES_PER_SAMPLE, SAMPLE_RATE
+from capture import CAPTURE_SUFFIX, CLIENT_FRAME, SERVER_FRAME, TOOL_RESULT, CaptureRecord, read_capture
+from rtmt import RTMiddleTier, RTSession, Tool, ToolResult, ToolResultDirection, _current_session
+
+class _FakeMessage:
+    def __init__(self, data: str):
+        self.data = data
+
+class _RecordingSocket:
+    def __init__(self, direction: str, outputs: list[tuple[str, str]]):
+        self.direction = direction
+        self.outputs = outputs
+        self.closed = False
+
+    async def send_json(self, data: dict) -> None:
+        self.outputs.append((self.direction, json.dumps(data)))
+
+    async def send_str(self, data: str) -> None:
+        self.outputs.append((self.direction, data))
+
+    async def close(self) -> None:
+        self.closed = True
+
+class _RecordedTools:
+    """Stub tools answering with the captured results, in the order they were captured, per tool and arguments."""
+    def __init__(self, records: list[CaptureRecord], speed: float):
+        self.speed = speed
+        self.results: dict[tuple[str, str], list[dict]] = defaultdict(list)
+        for record in records:
+            if record.kind == TOOL_RESULT:
+                result = json.loads(record.data)
+                self.results[(result["name"], result["arguments"])].append(result)
+
+    def names(self) -> set[str]:
+        return {name for name, _ in self.results}
+
+    def target(self, name: str):
+        async def replay(args: dict) -> ToolResult:
+            args.pop("session_id", None)
+            arguments = json.dumps(args)
+            # The model's arguments are compared parsed, the capture has them as the model formatted them
+            key = next((key for key in self.results if key[0] == name and self.results[key] and json.loads(key[1]) == args), None)
+            if key is None:
+                raise RuntimeError(f"No captured result of {name} for {arguments}")
+            result = self.results[key].pop(0)
+            if self.speed > 0:
+                await asyncio.sleep(result["seconds"] / self.speed)
+            if result["error"] is not None and result["result"] is None:
+                raise RuntimeError(result["error"])
+            return ToolResult(result["result"], ToolResultDirection[result["destination"]])
+        return replay
+
+class ReplayResult:
+    def __init__(self):
+        self.outputs: list[tuple[str, str]] = []
+        self.latencies: dict[str, list[float]] = {"to_server": [], "to_client": []}
+        self.cpu_seconds = 0.0
+        self.audio_seconds = 0.0
+
+async def replay(records: list[CaptureRecord], speed: float) -> ReplayResult:
+    tools = _RecordedTools(records, speed)
+    rtmt = RTMiddleTier("https://localhost", "replay", AzureKeyCredential("replay"))
+    for name in tools.names():
+        rtmt.tools[name] = Tool(schema={"type": "function", "name": name, "parameters": {"type": "object", "properties": {}}},
+                                target=tools.target(name))
+    result = ReplayResult()
+    client_ws = _RecordingSocket("to_client", result.outputs)
+    server_ws = _RecordingSocket("to_server", result.outputs)
+    session = RTSession(client_ws)
+    _current_session.set(session)
+
+    async def pending_tool_calls():
+        await asyncio.gather(*session.tool_tasks.values(), *session.background_tasks, return_exceptions=True)
+
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    for record in records:
+        if speed > 0:
+            delay = start_wall + record.timestamp_ns / 1e9 / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if record.kind == TOOL_RESULT:
+            if speed == 0:
+                # The frames after this point were received once the tool returned
+                await pending_tool_calls()
+            continue
+        message = _FakeMessage(record.data)
+        started = time.perf_counter()
+        if record.kind == CLIENT_FRAME:
+            relayed = await rtmt._process_message_to_server(session, message, client_ws)
+            result.latencies["to_server"].append(time.perf_counter() - started)
+            if relayed is not None:
+                await server_ws.send_str(relayed)
+            if record.data.startswith('{"type":"input_audio_buffer.append"') and (audio := record.data.find('"audio":"')) != -1:
+                result.audio_seconds += (len(record.data) - audio - len('"audio":"') - 2) * 3 / 4 / (SAMPLE_RATE * BYTES_PER_SAMPLE)
+        elif record.kind == SERVER_FRAME:
+            relayed = await rtmt._process_message_to_client(session, message, client_ws, server_ws)
+            result.latencies["to_client"].append(time.perf_counter() - started)
+            if relayed is not None:
+                await client_ws.send_str(relayed)
+    await pending_tool_calls()
+    result.cpu_seconds = time.process_time() - start_cpu
+    return result
+
+def percentiles(values: list[float]) -> str:
+    if not values:
+        return "      -       -"
+    values = np.array(values) * 1e6
+    return f"{np.percentile(values, 50):7.1f} {np.percentile(values, 99):7.1f}"
+
+def digest(outputs: list[tuple[str, str]], direction: str) -> str:
+    hash = hashlib.sha256()
+    for output_direction, data in outputs:
+        if output_direction == direction:
+            hash.update(data.encode("utf-8") + b"\n")
+    return hash.hexdigest()[:16]
+
+async def main(paths: list[Path], speed: float, dump: Optional[Path]) -> None:
+    captures = sorted(capture for path in paths for capture in ([path] if path.is_file() else path.glob(f"*{CAPTURE_SUFFIX}")))
+    print(f"{'capture':<24} {'frames':>7} {'tools':>5}   {'up p50':>7} {'p99 µs':>7}   {'down p50':>8} {'p99 µs':>7}   {'CPU ms/audio s':>14}   {'to server':>16} {'to client':>16}")
+    for path in captures:
+        _, records = read_capture(path)
+        result = await replay(records, speed)
+        tool_calls = sum(record.kind == TOOL_RESULT for record in records)
+        cpu_per_audio_second = result.cpu_seconds / result.audio_seconds * 1000 if result.audio_seconds else 0.0
+        print(f"{path.stem[-24:]:<24} {len(records) - tool_calls:7} {tool_calls:5}   {percentiles(result.latencies['to_server'])}   "
+              f" {percentiles(result.latencies['to_client'])}   {cpu_per_audio_second:14.2f}   "
+              f"{digest(result.outputs, 'to_server'):>16} {digest(result.outputs, 'to_client'):>16}")
+        if dump is not None:
+            with dump.open("a", encoding="utf-8") as file:
+                for direction, data in result.outputs:
+                    file.write(json.dumps({"capture": path.name, "direction": direction, "frame": data}) + "\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("captures", nargs="+", type=Path, help="Capture files or directories of captures")
+    parser.add_argument("--speed", type=float, default=0.0, help="Pace relative to the capture, 0 for as fast as possible")
+    parser.add_argument("--dump", type=Path, help="File to append the frames the middle tier sent to")
+    args = parser.parse_args()
+    asyncio.run(main(args.captures, args.speed, args.dump))
@@ -0,0 +1,116 @@
+"""
+Multi-client benchmark of per-connection session state in RTMiddleTier.
+
+Drives N concurrent sessions through the server-to-client relay, each one receiving its own
+"session.created" and a series of function calls to a tool that reports the session it ran for,
+and checks that no session ever sees another session's ID, pending calls or "response.create".
+
+Run from app/backend:  python -m benchmarks.bench_sessions --sessions 200
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+
+from azure.core.credentials import AzureKeyCredential
+
+from rtmt import RTMiddleTier, Tool, ToolResult, ToolResultDirection, _current_session, get_current_session
+
+_whoami_tool_schema = {
+    "type": "function",
+    "name": "whoami",
+    "description": "Report the session the tool is running for",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "session_id": {
+                "type": "string",
+                "description": "The session ID"
+            }
+        }
+    }
+}
+
+class _FakeMessage:
+    def __init__(self, data: str):
+        self.data = data
+
+class _RecordingSocket:
+    def __init__(self):
+        self.closed = False
+        self.sent: list[dict] = []
+
+    async def send_json(self, data: dict) -> None:
+        self.sent.append(data)
+
+    async def send_str(self, data: str) -> None:
+        self.sent.append(json.loads(data))
+
+    async def close(self) -> None:
+        self.closed = True
+
+async def _whoami(args: dict) -> ToolResult:
+    await asyncio.sleep(0.001)
+    return ToolResult({"args": args["session_id"], "context": get_current_session().session_id}, ToolResultDirection.TO_SERVER)
+
+def _events(session_id: str, index: int, turns: int) -> list[dict]:
+    events = [{"type": "session.created", "session": {"id": session_id}}]
+    for turn in range(turns):
+        item = {"type": "function_call", "call_id": f"call_{index}_{turn}", "name": "whoami", "arguments": "{}"}
+        events.append({"type": "conversation.item.created", "previous_item_id": f"item_{index}_{turn}", "item": item})
+        events.append({"type": "response.output_item.done", "item": item})
+        events.append({"type": "response.done", "response": {"output": []}})
+    return events
+
+async def _run_session(rtmt: RTMiddleTier, index: int, turns: int) -> int:
+    """Relay one session's events and return the number of cross-talk violations seen."""
+    client_ws, server_ws = _RecordingSocket(), _RecordingSocket()
+    session = rtmt.sessions.create(client_ws)
+    await asyncio.create_task(_relay(rtmt, session, client_ws, server_ws, index, turns))
+
+    session_id = f"sess_{index}"
+    violations = 0
+    outputs = [m["item"]["output"] for m in server_ws.sent if m["type"] == "conversation.item.create"]
+    for output in outputs:
+        seen = json.loads(output)
+        violations += (seen["args"] != session_id) + (seen["context"] != session_id)
+    violations += abs(len(outputs) - turns)
+    violations += abs(sum(1 for m in server_ws.sent if m["type"] == "response.create") - turns)
+    rtmt.sessions.remove(session)
+    return violations
+
+async def _relay(rtmt, session, client_ws, server_ws, index: int, turns: int) -> None:
+    # Same per-connection context the websocket handler sets up
+    _current_session.set(session)
+    for event in _events(f"sess_{index}", index, turns):
+        await rtmt._process_message_to_client(session, _FakeMessage(json.dumps(event)), client_ws, server_ws)
+        # Let the other sessions interleave their events with ours
+        await asyncio.sleep(0)
+    # Tool calls and the "response.create" that follows them run in the background
+    await asyncio.gather(*session.tool_tasks.values(), *session.background_tasks)
+
+async def main(sessions: int, turns: int) -> None:
+    rtmt = RTMiddleTier("https://localhost", "bench", AzureKeyCredential("bench"))
+    rtmt.tools["whoami"] = Tool(schema=_whoami_tool_schema, target=_whoami)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    violations = await asyncio.gather(*(_run_session(rtmt, i, turns) for i in range(sessions)))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await rtmt.sessions.close()
+
+    print(f"{sessions} concurrent sessions, {turns} tool calls each")
+    print(f"wall time            {elapsed * 1000:10.1f} ms")
+    print(f"tool calls / second  {sessions * turns / elapsed:10.0f}")
+    print(f"peak memory/session  {peak / sessions / 1024:10.1f} KiB")
+    print(f"cross-talk           {sum(violations):10d}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100, help="Number of concurrent sessions")
+    parser.add_argument("--turns", type=int, default=10, help="Tool calls per session")
+    args = parser.parse_args()
+    asyncio.run(main(args.sessions, args.turns))
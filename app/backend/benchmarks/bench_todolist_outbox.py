@@ -0,0 +1,106 @@
+"""
+Benchmark of todolist_create_task with the outbox.
+
+Starts a stand-in for the create task Logic App on localhost that answers after --latency seconds and fails a
+--failure-rate share of the requests. --sessions concurrent sessions each dictate --tasks tasks, and the model
+calls the tool a second time for a --retry-rate share of them, as it does after a slow or failed call.
+Compares creating the task before answering (the former behaviour) with queuing it in the outbox, and reports
+the tool latency, the tasks lost and the duplicate tasks created.
+
+Run from app/backend:  python -m benchmarks.bench_todolist_outbox
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from aiohttp import web
+
+from agents.todolist_tools import _create_task, _deliver_tasks
+from utils import DurableQueue, ToolHttpClient, WriteBehindQueue
+
+def percentiles(values: list[float]) -> str:
+    values = np.array(values) * 1000
+    return f"p50 {np.percentile(values, 50):7.2f} ms  p99 {np.percentile(values, 99):7.2f} ms"
+
+class FakeLogicApp:
+    def __init__(self, latency: float, failure_rate: float):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.created: Counter[tuple[str, str]] = Counter()
+
+    async def create_task(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        await asyncio.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            return web.Response(status=503)
+        self.created[(body["taskList"], body["taskText"])] += 1
+        return web.Response()
+
+    def report(self, name: str, durations: list[float], dictated: int) -> None:
+        lost = dictated - len(self.created)
+        duplicates = sum(self.created.values()) - len(self.created)
+        print(f"{name:<8} {percentiles(durations)}  lost {lost:3}  duplicates {duplicates:3}")
+
+async def dictate(create, session: int, tasks: int, retry_rate: float) -> list[float]:
+    durations = []
+    for n in range(tasks):
+        args = {"session_id": f"session{session}", "text": f"Prepare sample {n} for experiment {session}"}
+        for _ in range(2 if random.random() < retry_rate else 1):
+            start = time.perf_counter()
+            await create(dict(args))
+            durations.append(time.perf_counter() - start)
+    return durations
+
+async def main(latency: float, failure_rate: float, sessions: int, tasks: int, retry_rate: float) -> None:
+    random.seed(0)
+    logic_app = FakeLogicApp(latency, failure_rate)
+    app = web.Application()
+    app.router.add_post("/tasks", logic_app.create_task)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/tasks"
+    http_client = ToolHttpClient()
+
+    async def direct_create(args) -> None:
+        # Former behaviour: the answer waits for the Logic App and a failure is only reported
+        try:
+            await _deliver_tasks(http_client, url, args["session_id"], [{"text": args["text"], "idempotency_key": ""}])
+        except Exception:
+            pass
+
+    durations = sum(await asyncio.gather(*(dictate(direct_create, s, tasks, retry_rate) for s in range(sessions))), [])
+    logic_app.report("direct", durations, sessions * tasks)
+
+    logic_app.created.clear()
+    with tempfile.TemporaryDirectory() as outbox_dir:
+        outbox = WriteBehindQueue(
+            DurableQueue(Path(outbox_dir) / "todolist.db"),
+            deliver=lambda task_list, queued: _deliver_tasks(http_client, url, task_list, queued),
+            max_delay=1.0,
+            retry_base=0.2)
+        await outbox.start()
+        durations = sum(await asyncio.gather(*(dictate(lambda args: _create_task(outbox, args), s, tasks, retry_rate) for s in range(sessions))), [])
+        while len(outbox) > 0:
+            await asyncio.sleep(0.05)
+        await outbox.close()
+    logic_app.report("outbox", durations, sessions * tasks)
+
+    await http_client.close()
+    await runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--latency", type=float, default=0.8, help="Seconds the Logic App takes to answer")
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--tasks", type=int, default=5, help="Tasks dictated per session")
+    parser.add_argument("--retry-rate", type=float, default=0.2, help="Share of the tasks the model sends twice")
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.failure_rate, args.sessions, args.tasks, args.retry_rate))
@@ -0,0 +1,78 @@
+"""
+Benchmark of the per-turn latency tracing of RTMiddleTier.
+
+Relays --turns synthetic turns (speech stopped, transcription, response created, --audio-frames audio deltas
+and response done) through the middle tier with and without a TurnTracer, and reports the relay cost per
+frame and per turn, the spans exported to a local OTLP JSON file, and the first audio latency of a trace.
+
+Run from app/backend:  python -m benchmarks.bench_tracing
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from azure.core.credentials import AzureKeyCredential
+
+from benchmarks.bench_relay import _audio_frames, _FakeMessage
+from rtmt import RTMiddleTier, RTSession
+from tracing import FileSpanExporter, TurnTracer
+
+class _FakeServerSocket:
+    async def send_json(self, data) -> None:
+        pass
+
+def turn_frames(audio_frames: int) -> list[_FakeMessage]:
+    events = [
+        {"type": "input_audio_buffer.speech_stopped", "audio_end_ms": 1200, "item_id": "item_1"},
+        {"type": "input_audio_buffer.committed", "item_id": "item_1"},
+        {"type": "conversation.item.input_audio_transcription.completed", "item_id": "item_1", "transcript": "what is the temperature"},
+        {"type": "response.created", "response": {"id": "response_1"}},
+    ]
+    frames = [_FakeMessage(json.dumps(event)) for event in events]
+    frames += _audio_frames("response.audio.delta", "delta", 100, 1)[:1] * audio_frames
+    frames.append(_FakeMessage(json.dumps({"type": "response.done", "response": {"id": "response_1", "output": []}})))
+    return frames
+
+async def relay(rtmt: RTMiddleTier, frames: list[_FakeMessage], turns: int) -> float:
+    session = RTSession(None)
+    server_ws = _FakeServerSocket()
+    start = time.process_time()
+    for _ in range(turns):
+        for frame in frames:
+            await rtmt._process_message_to_client(session, frame, None, server_ws)
+    return time.process_time() - start
+
+async def main(turns: int, audio_frames: int) -> None:
+    frames = turn_frames(audio_frames)
+    rtmt = RTMiddleTier(endpoint="https://localhost", deployment="gpt-4o-realtime-preview", credentials=AzureKeyCredential("key"))
+    await relay(rtmt, frames, 10)  # warm-up
+    untraced = await relay(rtmt, frames, turns)
+
+    with tempfile.TemporaryDirectory() as trace_dir:
+        path = Path(trace_dir) / "turns.jsonl"
+        rtmt.tracer = TurnTracer(FileSpanExporter(path), rtmt.metrics)
+        traced = await relay(rtmt, frames, turns)
+        start = time.perf_counter()
+        await rtmt.tracer._export()
+        export_seconds = time.perf_counter() - start
+        spans = json.loads(path.read_text().splitlines()[0])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+    per_frame = lambda seconds: seconds / (turns * len(frames)) * 1e6
+    print(f"relay without tracing  {per_frame(untraced):6.2f} µs per frame  {untraced / turns * 1e6:8.1f} µs per turn")
+    print(f"relay with tracing     {per_frame(traced):6.2f} µs per frame  {traced / turns * 1e6:8.1f} µs per turn")
+    print(f"export                 {len(spans)} spans of {turns} turns in {export_seconds * 1000:.1f} ms")
+    root = next(span for span in spans if span["name"] == "turn")
+    attributes = {attribute["key"]: attribute["value"] for attribute in root["attributes"]}
+    print(f"first trace            {[span['name'] for span in spans if span['traceId'] == root['traceId']]}")
+    print(f"                       events {[event['name'] for event in root['events']]}")
+    print(f"                       first audio after {attributes['turn.first_audio_ms']['doubleValue']} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--audio-frames", type=int, default=50, help="Audio deltas of each answer")
+    args = parser.parse_args()
+    asyncio.run(main(args.turns, args.audio_frames))
@@ -0,0 +1,230 @@
+"""
+Stand-in for the Azure OpenAI /openai/realtime websocket, to benchmark the middle tier without using quota.
+
+Every connection gets "session.created", then the server emulates server VAD: each --turn-audio-seconds of
+"input_audio_buffer.append" audio ends a user utterance with speech_stopped, committed and the transcription,
+and the answer follows. A --tool-call-rate share of the answers first call a tool, and the audio answer comes
+after the "response.create" the middle tier sends with the tool output. The answer streams
+--response-audio-seconds of "response.audio.delta" frames, paced in real time (or --audio-speed times faster,
+0 for as fast as possible), with transcript deltas.
+
+Audio frames sent by the server carry their send time in "event_id", and the server records the age of the
+client frames stamped the same way, so relay latency can be measured in both directions.
+
+Run standalone from app/backend to point the app at it (AZURE_OPENAI_ENDPOINT=http://localhost:8766):
+    python -m benchmarks.fake_realtime --port 8766
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import re
+import time
+from typing import Optional
+
+import aiohttp
+from aiohttp import web
+
+SAMPLE_RATE = 24000  # PCM16 mono, as the realtime API streams it
+BYTES_PER_SAMPLE = 2
+TOOL_NAME = "lookup"
+# Frames stamped with their send time carry it as the event ID, e.g. "event_t1712345678901234567"
+STAMPED_EVENT_ID = "event_t"
+_STAMP_PATTERN = re.compile(r'"event_id"\s*:\s*"event_t(\d+)"')
+_STAMP_SCAN_LIMIT = 128
+
+def stamp() -> str:
+    return f"{STAMPED_EVENT_ID}{time.time_ns()}"
+
+def frame_age(data: str) -> Optional[float]:
+    """Seconds since a stamped frame was sent, None if it isn't stamped."""
+    match = _STAMP_PATTERN.search(data, 0, _STAMP_SCAN_LIMIT)
+    return (time.time_ns() - int(match.group(1))) / 1e9 if match is not None else None
+
+def audio_payloads(frame_ms: int, count: int = 8) -> list[str]:
+    """Distinct base64 PCM16 frames of frame_ms, reused round robin to keep generating frames cheap."""
+    frame_bytes = SAMPLE_RATE * BYTES_PER_SAMPLE * frame_ms // 1000
+    return [base64.b64encode(os.urandom(frame_bytes)).decode("ascii") for _ in range(count)]
+
+def audio_seconds(base64_length: int) -> float:
+    return base64_length * 3 / 4 / (SAMPLE_RATE * BYTES_PER_SAMPLE)
+
+class FakeRealtimeStats:
+    connections: int = 0
+    frames_received: int = 0
+    frames_sent: int = 0
+    turns: int = 0
+    tool_calls: int = 0
+    # Age of the stamped client frames when they arrived, i.e. the client to server relay latency
+    latencies: list[float]
+
+    def __init__(self):
+        self.latencies = []
+
+class _Connection:
+    def __init__(self, server: "FakeRealtimeServer", ws: web.WebSocketResponse):
+        self.server = server
+        self.ws = ws
+        self.id = f"sess_{server.random.getrandbits(48):012x}"
+        self.audio_seconds = 0.0
+        self.turn: Optional[asyncio.Task] = None
+        self.response_create = asyncio.Event()
+        self.items = 0
+
+    async def send(self, event: dict) -> None:
+        await self.ws.send_str(json.dumps(event))
+        self.server.stats.frames_sent += 1
+
+    def item_id(self) -> str:
+        self.items += 1
+        return f"item_{self.items}"
+
+    async def run_turn(self) -> None:
+        server = self.server
+        user_item = self.item_id()
+        await self.send({"type": "input_audio_buffer.speech_stopped", "audio_end_ms": int(self.audio_seconds * 1000), "item_id": user_item})
+        await self.send({"type": "input_audio_buffer.committed", "previous_item_id": None, "item_id": user_item})
+        await asyncio.sleep(server.transcription_delay)
+        await self.send({"type": "conversation.item.input_audio_transcription.completed", "item_id": user_item, "content_index": 0,
+                         "transcript": "What was the temperature of the glovebox during experiment twelve?"})
+        await asyncio.sleep(server.response_delay)
+        if server.random.random() < server.tool_call_rate:
+            await self.call_tool(user_item)
+            self.response_create.clear()
+            await self.response_create.wait()
+            await asyncio.sleep(server.response_delay)
+        await self.answer()
+        server.stats.turns += 1
+
+    async def call_tool(self, previous_item: str) -> None:
+        response_id = f"resp_{self.item_id()}"
+        call_id = f"call_{self.item_id()}"
+        arguments = json.dumps({"query": "glovebox temperature experiment 12"})
+        item = {"id": self.item_id(), "type": "function_call", "status": "completed", "name": TOOL_NAME, "call_id": call_id, "arguments": arguments}
+        await self.send({"type": "response.created", "response": {"id": response_id, "status": "in_progress", "output": []}})
+        await self.send({"type": "response.output_item.added", "response_id": response_id, "output_index": 0, "item": {**item, "status": "in_progress", "arguments": ""}})
+        await self.send({"type": "conversation.item.created", "previous_item_id": previous_item, "item": {**item, "status": "in_progress", "arguments": ""}})
+        await self.send({"type": "response.function_call_arguments.delta", "response_id": response_id, "item_id": item["id"], "call_id": call_id, "delta": arguments})
+        await self.send({"type": "response.function_call_arguments.done", "response_id": response_id, "item_id": item["id"], "call_id": call_id, "arguments": arguments})
+        await self.send({"type": "response.output_item.done", "response_id": response_id, "output_index": 0, "item": item})
+        await self.send({"type": "response.done", "response": {"id": response_id, "status": "completed", "output": [item]}})
+        self.server.stats.tool_calls += 1
+
+    async def answer(self) -> None:
+        server = self.server
+        response_id = f"resp_{self.item_id()}"
+        item_id = self.item_id()
+        await self.send({"type": "response.created", "response": {"id": response_id, "status": "in_progress", "output": []}})
+        await self.send({"type": "response.output_item.added", "response_id": response_id, "output_index": 0,
+                         "item": {"id": item_id, "type": "message", "role": "assistant", "content": []}})
+        prefix = '{"type":"response.audio.delta","event_id":"'
+        suffix = f'","response_id":"{response_id}","item_id":"{item_id}","output_index":0,"content_index":0,"delta":"'
+        frames = int(server.response_audio_seconds * 1000 / server.frame_ms)
+        interval = server.frame_ms / 1000 / server.audio_speed if server.audio_speed > 0 else 0.0
+        start = time.monotonic()
+        for n in range(frames):
+            if n % 5 == 0:
+                await self.send({"type": "response.audio_transcript.delta", "response_id": response_id, "item_id": item_id, "delta": "The temperature was "})
+            await self.ws.send_str(prefix + stamp() + suffix + server.payloads[n % len(server.payloads)] + '"}')
+            server.stats.frames_sent += 1
+            # Paced on an absolute schedule, so the send time doesn't add up
+            delay = start + (n + 1) * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif interval == 0 and n % 10 == 9:
+                await asyncio.sleep(0)
+        await self.send({"type": "response.audio.done", "response_id": response_id, "item_id": item_id})
+        await self.send({"type": "response.done", "response": {"id": response_id, "status": "completed", "output": [
+            {"id": item_id, "type": "message", "role": "assistant", "content": [{"type": "audio", "transcript": "The temperature was 21 degrees."}]}]}})
+
+    def on_audio(self, data: str) -> None:
+        server = self.server
+        if (age := frame_age(data)) is not None:
+            server.stats.latencies.append(age)
+        match = re.search(r'"audio"\s*:\s*"', data)
+        self.audio_seconds += audio_seconds(len(data) - match.end() - 2) if match is not None else 0.0
+        if self.audio_seconds >= server.turn_audio_seconds and (self.turn is None or self.turn.done()):
+            self.audio_seconds = 0.0
+            self.turn = asyncio.create_task(self.run_turn())
+
+    async def on_event(self, event: dict) -> None:
+        match event.get("type"):
+            case "session.update":
+                await self.send({"type": "session.updated", "session": {"id": self.id, **event.get("session", {})}})
+            case "response.create":
+                self.response_create.set()
+            case "conversation.item.create":
+                await self.send({"type": "conversation.item.created", "previous_item_id": None, "item": {"id": self.item_id(), **event.get("item", {})}})
+            case "input_audio_buffer.clear":
+                await self.send({"type": "input_audio_buffer.cleared"})
+
+class FakeRealtimeServer:
+    """Scriptable fake of the realtime API, see the module docstring. Serve it with app() or start()."""
+    stats: FakeRealtimeStats
+
+    def __init__(self, frame_ms: int = 100, turn_audio_seconds: float = 3.0, response_audio_seconds: float = 2.0,
+                 audio_speed: float = 1.0, tool_call_rate: float = 0.3, transcription_delay: float = 0.05,
+                 response_delay: float = 0.2, seed: int = 0):
+        self.frame_ms = frame_ms
+        self.turn_audio_seconds = turn_audio_seconds
+        self.response_audio_seconds = response_audio_seconds
+        self.audio_speed = audio_speed
+        self.tool_call_rate = tool_call_rate
+        self.transcription_delay = transcription_delay
+        self.response_delay = response_delay
+        self.random = random.Random(seed)
+        self.payloads = audio_payloads(frame_ms)
+        self.stats = FakeRealtimeStats()
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        connection = _Connection(self, ws)
+        self.stats.connections += 1
+        await connection.send({"type": "session.created", "session": {"id": connection.id, "object": "realtime.session", "model": "gpt-4o-realtime-preview",
+                                                                      "modalities": ["text", "audio"], "voice": "alloy", "tools": []}})
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT:
+                    continue
+                self.stats.frames_received += 1
+                if msg.data.startswith('{"type":"input_audio_buffer.append"'):
+                    connection.on_audio(msg.data)
+                else:
+                    await connection.on_event(json.loads(msg.data))
+        finally:
+            if connection.turn is not None:
+                connection.turn.cancel()
+        return ws
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/openai/realtime", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serves the fake and returns its base URL, to use as the middle tier endpoint."""
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--turn-audio-seconds", type=float, default=3.0, help="Client audio making up a user utterance")
+    parser.add_argument("--response-audio-seconds", type=float, default=2.0)
+    parser.add_argument("--audio-speed", type=float, default=1.0, help="Answer audio pace relative to real time, 0 for unpaced")
+    parser.add_argument("--tool-call-rate", type=float, default=0.3, help="Share of the answers calling a tool first")
+    args = parser.parse_args()
+    server = FakeRealtimeServer(turn_audio_seconds=args.turn_audio_seconds, response_audio_seconds=args.response_audio_seconds,
+                                audio_speed=args.audio_speed, tool_call_rate=args.tool_call_rate)
+    web.run_app(server.app(), host="localhost", port=args.port)
@@ -0,0 +1,245 @@
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import re
+import struct
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("voiceassistant")
+
+CAPTURE_MAGIC = b"RTCAP1\n"
+CAPTURE_SUFFIX = ".rtcap"
+# raw stores the decoded PCM16 audio next to the rest of the frame, base64 the frames as received and none
+# only the length of the audio, replayed as silence
+AUDIO_MODES = ("raw", "base64", "none")
+
+# Record kinds
+CLIENT_FRAME = 1
+SERVER_FRAME = 2
+TOOL_RESULT = 3
+
+# Kind, nanoseconds since the start of the session, offset of the audio in the text, text bytes, audio bytes.
+# The text (UTF-8) and the stored audio follow the header.
+_RECORD = struct.Struct("<BQIII")
+# Audio events and the field carrying their base64 audio, the field must be the last one of the frame
+_AUDIO_EVENT = re.compile(r'\s*\{\s*"type"\s*:\s*"(input_audio_buffer\.append|response\.audio\.delta)"')
+_AUDIO_FIELD = {
+    "input_audio_buffer.append": re.compile(r'"audio"\s*:\s*"'),
+    "response.audio.delta": re.compile(r'"delta"\s*:\s*"'),
+}
+_EVENT_SCAN_LIMIT = 128
+
+class CaptureRecord:
+    __slots__ = ("kind", "timestamp_ns", "data")
+    kind: int
+    timestamp_ns: int
+    # The frame as received, or the JSON of a tool result
+    data: str
+
+    def __init__(self, kind: int, timestamp_ns: int, data: str):
+        self.kind = kind
+        self.timestamp_ns = timestamp_ns
+        self.data = data
+
+def read_capture(path: Path | str) -> tuple[dict[str, Any], list[CaptureRecord]]:
+    """Header and records of a capture, with the audio frames rebuilt as they were received."""
+    data = Path(path).read_bytes()
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{path} isn't a session capture")
+    header_end = data.index(b"\n", len(CAPTURE_MAGIC))
+    header = json.loads(data[len(CAPTURE_MAGIC):header_end])
+    stores_audio = header["audio"] == "raw"
+    records = []
+    position = header_end + 1
+    while position + _RECORD.size <= len(data):
+        kind, timestamp_ns, offset, text_length, audio_length = _RECORD.unpack_from(data, position)
+        position += _RECORD.size
+        text = data[position:position + text_length].decode("utf-8")
+        position += text_length
+        if audio_length > 0:
+            if stores_audio:
+                audio = data[position:position + audio_length]
+                position += audio_length
+            else:
+                audio = bytes(audio_length)
+            text = text[:offset] + base64.b64encode(audio).decode("ascii") + text[offset:]
+        records.append(CaptureRecord(kind, timestamp_ns, text))
+    # A truncated last record (e.g. the process was killed while writing) is ignored
+    return header, records
+
+class SessionCapture:
+    """
+    Frames and tool results of one session, buffered in memory and written to path by the SessionRecorder.
+    Recording only copies the frame into the buffer, so it can be done on the relay path.
+    """
+    path: Path
+    audio: str
+    max_buffered_bytes: int
+    dropped: int
+    closed: bool
+    # Consecutive flushes that couldn't write the buffer
+    write_failures: int
+
+    def __init__(self, path: Path, session_id: str, audio: str = "raw", max_buffered_bytes: int = 16 * 1024 * 1024):
+        if audio not in AUDIO_MODES:
+            raise ValueError(f"Unknown audio mode {audio}, expected one of {', '.join(AUDIO_MODES)}")
+        self.path = path
+        self.audio = audio
+        self.max_buffered_bytes = max_buffered_bytes
+        self.dropped = 0
+        self.closed = False
+        self.write_failures = 0
+        self._started = time.monotonic_ns()
+        header = {"session_id": session_id, "started_at": time.time_ns(), "audio": audio}
+        self._buffer = bytearray(CAPTURE_MAGIC + json.dumps(header).encode("utf-8") + b"\n")
+
+    def _append(self, kind: int, text: str, offset: int = 0, audio: bytes = b"", audio_length: int = 0) -> None:
+        if len(self._buffer) > self.max_buffered_bytes:
+            # The disk can't keep up, rather lose frames than memory
+            self.dropped += 1
+            return
+        encoded = text.encode("utf-8")
+        self._buffer += _RECORD.pack(kind, time.monotonic_ns() - self._started, offset, len(encoded), audio_length)
+        self._buffer += encoded
+        self._buffer += audio
+
+    def _frame(self, kind: int, data: str) -> None:
+        if self.audio != "base64" and (match := _AUDIO_EVENT.match(data, 0, _EVENT_SCAN_LIMIT)) is not None:
+            field = _AUDIO_FIELD[match.group(1)].search(data)
+            end = data.find('"', field.end()) if field is not None else -1
+            if end != -1:
+                try:
+                    audio = base64.b64decode(data[field.end():end], validate=True)
+                except binascii.Error:
+                    audio = None
+                if audio:
+                    self._append(kind, data[:field.end()] + data[end:], field.end(), audio if self.audio == "raw" else b"", len(audio))
+                    return
+        self._append(kind, data)
+
+    def client_frame(self, data: str) -> None:
+        """A frame received from the client, before the middle tier processes it."""
+        self._frame(CLIENT_FRAME, data)
+
+    def server_frame(self, data: str) -> None:
+        """A frame received from the realtime API, before the middle tier processes it."""
+        self._frame(SERVER_FRAME, data)
+
+    def tool_result(self, call_id: str, name: str, arguments: str, result: Optional[str], destination: Optional[str],
+                    seconds: float, error: Optional[str] = None) -> None:
+        self._append(TOOL_RESULT, json.dumps({"call_id": call_id, "name": name, "arguments": arguments, "result": result,
+                                              "destination": destination, "seconds": seconds, "error": error}))
+
+    def take(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def restore(self, data: bytes) -> None:
+        """Put back data taken but not written, ahead of what was recorded since."""
+        self._buffer[:0] = data
+
+    def close(self) -> None:
+        self.closed = True
+
+class SessionRecorder:
+    """
+    Captures the /realtime sessions to one compact file each in directory, to replay them offline (see
+    benchmarks/bench_replay.py): both directions as received, with timestamps, and the tool results. Audio
+    frames are stored as raw PCM16 by default, a quarter smaller than base64, or dropped with audio "none".
+    Data that can't be written stays buffered and is retried at the next flush, up to max_write_attempts
+    times once its session is closed.
+
+    Captures hold what the users said, enable them for troubleshooting only.
+    """
+    directory: Path
+    audio: str
+    flush_interval: float
+    max_write_attempts: int
+    bytes_written: int
+
+    def __init__(self, directory: Path | str, audio: str = "raw", flush_interval: float = 1.0, max_buffered_bytes: int = 16 * 1024 * 1024,
+                 max_write_attempts: int = 10):
+        if audio not in AUDIO_MODES:
+            raise ValueError(f"Unknown audio mode {audio}, expected one of {', '.join(AUDIO_MODES)}")
+        self.directory = Path(directory)
+        self.audio = audio
+        self.flush_interval = flush_interval
+        self.max_buffered_bytes = max_buffered_bytes
+        self.max_write_attempts = max_write_attempts
+        self.bytes_written = 0
+        self._captures: list[SessionCapture] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def open(self, session_id: str) -> SessionCapture:
+        name = f"{datetime.now():%Y%m%dT%H%M%S}-{session_id}{CAPTURE_SUFFIX}"
+        capture = SessionCapture(self.directory / name, session_id, self.audio, self.max_buffered_bytes)
+        self._captures.append(capture)
+        return capture
+
+    def _write(self, pending: list[tuple[SessionCapture, bytes]]) -> list[tuple[SessionCapture, bytes, OSError]]:
+        """Appends the data of every capture, returns the ones that couldn't be written."""
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            return [(capture, data, e) for capture, data in pending]
+        failed = []
+        for capture, data in pending:
+            try:
+                with capture.path.open("ab") as file:
+                    start = file.tell()
+                    try:
+                        file.write(data)
+                        file.flush()
+                    except OSError:
+                        # Don't leave a partial write behind, the whole data is written again at the next flush
+                        file.truncate(start)
+                        raise
+            except OSError as e:
+                failed.append((capture, data, e))
+        return failed
+
+    async def flush(self) -> None:
+        # Captures closed from here on are removed at the next flush, once what they recorded since is written
+        captures = list(self._captures)
+        pending = [(capture, capture.take()) for capture in captures]
+        pending = [(capture, data) for capture, data in pending if data]
+        failed = await asyncio.to_thread(self._write, pending) if pending else []
+        for capture, data, e in failed:
+            capture.restore(data)
+            capture.write_failures += 1
+            logger.warning(f"Can't write the session capture {capture.path.name}: {e}")
+        failed_captures = {capture for capture, _, _ in failed}
+        self.bytes_written += sum(len(data) for capture, data in pending if capture not in failed_captures)
+        for capture in captures:
+            if capture in failed_captures:
+                if not capture.closed or capture.write_failures < self.max_write_attempts:
+                    continue
+                logger.warning(f"Giving up on the session capture {capture.path.name}")
+            else:
+                capture.write_failures = 0
+            if capture.closed:
+                if capture.dropped:
+                    logger.warning(f"Capture {capture.path.name} dropped {capture.dropped} records")
+                self._captures.remove(capture)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def cleanup_ctx(self, app: web.Application):
+        self._task = asyncio.create_task(self._run())
+        yield
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        for capture in self._captures:
+            capture.close()
+        await self.flush()
@@ -0,0 +1,7 @@
+from .device import MachineDevice, MachinePoller, SimulatedDevice
+from .history import MachineHistory, MachineHistorySampler, PositionHistory
+from .publisher import MachineStatePublisher
+from .query import DIRECTIONS, STEADY_RATE, TRENDS, find_deviations
+from .state_store import MachineSnapshot, MachineStateStore
+
+__all__ = ['DIRECTIONS', 'MachineDevice', 'MachineHistory', 'MachineHistorySampler', 'MachinePoller', 'MachineSnapshot', 'MachineStatePublisher', 'MachineStateStore', 'PositionHistory', 'STEADY_RATE', 'SimulatedDevice', 'TRENDS', 'find_deviations']
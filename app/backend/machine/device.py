@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import numpy as np
+from aiohttp import web
+
+from .state_store import MachineSnapshot, MachineStateStore
+
+logger = logging.getLogger("voiceassistant")
+
+class MachineDevice(ABC):
+    """
+    Hardware interface of the machine. Positions are numbered like in the MachineStateStore. Calls can be
+    slow, they are only made by the MachinePoller, never while a tool call waits.
+    """
+
+    @abstractmethod
+    async def read_temperatures(self) -> np.ndarray:
+        """Current temperature of every position."""
+
+    @abstractmethod
+    async def write_setpoints(self, indexes: list[int], setpoints: list[float]) -> None:
+        """Set the setpoints of the positions at indexes."""
+
+    async def close(self) -> None:
+        pass
+
+class SimulatedDevice(MachineDevice):
+    """
+    Stand-in for the machine to develop and benchmark without hardware. Every call takes latency seconds,
+    and positions head for their setpoint exponentially with the given time constant, at most max_rate °C
+    per second. A setpoint of 0 means the position isn't regulated and drifts to the ambient temperature,
+    as in the initial simulated state. Readings get Gaussian noise of standard deviation noise °C.
+    """
+    latency: float
+    time_constant: float
+    max_rate: float
+    ambient: float
+    noise: float
+
+    def __init__(self,
+                 setpoints: np.ndarray,
+                 temperatures: np.ndarray,
+                 latency: float = 0.2,
+                 time_constant: float = 120.0,
+                 max_rate: float = 1.0,
+                 ambient: float = 25.0,
+                 noise: float = 0.05,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.time_constant = time_constant
+        self.max_rate = max_rate
+        self.ambient = ambient
+        self.noise = noise
+        self._setpoints = np.array(setpoints, dtype=np.float64)
+        self._temperatures = np.array(temperatures, dtype=np.float64)
+        self._rng = np.random.default_rng(seed)
+        self._updated_at = time.monotonic()
+
+    @classmethod
+    def from_snapshot(cls, snapshot: MachineSnapshot, **kwargs) -> "SimulatedDevice":
+        return cls(snapshot.setpoints, snapshot.temperatures, **kwargs)
+
+    def _advance(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated_at
+        self._updated_at = now
+        targets = np.where(self._setpoints > 0, self._setpoints, self.ambient)
+        step = (targets - self._temperatures) * -np.expm1(-elapsed / self.time_constant)
+        self._temperatures += np.clip(step, -self.max_rate * elapsed, self.max_rate * elapsed)
+
+    async def read_temperatures(self) -> np.ndarray:
+        await asyncio.sleep(self.latency)
+        self._advance()
+        return self._temperatures + self._rng.normal(0.0, self.noise, len(self._temperatures))
+
+    async def write_setpoints(self, indexes: list[int], setpoints: list[float]) -> None:
+        await asyncio.sleep(self.latency)
+        self._advance()
+        self._setpoints[indexes] = setpoints
+
+class MachinePoller:
+    """
+    Keeps the MachineStateStore in sync with a slow device, so tools answer from the latest snapshot instead
+    of waiting on the device: temperatures are read in the background every interval seconds, and setpoint
+    writes are queued and sent to the device one at a time, the store being updated once the device took them.
+    """
+    interval: float
+    reads: int
+    read_failures: int
+
+    def __init__(self, store: MachineStateStore, device: MachineDevice, interval: float = 1.0):
+        self.store = store
+        self.device = device
+        self.interval = interval
+        self.reads = 0
+        self.read_failures = 0
+        self._commands: asyncio.Queue[tuple[list[int], list[float], asyncio.Future]] = asyncio.Queue()
+        # The device handles one call at a time
+        self._device_lock = asyncio.Lock()
+        self._tasks: list[asyncio.Task] = []
+
+    async def set_setpoints(self, indexes: list[int], setpoints: list[float]) -> MachineSnapshot:
+        """Queue a setpoint write, returns the snapshot that includes it once the device took it."""
+        future = asyncio.get_running_loop().create_future()
+        await self._commands.put((indexes, setpoints, future))
+        return await future
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._poll()), asyncio.create_task(self._run_commands())]
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while not self._commands.empty():
+            _, _, future = self._commands.get_nowait()
+            if not future.done():
+                future.set_exception(ConnectionError("The machine connection is closed"))
+        await self.device.close()
+
+    def cleanup_ctx(self):
+        async def cleanup_ctx(app: web.Application):
+            self.start()
+            yield
+            await self.close()
+        return cleanup_ctx
+
+    async def _poll(self) -> None:
+        next_read = time.monotonic()
+        while True:
+            try:
+                async with self._device_lock:
+                    temperatures = await self.device.read_temperatures()
+                await self.store.set_temperatures(temperatures, read_at=time.time())
+                self.reads += 1
+            except Exception as e:
+                self.read_failures += 1
+                logger.warning(f"Can't read the machine temperatures: {e}")
+            # Fixed rate, unless reads take longer than the interval
+            next_read = max(next_read + self.interval, time.monotonic())
+            await asyncio.sleep(next_read - time.monotonic())
+
+    async def _run_commands(self) -> None:
+        while True:
+            indexes, setpoints, future = await self._commands.get()
+            if future.done():
+                # The tool call was cancelled while the command was queued
+                continue
+            try:
+                async with self._device_lock:
+                    await self.device.write_setpoints(indexes, setpoints)
+                snapshot = await self.store.set_setpoints(indexes, setpoints)
+            except Exception as e:
+                logger.warning(f"Can't write the machine setpoints: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(snapshot)
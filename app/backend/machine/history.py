@@ -0,0 +1,128 @@
+import asyncio
+import time
+from typing import Optional
+
+import numpy as np
+from aiohttp import web
+
+from .state_store import MachineSnapshot, MachineStateStore
+
+class PositionHistory:
+    """Temperature readings of one position over a time window, oldest first."""
+    times: np.ndarray
+    temperatures: np.ndarray
+
+    def __init__(self, times: np.ndarray, temperatures: np.ndarray):
+        self.times = times
+        self.temperatures = temperatures
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def downsample(self, points: int) -> np.ndarray:
+        """Mean temperature of up to points equal slices of the window."""
+        points = min(points, len(self))
+        starts = (np.arange(points) * len(self)) // points
+        return np.add.reduceat(self.temperatures, starts) / np.diff(np.append(starts, len(self)))
+
+    def rate(self, seconds: float) -> Optional[float]:
+        """Least squares slope of the temperature over the last seconds of the window, in °C per second."""
+        recent = self.times >= self.times[-1] - seconds
+        times, temperatures = self.times[recent], self.temperatures[recent]
+        if len(times) < 2 or times[-1] == times[0]:
+            return None
+        centered = times - times.mean()
+        return float((centered * (temperatures - temperatures.mean())).sum() / (centered * centered).sum())
+
+class MachineHistory:
+    """
+    Temperature history of every position, fed by the snapshots of the MachineStateStore.
+
+    Readings are kept in a fixed-size ring of rows, one row per snapshot with a column per position, so
+    memory stays at capacity × positions floats however long the server runs and the oldest readings are
+    overwritten first.
+    """
+    capacity: int
+
+    def __init__(self, positions: int, capacity: int = 3600):
+        self.capacity = capacity
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._temperatures = np.zeros((capacity, positions), dtype=np.float32)
+        # Next row to write, and rows written so far up to capacity
+        self._next = 0
+        self._count = 0
+        self._last_temperatures: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def on_snapshot(self, snapshot: MachineSnapshot) -> None:
+        # Setpoint changes share the temperature column of the previous snapshot, there is nothing new to record
+        if snapshot.temperatures is self._last_temperatures:
+            return
+        self._last_temperatures = snapshot.temperatures
+        self.record(snapshot.taken_at, snapshot.temperatures)
+
+    def record(self, timestamp: float, temperatures: np.ndarray) -> None:
+        self._times[self._next] = timestamp
+        self._temperatures[self._next] = temperatures
+        self._next = (self._next + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _rows(self, since: float) -> np.ndarray:
+        """Rows recorded at or after the since timestamp, in chronological order."""
+        # The oldest row is the next one to be overwritten once the ring is full
+        order = np.arange(self._next - self._count, self._next) % self.capacity
+        return order[np.searchsorted(self._times[order], since):]
+
+    def position(self, index: int, since: float) -> PositionHistory:
+        """Readings of a position taken at or after the since timestamp."""
+        rows = self._rows(since)
+        return PositionHistory(self._times[rows], self._temperatures[rows, index].astype(np.float64))
+
+    def rates(self, since: float) -> Optional[np.ndarray]:
+        """Least squares slope of the temperature of every position since the timestamp, in °C per second."""
+        rows = self._rows(since)
+        if len(rows) < 2:
+            return None
+        centered = self._times[rows] - self._times[rows].mean()
+        variance = (centered * centered).sum()
+        if variance == 0:
+            return None
+        # The centered times sum to zero, so the temperatures don't need centering
+        return (centered @ self._temperatures[rows].astype(np.float64)) / variance
+
+class MachineHistorySampler:
+    """
+    Records the current temperatures of a store into a MachineHistory every interval seconds, for stores that
+    no MachinePoller refreshes. Snapshots only change when something writes to the store, so without it the
+    history would hold nothing recent to answer from once the readings of the last change fell out of the window.
+    """
+    interval: float
+
+    def __init__(self, store: MachineStateStore, history: MachineHistory, interval: float = 1.0):
+        self.store = store
+        self.history = history
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def cleanup_ctx(self):
+        async def cleanup_ctx(app: web.Application):
+            self.start()
+            yield
+            await self.close()
+        return cleanup_ctx
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self.history.record(time.time(), self.store.snapshot.temperatures)
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from typing import Any
+
+import numpy as np
+
+from rtmt import RTMiddleTier, RTSession
+from .state_store import MachineSnapshot, MachineStateStore
+
+logger = logging.getLogger("voiceassistant")
+
+SUBSCRIBE_EVENT = "extension.machine_state.subscribe"
+UNSUBSCRIBE_EVENT = "extension.machine_state.unsubscribe"
+STATE_EVENT = "extension.machine_state"
+
+class _Subscription:
+    session: RTSession
+    min_interval: float
+    last_sent_at: float
+    # Values last sent to the client, the deltas are computed against them
+    setpoints: np.ndarray
+    temperatures: np.ndarray
+    flush_scheduled: bool
+
+    def __init__(self, session: RTSession, min_interval: float, snapshot: MachineSnapshot):
+        self.session = session
+        self.min_interval = min_interval
+        self.last_sent_at = time.monotonic()
+        self.setpoints = snapshot.setpoints
+        self.temperatures = snapshot.temperatures.copy()
+        self.flush_scheduled = False
+
+class MachineStatePublisher:
+    """
+    Pushes machine state changes to the clients that subscribed, so the UI can show live readings without
+    asking the model. A client sends {"type": "extension.machine_state.subscribe"} (with an optional
+    "min_interval" in seconds) and gets an "extension.machine_state" event with every position, then events
+    with only the positions whose setpoint changed or whose temperature moved by deadband °C or more.
+
+    Changes are coalesced per client: at most one event every min_interval seconds, carrying the latest state.
+    """
+    min_interval: float
+    deadband: float
+    events_sent: int
+
+    def __init__(self, store: MachineStateStore, min_interval: float = 1.0, deadband: float = 0.05):
+        self.store = store
+        self.min_interval = min_interval
+        self.deadband = deadband
+        self.events_sent = 0
+        self._subscriptions: dict[str, _Subscription] = {}
+
+    def __len__(self) -> int:
+        return len(self._subscriptions)
+
+    def attach(self, rtmt: RTMiddleTier) -> None:
+        rtmt.client_extension_handlers[SUBSCRIBE_EVENT] = self._subscribe
+        rtmt.client_extension_handlers[UNSUBSCRIBE_EVENT] = self._unsubscribe
+        rtmt.session_closed_listeners.append(self._unsubscribe)
+        self.store.listeners.append(self.on_snapshot)
+
+    async def _subscribe(self, session: RTSession, message: dict[str, Any]) -> None:
+        # Clients can ask for fewer updates, not for more
+        min_interval = max(self.min_interval, float(message.get("min_interval") or 0))
+        snapshot = self.store.snapshot
+        self._subscriptions[session.id] = _Subscription(session, min_interval, snapshot)
+        await self._send(session, snapshot, np.arange(len(self.store)))
+
+    async def _unsubscribe(self, session: RTSession, message: dict[str, Any] | None = None) -> None:
+        self._subscriptions.pop(session.id, None)
+
+    def on_snapshot(self, snapshot: MachineSnapshot) -> None:
+        for subscription in self._subscriptions.values():
+            if not subscription.flush_scheduled:
+                subscription.flush_scheduled = True
+                subscription.session.run_in_background(self._flush(subscription))
+
+    async def _flush(self, subscription: _Subscription) -> None:
+        delay = subscription.last_sent_at + subscription.min_interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        subscription.flush_scheduled = False
+        if self._subscriptions.get(subscription.session.id) is not subscription:
+            return
+        # Whatever changed while waiting goes out in this one event
+        snapshot = self.store.snapshot
+        changed = np.flatnonzero((snapshot.setpoints != subscription.setpoints)
+                                 | (np.abs(snapshot.temperatures - subscription.temperatures) >= self.deadband))
+        if len(changed) == 0:
+            return
+        subscription.setpoints = snapshot.setpoints
+        # Positions under the deadband keep their last sent value, so slow drifts are sent once they add up
+        subscription.temperatures[changed] = snapshot.temperatures[changed]
+        subscription.last_sent_at = time.monotonic()
+        await self._send(subscription.session, snapshot, changed)
+
+    async def _send(self, session: RTSession, snapshot: MachineSnapshot, indexes: np.ndarray) -> None:
+        try:
+            await session.client_ws.send_json({
+                "type": STATE_EVENT,
+                "version": snapshot.version,
+                "read_at": snapshot.read_at,
+                "positions": [
+                    {
+                        "deck": self.store.position_decks[i],
+                        "position": self.store.position_names[i],
+                        "setpoint": float(snapshot.setpoints[i]),
+                        "temperature": round(float(snapshot.temperatures[i]), 2),
+                    }
+                    for i in indexes.tolist()
+                ]
+            })
+            self.events_sent += 1
+        except Exception as e:
+            logger.info(f"Can't push the machine state to session {session.id}, unsubscribing: {e}")
+            self._subscriptions.pop(session.id, None)
@@ -0,0 +1,47 @@
+from typing import Optional
+
+import numpy as np
+
+from .state_store import MachineSnapshot
+
+# °C per second under which a position counts as neither heating nor cooling
+STEADY_RATE = 0.05 / 60
+
+DIRECTIONS = ("above", "below", "any")
+TRENDS = ("heating", "cooling", "stable", "any")
+
+def find_deviations(snapshot: MachineSnapshot,
+                    rates: Optional[np.ndarray] = None,
+                    positions: Optional[np.ndarray] = None,
+                    min_deviation: float = 0.0,
+                    direction: str = "any",
+                    trend: str = "any") -> np.ndarray:
+    """
+    Indexes of the positions matching all the criteria, largest deviation from the setpoint first, computed
+    over the whole setpoint and temperature columns at once.
+
+    positions: boolean mask of the positions to consider, all by default.
+    min_deviation: minimum distance in °C between temperature and setpoint, positions at exactly their
+    setpoint only match with 0.
+    direction: whether the temperature must be above or below the setpoint.
+    trend: whether the position must be heating, cooling or stable, needs the rates in °C per second.
+    """
+    deviations = snapshot.temperatures - snapshot.setpoints
+    matches = np.abs(deviations) >= min_deviation
+    if positions is not None:
+        matches &= positions
+    if direction == "above":
+        matches &= deviations > 0
+    elif direction == "below":
+        matches &= deviations < 0
+    if trend != "any":
+        if rates is None:
+            raise ValueError("The trend of the positions needs a temperature history")
+        if trend == "heating":
+            matches &= rates > STEADY_RATE
+        elif trend == "cooling":
+            matches &= rates < -STEADY_RATE
+        else:
+            matches &= np.abs(rates) <= STEADY_RATE
+    found = np.flatnonzero(matches)
+    return found[np.argsort(-np.abs(deviations[found]), kind="stable")]
@@ -0,0 +1,118 @@
+import asyncio
+import time
+from typing import Callable, Iterable, Optional
+
+import numpy as np
+
+from models.junior import Deck, JuniorMachineState, PositionReading
+
+class MachineSnapshot:
+    """
+    Immutable view of every position of the machine at one point in time. Positions are numbered in deck
+    order and their setpoints and temperatures are kept in NumPy columns rather than pydantic objects.
+    """
+    version: int
+    # time.time() of the change that produced this snapshot
+    taken_at: float
+    setpoints: np.ndarray
+    temperatures: np.ndarray
+    # time.time() of the device read the temperatures come from, None when they don't come from a device
+    read_at: Optional[float]
+
+    def __init__(self, version: int, taken_at: float, setpoints: np.ndarray, temperatures: np.ndarray, read_at: Optional[float] = None):
+        setpoints.flags.writeable = False
+        temperatures.flags.writeable = False
+        self.version = version
+        self.taken_at = taken_at
+        self.setpoints = setpoints
+        self.temperatures = temperatures
+        self.read_at = read_at
+
+class MachineStateStore:
+    """
+    State of all decks and positions of the machine, shared by every session.
+
+    Positions are looked up by (deck, position) name in constant time. Readers take the current snapshot,
+    which is never modified: writers hold a lock while they copy the columns, apply their changes and swap
+    the new snapshot in, so concurrent sessions always read a consistent state and never lose an update.
+    """
+    deck_names: list[str]
+    position_names: list[str]
+    # Deck of each position
+    position_decks: list[str]
+    # Called with each new snapshot, after it's swapped in
+    listeners: list[Callable[[MachineSnapshot], None]]
+
+    def __init__(self, decks: Iterable[tuple[str, Iterable[tuple[str, float, float]]]]):
+        """decks: name of each deck with the (name, setpoint, temperature) of its positions."""
+        self.deck_names = []
+        self.position_names = []
+        self.position_decks = []
+        self._index: dict[tuple[str, str], int] = {}
+        self._deck_slices: dict[str, slice] = {}
+        setpoints, temperatures = [], []
+        for deck_name, positions in decks:
+            start = len(self.position_names)
+            for position_name, setpoint, temperature in positions:
+                self._index[(deck_name, position_name)] = len(self.position_names)
+                self.position_names.append(position_name)
+                self.position_decks.append(deck_name)
+                setpoints.append(setpoint)
+                temperatures.append(temperature)
+            self.deck_names.append(deck_name)
+            self._deck_slices[deck_name] = slice(start, len(self.position_names))
+        self._snapshot = MachineSnapshot(0, time.time(), np.array(setpoints, dtype=np.float64), np.array(temperatures, dtype=np.float64))
+        self._lock = asyncio.Lock()
+        self.listeners = []
+
+    @classmethod
+    def from_state(cls, state: JuniorMachineState) -> "MachineStateStore":
+        return cls((deck.name, ((p.name, p.setpoint, p.temperature) for p in deck.positions)) for deck in state.decks)
+
+    def __len__(self) -> int:
+        return len(self.position_names)
+
+    @property
+    def snapshot(self) -> MachineSnapshot:
+        return self._snapshot
+
+    def index_of(self, deck_name: str, position_name: str) -> Optional[int]:
+        return self._index.get((deck_name, position_name))
+
+    def has_deck(self, deck_name: str) -> bool:
+        return deck_name in self._deck_slices
+
+    def deck_positions(self, deck_name: str) -> slice:
+        """Indexes of the positions of a deck, which are contiguous."""
+        return self._deck_slices[deck_name]
+
+    async def set_setpoints(self, indexes: list[int], setpoints: list[float]) -> MachineSnapshot:
+        """Apply all the setpoints at once, readers see either none or all of them."""
+        async with self._lock:
+            current = self._snapshot
+            updated = current.setpoints.copy()
+            updated[indexes] = setpoints
+            return self._commit(MachineSnapshot(current.version + 1, time.time(), updated, current.temperatures, current.read_at))
+
+    async def set_temperatures(self, temperatures: np.ndarray, read_at: Optional[float] = None) -> MachineSnapshot:
+        """Replace the temperature readings of all positions, read from the device at read_at."""
+        async with self._lock:
+            current = self._snapshot
+            return self._commit(MachineSnapshot(current.version + 1, time.time(), current.setpoints,
+                                                np.array(temperatures, dtype=np.float64), read_at))
+
+    def _commit(self, snapshot: MachineSnapshot) -> MachineSnapshot:
+        self._snapshot = snapshot
+        for listener in self.listeners:
+            listener(snapshot)
+        return snapshot
+
+    def to_state(self, snapshot: Optional[MachineSnapshot] = None) -> JuniorMachineState:
+        snapshot = snapshot or self._snapshot
+        return JuniorMachineState(decks=[
+            Deck(name=deck_name, positions=[
+                PositionReading(name=self.position_names[i], setpoint=float(snapshot.setpoints[i]), temperature=float(snapshot.temperatures[i]))
+                for i in range(*self._deck_slices[deck_name].indices(len(self)))
+            ])
+            for deck_name in self.deck_names
+        ])
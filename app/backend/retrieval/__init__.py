@@ -0,0 +1,8 @@
+from .azure_search import AzureSearchBackend
+from .backend import Chunk, RetrievalBackend
+from .embeddings import EmbeddingFunction, HashingEmbedding
+from .file_names import FileNameIndex
+from .local_index import LocalIndex
+from .packing import estimate_tokens, format_chunks, pack_chunks
+
+__all__ = ['AzureSearchBackend', 'Chunk', 'EmbeddingFunction', 'FileNameIndex', 'HashingEmbedding', 'LocalIndex', 'RetrievalBackend', 'estimate_tokens', 'format_chunks', 'pack_chunks']
@@ -0,0 +1,63 @@
+from typing import Hashable
+
+from azure.search.documents.aio import SearchClient
+from azure.search.documents.models import VectorizableTextQuery
+
+from .backend import Chunk, RetrievalBackend
+
+class AzureSearchBackend(RetrievalBackend):
+    """Chunks indexed in Azure AI Search by the integrated vectorization pipeline of setup_intvect.py."""
+
+    def __init__(self,
+                 search_client: SearchClient,
+                 semantic_configuration: str | None,
+                 identifier_field: str,
+                 title_field: str,
+                 content_field: str,
+                 embedding_field: str,
+                 use_vector_query: bool):
+        self.search_client = search_client
+        self.semantic_configuration = semantic_configuration
+        self.identifier_field = identifier_field
+        self.title_field = title_field
+        self.content_field = content_field
+        self.embedding_field = embedding_field
+        self.use_vector_query = use_vector_query
+
+    def options_key(self) -> Hashable:
+        return (self.semantic_configuration, self.use_vector_query)
+
+    async def search(self, query: str, top: int) -> list[Chunk]:
+        # Hybrid query using Azure AI Search with (optional) Semantic Ranker
+        vector_queries = []
+        if self.use_vector_query:
+            vector_queries.append(VectorizableTextQuery(text=query, k_nearest_neighbors=50, fields=self.embedding_field))
+        search_results = await self.search_client.search(
+            search_text=query,
+            query_type="semantic" if self.semantic_configuration else "simple",
+            semantic_configuration_name=self.semantic_configuration,
+            top=top,
+            vector_queries=vector_queries,
+            # The title is only needed by report_grounding, selecting it here saves a second round trip
+            select=", ".join([self.identifier_field, self.title_field, self.content_field])
+        )
+        return [(r[self.identifier_field], r[self.title_field], r[self.content_field]) async for r in search_results]
+
+    async def get_chunks(self, identifiers: list[str]) -> list[Chunk]:
+        list = " OR ".join(identifiers)
+        # Use search instead of filter to align with how detailt integrated vectorization indexes
+        # are generated, where chunk_id is searchable with a keyword tokenizer, not filterable
+        search_results = await self.search_client.search(search_text=list,
+                                                         search_fields=[self.identifier_field],
+                                                         select=[self.identifier_field, self.title_field, self.content_field],
+                                                         top=len(identifiers),
+                                                         query_type="full")
+
+        # If your index has a key field that's filterable but not searchable and with the keyword analyzer, you can
+        # use a filter instead (and you can remove the regex check in report_grounding, just ensure you escape single quotes)
+        # search_results = await search_client.search(filter=f"search.in(chunk_id, '{list}')", select=["chunk_id", "title", "chunk"])
+
+        return [(r[self.identifier_field], r[self.title_field], r[self.content_field]) async for r in search_results]
+
+    async def close(self) -> None:
+        await self.search_client.close()
@@ -0,0 +1,23 @@
+from abc import ABC, abstractmethod
+from typing import Hashable
+
+# (identifier, title, content) of an indexed chunk
+Chunk = tuple[str, str, str]
+
+class RetrievalBackend(ABC):
+    """Where the search and report_grounding tools get their chunks from."""
+
+    def options_key(self) -> Hashable:
+        """Search options that change the results of a query, used to key the search result cache."""
+        return ()
+
+    @abstractmethod
+    async def search(self, query: str, top: int) -> list[Chunk]:
+        """Hybrid (keyword and vector) search, best chunks first."""
+
+    @abstractmethod
+    async def get_chunks(self, identifiers: list[str]) -> list[Chunk]:
+        """Look chunks up by identifier, unknown identifiers are skipped."""
+
+    async def close(self) -> None:
+        pass
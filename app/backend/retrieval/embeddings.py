@@ -0,0 +1,37 @@
+import re
+import zlib
+from typing import Callable
+
+import numpy as np
+
+# Maps a batch of texts to a (len(texts), dimensions) float32 matrix
+EmbeddingFunction = Callable[[list[str]], np.ndarray]
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+class HashingEmbedding:
+    """
+    Deterministic stand-in for a real embedding model: words and their character trigrams are hashed into a
+    fixed number of signed buckets. Needs no model download, gives the same vectors on every machine and run,
+    and still ranks texts sharing words and word fragments (e.g. "nitrate" and "nitration") close together.
+    """
+    dimensions: int
+
+    def __init__(self, dimensions: int = 256):
+        self.dimensions = dimensions
+
+    def __call__(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in _WORD_PATTERN.findall(text.lower()):
+                self._add(vectors[row], word, 1.0)
+                padded = f"#{word}#"
+                for i in range(len(padded) - 2):
+                    self._add(vectors[row], padded[i:i + 3], 0.5)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _add(self, vector: np.ndarray, feature: str, weight: float) -> None:
+        # crc32 rather than hash() which is salted per process
+        bucket = zlib.crc32(feature.encode("utf-8"))
+        vector[bucket % self.dimensions] += weight if bucket & 0x80000000 else -weight
@@ -0,0 +1,233 @@
+import asyncio
+import difflib
+import logging
+import re
+from pathlib import PurePosixPath
+from typing import Awaitable, Callable, Iterable, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger("voiceassistant")
+
+# Similarity of a spoken word to a word of a file name from which they are taken as the same word
+WORD_SIMILARITY = 0.8
+# Similarity of a word that is a prefix of the other, e.g. "exp" and "experiment"
+PREFIX_SIMILARITY = 0.9
+MIN_PREFIX_LENGTH = 3
+# Penalty of every word or number of a file name that the keywords don't mention, so that "experiment 2"
+# prefers "experiment_2.txt" to "experiment_2_sample.txt" (by less than the ambiguity margin)
+EXTRA_TOKEN_PENALTY = 0.01
+
+# Words spoken around the keywords, e.g. "the file of experiment two"
+_FILLER_WORDS = frozenset("called file for named of the".split())
+_UNITS = {word: n for n, word in enumerate(
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen sixteen "
+    "seventeen eighteen nineteen".split())}
+_TENS = {word: 10 * n for n, word in enumerate("twenty thirty forty fifty sixty seventy eighty ninety".split(), start=2)}
+# Letters and digits are separate tokens, so "experiment2" is "experiment 2"
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]+|\d+")
+
+def name_tokens(text: str) -> list[str]:
+    """Lowercase words and numbers of a file name or of spoken keywords, with number words as digits."""
+    tokens = []
+    after_tens = False
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        if after_tens and 0 < _UNITS.get(token, 0) < 10:
+            # "twenty five" is 25
+            tokens[-1] = str(int(tokens[-1]) + _UNITS[token])
+            after_tens = False
+            continue
+        after_tens = token in _TENS
+        if token.isdigit():
+            tokens.append(str(int(token)))
+        elif token in _UNITS:
+            tokens.append(str(_UNITS[token]))
+        elif token in _TENS:
+            tokens.append(str(_TENS[token]))
+        else:
+            tokens.append(token)
+    return tokens
+
+def _keywords(text: str) -> tuple[str, ...]:
+    return tuple(sorted({token for token in name_tokens(text) if token not in _FILLER_WORDS}))
+
+class FileNameIndex:
+    """
+    In-process index of the names of the files of a folder, resolving spoken keywords like "experiment two
+    sample" to a file name like "Experiment2_Sample.txt" without a round trip to the Logic App.
+
+    Keywords and names are split in words and numbers. Every number of the keywords must be in the name, words
+    may match a word of the name approximately or by prefix, and names are scored by the share of keywords
+    they match. resolve() returns None when no name scores min_score or more, or when another name scores
+    within margin of the best one, so that the caller can fall back to the remote lookup.
+
+    Approximate matching needs the whole listing of the folder, fetched with list_names every refresh_interval
+    seconds or sooner when refresh_soon() is called. Without it, or until the first listing succeeds, only
+    keywords already resolved remotely (see remember()) are answered locally.
+    """
+    refresh_interval: float
+    min_score: float
+    margin: float
+    # Whether the names come from a listing of the whole folder
+    complete: bool
+    hits: int
+    misses: int
+    ambiguous: int
+
+    def __init__(self,
+                 list_names: Optional[Callable[[], Awaitable[list[str]]]] = None,
+                 refresh_interval: float = 300.0,
+                 min_score: float = 0.75,
+                 margin: float = 0.1):
+        self.list_names = list_names
+        self.refresh_interval = refresh_interval
+        self.min_score = min_score
+        self.margin = margin
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+        self.ambiguous = 0
+        # Name to its words and numbers, and token to the names having it
+        self._names: dict[str, tuple[frozenset[str], frozenset[str]]] = {}
+        self._by_token: dict[str, set[str]] = {}
+        # Keywords resolved remotely, to their file name
+        self._resolved: dict[tuple[str, ...], str] = {}
+        # Words of the names similar to a keyword, computed once per keyword until the names change
+        self._similar: dict[str, list[tuple[str, float]]] = {}
+        self._refresh_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def replace(self, names: Iterable[str]) -> None:
+        """Index the complete listing of the folder, in place of the names indexed so far."""
+        self._names = {}
+        self._by_token = {}
+        self._similar.clear()
+        for name in names:
+            self.add(name)
+        self.complete = True
+
+    def add(self, name: str) -> None:
+        if name in self._names:
+            return
+        tokens = name_tokens(PurePosixPath(name).stem)
+        words = frozenset(token for token in tokens if not token.isdigit())
+        numbers = frozenset(token for token in tokens if token.isdigit())
+        self._names[name] = (words, numbers)
+        for token in words | numbers:
+            self._by_token.setdefault(token, set()).add(name)
+        self._similar.clear()
+
+    def remember(self, text: str, name: str) -> None:
+        """Record the file name the remote lookup found for the keywords, to answer them locally next time."""
+        if keywords := _keywords(text):
+            self._resolved[keywords] = name
+        self.add(name)
+
+    def _similar_words(self, keyword: str) -> list[tuple[str, float]]:
+        similar = self._similar.get(keyword)
+        if similar is not None:
+            return similar
+        similar = []
+        for word in self._by_token:
+            if word == keyword:
+                similar.append((word, 1.0))
+            elif word.isdigit():
+                continue
+            elif min(len(word), len(keyword)) >= MIN_PREFIX_LENGTH and (word.startswith(keyword) or keyword.startswith(word)):
+                similar.append((word, PREFIX_SIMILARITY))
+            elif (similarity := difflib.SequenceMatcher(None, keyword, word).ratio()) >= WORD_SIMILARITY:
+                similar.append((word, similarity))
+        if len(self._similar) >= 4096:
+            self._similar.clear()
+        self._similar[keyword] = similar
+        return similar
+
+    def resolve(self, text: str) -> Optional[str]:
+        """File name best matching the spoken keywords, None on a miss or an ambiguity."""
+        keywords = _keywords(text)
+        if not keywords:
+            return None
+        name = self._resolved.get(keywords)
+        if name is not None and name in self._names:
+            self.hits += 1
+            return name
+        if not self.complete:
+            self.misses += 1
+            return None
+
+        numbers = [keyword for keyword in keywords if keyword.isdigit()]
+        candidates: Optional[set[str]] = None
+        for number in numbers:
+            having = self._by_token.get(number, set())
+            candidates = having if candidates is None else candidates & having
+        # Sum over the keywords of the best similarity to a word of each name, the numbers usually narrow the
+        # names down to a few
+        scores: dict[str, float] = {}
+        for keyword in keywords:
+            if keyword.isdigit():
+                continue
+            best: dict[str, float] = {}
+            for word, similarity in self._similar_words(keyword):
+                having = self._by_token[word] if candidates is None else self._by_token[word] & candidates
+                for name in having:
+                    if similarity > best.get(name, 0.0):
+                        best[name] = similarity
+            for name, similarity in best.items():
+                scores[name] = scores.get(name, 0.0) + similarity
+        if candidates is None:
+            candidates = set(scores)
+
+        ranked = []
+        for name in candidates:
+            words, name_numbers = self._names[name]
+            extra = len(words) + len(name_numbers) - len(keywords)
+            score = (scores.get(name, 0.0) + len(numbers)) / len(keywords) - EXTRA_TOKEN_PENALTY * max(extra, 0)
+            ranked.append((score, name))
+        ranked.sort(reverse=True)
+        if not ranked or ranked[0][0] < self.min_score:
+            self.misses += 1
+            return None
+        if len(ranked) > 1 and ranked[0][0] - ranked[1][0] < self.margin:
+            self.ambiguous += 1
+            return None
+        self.hits += 1
+        return ranked[0][1]
+
+    def refresh_soon(self) -> None:
+        """List the folder again without waiting for refresh_interval, e.g. when a name is missing."""
+        self._refresh_requested.set()
+
+    def start(self) -> None:
+        if self.list_names is not None:
+            self._task = asyncio.create_task(self._refresh())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def cleanup_ctx(self):
+        async def cleanup_ctx(app: web.Application):
+            self.start()
+            yield
+            await self.close()
+        return cleanup_ctx
+
+    async def _refresh(self) -> None:
+        while True:
+            self._refresh_requested.clear()
+            try:
+                self.replace(await self.list_names())
+            except Exception as e:
+                logger.warning(f"Can't list the file names, keeping the {len(self)} known ones: {e}")
+            try:
+                await asyncio.wait_for(self._refresh_requested.wait(), self.refresh_interval)
+            except asyncio.TimeoutError:
+                pass
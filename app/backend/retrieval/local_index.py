@@ -0,0 +1,189 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+from pathlib import Path
+from typing import Hashable, Optional
+
+import numpy as np
+
+from .backend import Chunk, RetrievalBackend
+from .embeddings import EmbeddingFunction, HashingEmbedding
+
+logger = logging.getLogger("voiceassistant")
+
+# Same chunking as the SplitSkill configured in setup_intvect.py
+PAGE_LENGTH = 2000
+PAGE_OVERLAP = 500
+# Candidates taken from each ranking before fusing them, like k_nearest_neighbors of the Azure vector query
+CANDIDATES = 50
+RRF_K = 60
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+def split_pages(text: str, page_length: int = PAGE_LENGTH, overlap: int = PAGE_OVERLAP) -> list[str]:
+    """Split text in pages of at most page_length characters overlapping by about overlap, on whitespace."""
+    text = text.strip()
+    pages = []
+    start = 0
+    while start < len(text):
+        end = min(start + page_length, len(text))
+        if end < len(text):
+            cut = max(text.rfind(" ", start, end), text.rfind("\n", start, end))
+            if cut > start + page_length // 2:
+                end = cut
+        pages.append(text[start:end].strip())
+        if end >= len(text):
+            break
+        next_start = max(end - overlap, start + 1)
+        boundary = max(text.rfind(" ", start, next_start), text.rfind("\n", start, next_start))
+        start = boundary + 1 if boundary > start else next_start
+    return pages
+
+class LocalIndex(RetrievalBackend):
+    """
+    In-process hybrid index over a folder of text documents, for labs with poor connectivity.
+
+    Documents are split like the Azure indexer does, then indexed both with vectors (brute-force cosine
+    similarity over a NumPy matrix) and with BM25, and the two rankings are fused with reciprocal rank fusion
+    like Azure AI Search hybrid queries. The index is saved as .npy files that workers memory-map on load.
+    """
+    ids: list[str]
+    titles: list[str]
+    contents: list[str]
+    parent_ids: list[str]
+
+    def __init__(self, index_dir: Path, embed: EmbeddingFunction):
+        self.index_dir = index_dir
+        self.embed = embed
+        with open(index_dir / "chunks.json", encoding="utf-8") as f:
+            chunks = json.load(f)
+        self.ids = chunks["ids"]
+        self.titles = chunks["titles"]
+        self.contents = chunks["contents"]
+        self.parent_ids = chunks["parent_ids"]
+        self.vocabulary: dict[str, int] = chunks["vocabulary"]
+        self._positions = {identifier: i for i, identifier in enumerate(self.ids)}
+        self.vectors = np.load(index_dir / "vectors.npy", mmap_mode="r")
+        self.postings_indptr = np.load(index_dir / "postings_indptr.npy", mmap_mode="r")
+        self.postings_docs = np.load(index_dir / "postings_docs.npy", mmap_mode="r")
+        self.postings_tf = np.load(index_dir / "postings_tf.npy", mmap_mode="r")
+        self.doc_lengths = np.load(index_dir / "doc_lengths.npy", mmap_mode="r")
+        self._average_length = float(self.doc_lengths.mean()) if len(self.doc_lengths) > 0 else 0.0
+
+    @classmethod
+    def load_or_build(cls, data_dir: Path, index_dir: Path, embed: Optional[EmbeddingFunction] = None) -> "LocalIndex":
+        """Load the index saved in index_dir, rebuilding it first if the documents in data_dir changed."""
+        embed = embed or HashingEmbedding()
+        fingerprint = cls._fingerprint(data_dir, embed)
+        manifest_path = index_dir / "manifest.json"
+        if manifest_path.exists() and json.loads(manifest_path.read_text()).get("fingerprint") == fingerprint:
+            logger.info("Loading local search index from %s", index_dir)
+        else:
+            logger.info("Building local search index of %s in %s", data_dir, index_dir)
+            cls._build(data_dir, index_dir, embed)
+            manifest_path.write_text(json.dumps({"fingerprint": fingerprint}))
+        return cls(index_dir, embed)
+
+    @staticmethod
+    def _fingerprint(data_dir: Path, embed: EmbeddingFunction) -> str:
+        digest = hashlib.sha1(f"{type(embed).__qualname__}:{getattr(embed, 'dimensions', '')}".encode())
+        for path in sorted(data_dir.glob("*.txt")):
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _build(data_dir: Path, index_dir: Path, embed: EmbeddingFunction) -> None:
+        ids, titles, contents, parent_ids = [], [], [], []
+        for path in sorted(data_dir.glob("*.txt")):
+            # Chunk identifiers must match the key pattern report_grounding accepts
+            parent_id = hashlib.sha1(path.name.encode("utf-8")).hexdigest()[:16]
+            for page, content in enumerate(split_pages(path.read_text(encoding="utf-8"))):
+                ids.append(f"{parent_id}_pages_{page}")
+                titles.append(path.name)
+                contents.append(content)
+                parent_ids.append(parent_id)
+
+        # The title is searchable too, as in the Azure index
+        searchable = [f"{title}\n{content}" for title, content in zip(titles, contents)]
+        vocabulary: dict[str, int] = {}
+        postings: list[dict[int, int]] = []
+        doc_lengths = np.zeros(len(contents), dtype=np.float32)
+        for doc, text in enumerate(searchable):
+            tokens = tokenize(text)
+            doc_lengths[doc] = len(tokens)
+            for token in tokens:
+                term = vocabulary.setdefault(token, len(vocabulary))
+                if term == len(postings):
+                    postings.append({})
+                postings[term][doc] = postings[term].get(doc, 0) + 1
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        docs = np.array([doc for p in postings for doc in p], dtype=np.int32)
+        tf = np.array([count for p in postings for count in p.values()], dtype=np.float32)
+
+        vectors = embed(searchable) if contents else np.zeros((0, 1), dtype=np.float32)
+        os.makedirs(index_dir, exist_ok=True)
+        np.save(index_dir / "vectors.npy", np.ascontiguousarray(vectors, dtype=np.float32))
+        np.save(index_dir / "postings_indptr.npy", indptr)
+        np.save(index_dir / "postings_docs.npy", docs)
+        np.save(index_dir / "postings_tf.npy", tf)
+        np.save(index_dir / "doc_lengths.npy", doc_lengths)
+        with open(index_dir / "chunks.json", "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "titles": titles, "contents": contents, "parent_ids": parent_ids, "vocabulary": vocabulary}, f)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def options_key(self) -> Hashable:
+        return ("local", str(self.index_dir))
+
+    def _vector_ranking(self, query: str) -> np.ndarray:
+        similarities = self.vectors @ self.embed([query])[0]
+        return self._top(similarities, similarities > 0)
+
+    def _bm25_ranking(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.postings_indptr[term_id], self.postings_indptr[term_id + 1]
+            docs, tf = self.postings_docs[start:end], self.postings_tf[start:end]
+            idf = math.log(1 + (len(self.ids) - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[docs] / self._average_length)
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return self._top(scores, scores > 0)
+
+    @staticmethod
+    def _top(scores: np.ndarray, matches: np.ndarray) -> np.ndarray:
+        candidates = np.flatnonzero(matches)
+        if len(candidates) > CANDIDATES:
+            candidates = candidates[np.argpartition(-scores[candidates], CANDIDATES)[:CANDIDATES]]
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+    def search_scored(self, query: str, top: int) -> list[tuple[Chunk, float]]:
+        """Chunks with their reciprocal rank fusion score, best first."""
+        if len(self.ids) == 0:
+            return []
+        fused = np.zeros(len(self.ids), dtype=np.float64)
+        for ranking in (self._vector_ranking(query), self._bm25_ranking(query)):
+            fused[ranking] += 1.0 / (RRF_K + 1 + np.arange(len(ranking)))
+        best = self._top(fused, fused > 0)[:top]
+        return [((self.ids[i], self.titles[i], self.contents[i]), float(fused[i])) for i in best]
+
+    async def search(self, query: str, top: int) -> list[Chunk]:
+        # Single-digit milliseconds on the lab corpora, not worth a hop to a worker thread
+        return [chunk for chunk, _ in self.search_scored(query, top)]
+
+    async def get_chunks(self, identifiers: list[str]) -> list[Chunk]:
+        positions = [self._positions[i] for i in identifiers if i in self._positions]
+        return [(self.ids[i], self.titles[i], self.contents[i]) for i in positions]
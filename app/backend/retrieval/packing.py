@@ -0,0 +1,86 @@
+import math
+import re
+from typing import Optional
+
+from .backend import Chunk
+
+# Rough size of a token for English text, good enough to budget tool output without shipping a tokenizer
+CHARS_PER_TOKEN = 4
+# Chunks that would be cut below this many tokens are dropped rather than truncated
+MIN_TRUNCATED_TOKENS = 32
+# Enough leading text of a page to find where it starts in the previous page
+_ANCHOR_LENGTH = 48
+
+# Chunk identifiers of the integrated vectorization indexes and of the local index end with the page number
+_PAGE_PATTERN = re.compile(r"^(.*)_pages_(\d+)$")
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def _page_of(identifier: str) -> Optional[tuple[str, int]]:
+    match = _PAGE_PATTERN.match(identifier)
+    return (match.group(1), int(match.group(2))) if match else None
+
+def overlap_length(previous: str, following: str) -> int:
+    """Length of the longest suffix of previous that is also a prefix of following."""
+    anchor = following[:_ANCHOR_LENGTH]
+    if not anchor:
+        return 0
+    start = previous.find(anchor)
+    while start != -1:
+        if following.startswith(previous[start:]):
+            return len(previous) - start
+        start = previous.find(anchor, start + 1)
+    return 0
+
+def _truncate(content: str, tokens: int) -> str:
+    limit = tokens * CHARS_PER_TOKEN
+    if len(content) <= limit:
+        return content
+    cut = content.rfind(" ", 0, limit - 1)
+    return content[:cut if cut > limit // 2 else limit - 1].rstrip() + "…"
+
+def format_chunk(identifier: str, content: str) -> str:
+    """A chunk as the search tool outputs it."""
+    return f"[{identifier}]: {content}\n-----\n"
+
+def format_chunks(chunks: list[Chunk]) -> str:
+    return "".join(format_chunk(identifier, content) for identifier, _, content in chunks)
+
+def pack_chunks(chunks: list[Chunk], token_budget: int) -> list[Chunk]:
+    """
+    Fit search results in a token budget for the realtime model to read.
+
+    Chunks are kept in the order given (best first). Consecutive pages of the same document overlap (see the
+    SplitSkill in setup_intvect.py), so when both pages are kept the text a chunk shares with the other is
+    dropped from whichever ranks lower. Once the budget runs out the next chunk is truncated and the rest
+    are left out. The budget covers the chunks formatted with format_chunks, identifiers and separators included.
+    """
+    packed: list[Chunk] = []
+    kept_pages: dict[tuple[str, int], str] = {}
+    remaining = token_budget
+    for identifier, title, page_content in chunks:
+        content = page_content
+        page = _page_of(identifier)
+        if page is not None:
+            parent, number = page
+            previous = kept_pages.get((parent, number - 1))
+            if previous is not None:
+                content = content[overlap_length(previous, content):].lstrip()
+            following = kept_pages.get((parent, number + 1))
+            if following is not None:
+                content = content[:len(content) - overlap_length(content, following)].rstrip()
+            # Later neighbours are compared with the full page, not with what's left of it
+            kept_pages[page] = page_content
+        if not content:
+            continue
+        # The identifier and the separator are read too, they frame each chunk in the tool output
+        tokens = estimate_tokens(format_chunk(identifier, content))
+        if tokens > remaining:
+            framing = estimate_tokens(format_chunk(identifier, ""))
+            if remaining - framing >= MIN_TRUNCATED_TOKENS:
+                packed.append((identifier, title, _truncate(content, remaining - framing)))
+            break
+        packed.append((identifier, title, content))
+        remaining -= tokens
+    return packed
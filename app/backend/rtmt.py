@@ -2,16 +2,74 @@ import asyncio
 import json
 import logging
 import os
+import re
+import time
+import uuid
+from contextvars import ContextVar
 from enum import Enum
-from typing import Any, Callable, Optional
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
 
 import aiohttp
 from aiohttp import web
 from azure.core.credentials import AzureKeyCredential
-from azure.identity import DefaultAzureCredential, get_bearer_token_provider
+from azure.identity import DefaultAzureCredential
+
+from capture import SessionCapture, SessionRecorder
+from tracing import TRACED_SERVER_EVENTS, TurnTracer
+from upstream_pool import UpstreamPool
+from utils import AsyncTokenManager, MetricsRegistry
+from utils.metrics import MAX_LABEL_SETS, Counter
 
 logger = logging.getLogger("voiceassistant")
 
+# Event types the middle tier rewrites, drops or inspects. Every other event (notably the large base64
+# "input_audio_buffer.append" and "response.audio.delta" frames) is relayed untouched without being parsed.
+_SERVER_EVENTS_TO_PROCESS = frozenset({
+    "session.created",
+    "response.output_item.added",
+    "conversation.item.created",
+    "response.function_call_arguments.delta",
+    "response.function_call_arguments.done",
+    "response.output_item.done",
+    "response.done",
+    "conversation.item.input_audio_transcription.completed",
+})
+_CLIENT_EVENTS_TO_PROCESS = frozenset({
+    "session.update",
+})
+
+# Both the realtime API and the frontend serialize "type" as the first key of every event, so it can be
+# read from a bounded prefix of the frame. Frames where it isn't the first key fall back to a full parse.
+_EVENT_TYPE_PATTERN = re.compile(r'\s*\{\s*"type"\s*:\s*"([^"\\]+)"')
+_EVENT_TYPE_SCAN_LIMIT = 128
+# Ping interval of the realtime websockets, pooled sockets that stop answering are discarded
+UPSTREAM_HEARTBEAT_SECONDS = 20.0
+
+def peek_event_type(data: str) -> Optional[str]:
+    match = _EVENT_TYPE_PATTERN.match(data, 0, _EVENT_TYPE_SCAN_LIMIT)
+    return match.group(1) if match is not None else None
+
+class _FrameMetrics:
+    """Frame and size counters of one relay direction, with the counters of each event type looked up once."""
+    direction: str
+
+    def __init__(self, frames: Counter, frame_bytes: Counter, direction: str):
+        self.frames = frames
+        self.frame_bytes = frame_bytes
+        self.direction = direction
+        self._by_type: dict[Optional[str], tuple[Any, Any]] = {}
+
+    def record(self, event_type: Optional[str], size: int) -> None:
+        counters = self._by_type.get(event_type)
+        if counters is None:
+            # Frames whose type isn't the first key are parsed later on, they aren't told apart here
+            label = event_type or "unknown"
+            counters = (self.frames.labels(self.direction, label), self.frame_bytes.labels(self.direction, label))
+            if len(self._by_type) < MAX_LABEL_SETS:
+                self._by_type[event_type] = counters
+        counters[0].value += 1
+        counters[1].value += size
+
 class ToolResultDirection(Enum):
     TO_SERVER = 1
     TO_CLIENT = 2
@@ -45,15 +103,141 @@ class RTToolCall:
         self.tool_call_id = tool_call_id
         self.previous_id = previous_id
 
+class RTSession:
+    """State of a single client connection, so that one worker can host many concurrent voice sessions."""
+    id: str
+    client_ws: web.WebSocketResponse
+    # Session ID assigned by the realtime API in "session.created"
+    session_id: Optional[str] = None
+    tools_pending: dict[str, RTToolCall]
+    # Tool calls of the current response running in the background, keyed by call ID
+    tool_tasks: dict[str, asyncio.Task]
+    # Other work started on behalf of the session that must not outlive it
+    background_tasks: set[asyncio.Task]
+    # Free-form per-session state that tools can use to keep data across calls of the same conversation
+    tool_context: dict[str, Any]
+    last_activity: float
+    # Recording of the frames and tool results when the middle tier captures sessions
+    capture: Optional[SessionCapture] = None
+
+    def __init__(self, client_ws: web.WebSocketResponse):
+        self.id = uuid.uuid4().hex
+        self.client_ws = client_ws
+        self.session_id = None
+        self.tools_pending = {}
+        self.tool_tasks = {}
+        self.background_tasks = set()
+        self.tool_context = {}
+        self.last_activity = time.monotonic()
+        self.capture = None
+
+    def touch(self) -> None:
+        self.last_activity = time.monotonic()
+
+    def idle_seconds(self) -> float:
+        return time.monotonic() - self.last_activity
+
+    def run_tool_call(self, call_id: str, coro: Awaitable[None]) -> None:
+        """Run a tool call in the background so that the relay keeps streaming while it executes."""
+        self.tool_tasks[call_id] = asyncio.create_task(coro)
+
+    def take_tool_calls(self) -> list[asyncio.Task]:
+        """Hand over the tool calls started so far, e.g. to wait for them at the end of a response."""
+        tasks = list(self.tool_tasks.values())
+        self.tool_tasks.clear()
+        return tasks
+
+    def run_in_background(self, coro: Awaitable[None]) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    def cancel_tasks(self) -> None:
+        for task in [*self.tool_tasks.values(), *self.background_tasks]:
+            task.cancel()
+        self.tool_tasks.clear()
+
+    async def close(self) -> None:
+        if not self.client_ws.closed:
+            await self.client_ws.close()
+
+_current_session: ContextVar[Optional[RTSession]] = ContextVar("rt_session", default=None)
+
+def get_current_session() -> Optional[RTSession]:
+    """Session of the connection the caller is running on behalf of, e.g. from inside a tool target."""
+    return _current_session.get()
+
+class RTSessionRegistry:
+    """Tracks the live sessions of a worker and closes the ones that stay idle for too long."""
+    idle_timeout: float
+    sweep_interval: float
+
+    def __init__(self, idle_timeout: float, sweep_interval: float = 30.0):
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self._sessions: dict[str, RTSession] = {}
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def get(self, id: str) -> Optional[RTSession]:
+        return self._sessions.get(id)
+
+    def create(self, client_ws: web.WebSocketResponse) -> RTSession:
+        session = RTSession(client_ws)
+        self._sessions[session.id] = session
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._evict_idle_sessions())
+        return session
+
+    def remove(self, session: RTSession) -> None:
+        self._sessions.pop(session.id, None)
+
+    async def _evict_idle_sessions(self) -> None:
+        while self._sessions:
+            await asyncio.sleep(self.sweep_interval)
+            for session in self:
+                if session.idle_seconds() > self.idle_timeout:
+                    logger.info("Closing session %s after %.0f seconds of inactivity", session.id, session.idle_seconds())
+                    self.remove(session)
+                    await session.close()
+
+    async def close(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        for session in self:
+            self.remove(session)
+            await session.close()
+
 class RTMiddleTier:
     endpoint: str
     deployment: str
     key: Optional[str] = None
-    current_session_id: Optional[str] = None
+    sessions: RTSessionRegistry
+    upstream_pool: UpstreamPool
+    # Relay, tool and upstream metrics, served on /metrics by the app
+    metrics: MetricsRegistry
+    # Per-turn latency traces (speech stopped, transcription, tool calls, first audio), off unless set
+    tracer: Optional[TurnTracer] = None
+    # Captures the sessions to disk for offline replay, off unless set
+    recorder: Optional[SessionRecorder] = None
     
     # Tools are server-side only for now, though the case could be made for client-side tools
     # in addition to server-side tools that are invisible to the client
-    tools: dict[str, Tool] = {}
+    tools: dict[str, Tool]
+    # Background work of the tools (e.g. cache invalidation), run for the lifetime of the app the middle tier is attached to
+    cleanup_ctx: list[Callable[[web.Application], AsyncIterator[None]]]
+    # Called with the session and the transcript of each user utterance, e.g. to start work speculatively
+    transcription_listeners: list[Callable[[RTSession, str], None]]
+    # Called when a client connection ends, e.g. to flush or release per-session state
+    session_closed_listeners: list[Callable[[RTSession], Awaitable[None]]]
+    # Handlers of the "extension.*" events clients send to the middle tier itself, these aren't relayed
+    client_extension_handlers: dict[str, Callable[[RTSession, dict[str, Any]], Awaitable[None]]]
 
     # Server-enforced configuration, if set, these will override the client's configuration
     # Typically at least the model name and system message will be set by the server
@@ -64,23 +248,58 @@ class RTMiddleTier:
     disable_audio: Optional[bool] = None
     voice_choice: Optional[str] = None
     api_version: str = "2024-10-01-preview"
-    _tools_pending = {}
     _token_provider = None
 
-    def __init__(self, endpoint: str, deployment: str, credentials: AzureKeyCredential | DefaultAzureCredential, voice_choice: Optional[str] = None):
+    def __init__(self, endpoint: str, deployment: str, credentials: AzureKeyCredential | DefaultAzureCredential | AsyncTokenManager, voice_choice: Optional[str] = None,
+                 session_idle_timeout: float = 30 * 60, upstream_pool_size: int = 0, upstream_max_idle_age: float = 5 * 60):
         self.endpoint = endpoint
         self.deployment = deployment
         self.voice_choice = voice_choice
+        self.tools = {}
+        self.cleanup_ctx = []
+        self.transcription_listeners = []
+        self.session_closed_listeners = []
+        self.client_extension_handlers = {}
+        self.sessions = RTSessionRegistry(idle_timeout=session_idle_timeout)
+        self.upstream_pool = UpstreamPool(self._connect_upstream, size=upstream_pool_size, max_idle_age=upstream_max_idle_age)
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._init_metrics()
         if voice_choice is not None:
             logger.info("Realtime voice choice set to %s", voice_choice)
         if isinstance(credentials, AzureKeyCredential):
             self.key = credentials.key
         else:
-            self._token_provider = get_bearer_token_provider(credentials, "https://cognitiveservices.azure.com/.default")
-            self._token_provider() # Warm up during startup so we have a token cached when the first request arrives
-        self.current_session_id = None
+            token_manager = credentials if isinstance(credentials, AsyncTokenManager) else AsyncTokenManager(credentials)
+            self._token_provider = token_manager.get_bearer_token_provider("https://cognitiveservices.azure.com/.default")
+            token_manager.warm_up("https://cognitiveservices.azure.com/.default") # so we have a token cached when the first request arrives
+
+    def _init_metrics(self) -> None:
+        self.metrics = MetricsRegistry()
+        frames = self.metrics.counter("rtmt_frames_total", "Websocket frames relayed, by direction and event type.", ("direction", "type"))
+        frame_bytes = self.metrics.counter("rtmt_frame_bytes_total", "Size of the websocket frames relayed, by direction and event type.", ("direction", "type"))
+        self._frames_to_client = _FrameMetrics(frames, frame_bytes, "to_client")
+        self._frames_to_server = _FrameMetrics(frames, frame_bytes, "to_server")
+        self._tool_seconds = self.metrics.histogram("rtmt_tool_duration_seconds", "Time tools took to return their result or fail, by tool and outcome (ok, error or cancelled).", ("tool", "outcome"))
+        self._tool_errors = self.metrics.counter("rtmt_tool_errors_total", "Tool calls that raised an error, by tool.", ("tool",))
+        self._tool_calls_in_flight = 0
+        self.metrics.gauge("rtmt_tool_calls_in_flight", "Tool calls running.", lambda: self._tool_calls_in_flight)
+        self._sessions_total = self.metrics.counter("rtmt_sessions_total", "Client connections accepted.")
+        self.metrics.gauge("rtmt_sessions_active", "Client connections open.", lambda: len(self.sessions))
+        connect_seconds = self.metrics.histogram("rtmt_upstream_connect_seconds", "Time to connect to the realtime API and get session.created.")
+        self.upstream_pool.connect_listeners.append(connect_seconds.observe)
+        stats = self.upstream_pool.stats
+        self.metrics.gauge("rtmt_upstream_claims_total", "Realtime connections claimed by clients.", lambda: stats.claims, "counter")
+        self.metrics.gauge("rtmt_upstream_pool_hits_total", "Claims served by a pre-connected socket.", lambda: stats.hits, "counter")
+        self.metrics.gauge("rtmt_upstream_connect_failures_total", "Failed attempts to pre-connect a socket.", lambda: stats.connect_failures, "counter")
+        self.metrics.gauge("rtmt_upstream_pool_idle", "Pre-connected sockets waiting for a client.", self.upstream_pool.idle_count)
 
-    async def _process_message_to_client(self, msg: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse) -> Optional[str]:
+    async def _process_message_to_client(self, session: RTSession, msg: str, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse) -> Optional[str]:
+        event_type = peek_event_type(msg.data)
+        self._frames_to_client.record(event_type, len(msg.data))
+        if self.tracer is not None and event_type in TRACED_SERVER_EVENTS:
+            self.tracer.on_server_event(session.id, event_type)
+        if event_type is not None and event_type not in _SERVER_EVENTS_TO_PROCESS:
+            return msg.data
         # putting all the logic in a try/except block to avoid the websocket connection to be closed in case of errors
         # this also allows the client to reconnect to the server and not losing the session with all the tools registered
         try:
@@ -93,16 +312,16 @@ class RTMiddleTier:
             if message is not None:
                 match message["type"]:
                     case "session.created":
-                        session = message["session"]
-                        # Set the session ID to the current session ID
-                        self.current_session_id = session.get("id")
+                        rt_session = message["session"]
+                        # Keep the realtime session ID on this connection's session
+                        session.session_id = rt_session.get("id")
                         # Hide the instructions, tools and max tokens from clients, if we ever allow client-side 
                         # tools, this will need updating
-                        session["instructions"] = ""
-                        session["tools"] = []
-                        session["voice"] = self.voice_choice
-                        session["tool_choice"] = "none"
-                        session["max_response_output_tokens"] = None
+                        rt_session["instructions"] = ""
+                        rt_session["tools"] = []
+                        rt_session["voice"] = self.voice_choice
+                        rt_session["tool_choice"] = "none"
+                        rt_session["max_response_output_tokens"] = None
                         updated_message = json.dumps(message)
 
                     case "response.output_item.added":
@@ -112,8 +331,8 @@ class RTMiddleTier:
                     case "conversation.item.created":
                         if "item" in message and message["item"]["type"] == "function_call":
                             item = message["item"]
-                            if item["call_id"] not in self._tools_pending:
-                                self._tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message["previous_item_id"])
+                            if item["call_id"] not in session.tools_pending:
+                                session.tools_pending[item["call_id"]] = RTToolCall(item["call_id"], message["previous_item_id"])
                             updated_message = None
                         elif "item" in message and message["item"]["type"] == "function_call_output":
                             updated_message = None
@@ -128,43 +347,18 @@ class RTMiddleTier:
                         if "item" in message and message["item"]["type"] == "function_call":
                             item = message["item"]
                             logger.info(f"Tool invocation details: {item}")
-                            tool_call = self._tools_pending[message["item"]["call_id"]]
-                            tool = self.tools[item["name"]]
-                            args_dict = json.loads(item["arguments"])
-                            # Inject sessionId if requested by schema
-                            if (self.current_session_id
-                                and "parameters" in tool.schema
-                                and "properties" in tool.schema["parameters"]
-                                and "session_id" in tool.schema["parameters"]["properties"]
-                            ):
-                                args_dict["session_id"] = self.current_session_id
-                            result = await tool.target(args_dict)
-                            logger.info(f"Tool result: {result}")
-                            await server_ws.send_json({
-                                "type": "conversation.item.create",
-                                "item": {
-                                    "type": "function_call_output",
-                                    "call_id": item["call_id"],
-                                    "output": result.to_text() if result.destination == ToolResultDirection.TO_SERVER else ""
-                                }
-                            })
-                            if result.destination == ToolResultDirection.TO_CLIENT:
-                                # TODO: this will break clients that don't know about this extra message, rewrite 
-                                # this to be a regular text message with a special marker of some sort
-                                await client_ws.send_json({
-                                    "type": "extension.middle_tier_tool_response",
-                                    "previous_item_id": tool_call.previous_id,
-                                    "tool_name": item["name"],
-                                    "tool_result": result.to_text()
-                                })
+                            tool_call = session.tools_pending[message["item"]["call_id"]]
+                            # Don't hold up the relay while the tool runs, calls of the same response run in parallel
+                            session.run_tool_call(item["call_id"], self._run_tool_call(session, item, tool_call, client_ws, server_ws))
                             updated_message = None
 
                     case "response.done":
-                        if len(self._tools_pending) > 0:
-                            self._tools_pending.clear()
-                            await server_ws.send_json({
-                                "type": "response.create"
-                            })
+                        calls_tools = len(session.tools_pending) > 0
+                        if self.tracer is not None:
+                            self.tracer.on_response_done(session.id, calls_tools)
+                        if calls_tools:
+                            session.tools_pending.clear()
+                            session.run_in_background(self._create_response_after(session, session.take_tool_calls(), server_ws))
                         if "response" in message:
                             replace = False
                             for i, output in enumerate(reversed(message["response"]["output"])):
@@ -177,6 +371,9 @@ class RTMiddleTier:
                     case "conversation.item.input_audio_transcription.completed":
                         # check the deactivation keyword in the transcription
                         logger.info(f"Message: {message}")
+                        if "transcript" in message:
+                            for listener in self.transcription_listeners:
+                                listener(session, message["transcript"])
                         if "transcript" in message and os.environ.get("KEYWORD_DEACTIVATION", "").lower() in message["transcript"].lower():
                             # clear the audio buffer
                             await server_ws.send_json({
@@ -185,94 +382,227 @@ class RTMiddleTier:
                 return updated_message
         except Exception as e:
             logger.error(f"Error processing message to client: {e}")
+            await self._send_error_message(server_ws)
+            return None
+
+    async def _run_tool_call(self, session: RTSession, item: dict[str, Any], tool_call: RTToolCall, client_ws: web.WebSocketResponse, server_ws: web.WebSocketResponse) -> None:
+        self._tool_calls_in_flight += 1
+        span = self.tracer.start_tool(session.id, item.get("name"), item.get("call_id")) if self.tracer is not None else None
+        error = None
+        result = None
+        started = time.perf_counter()
+        returned = None
+        try:
+            tool = self.tools[item["name"]]
+            args_dict = json.loads(item["arguments"])
+            # Inject sessionId if requested by schema
+            if (session.session_id
+                and "parameters" in tool.schema
+                and "properties" in tool.schema["parameters"]
+                and "session_id" in tool.schema["parameters"]["properties"]
+            ):
+                args_dict["session_id"] = session.session_id
+            result = await tool.target(args_dict)
+            returned = time.perf_counter()
+            logger.info(f"Tool result: {result}")
             await server_ws.send_json({
                 "type": "conversation.item.create",
                 "item": {
-                    "type": "message",
-                    "role": "assistant",
-                    "status": "completed",
-                    "content": [{"type": "text", "text": "There was an error processing your request. Please try again."}],
+                    "type": "function_call_output",
+                    "call_id": item["call_id"],
+                    "output": result.to_text() if result.destination == ToolResultDirection.TO_SERVER else ""
                 }
             })
-            return None
+            if result.destination == ToolResultDirection.TO_CLIENT:
+                # TODO: this will break clients that don't know about this extra message, rewrite 
+                # this to be a regular text message with a special marker of some sort
+                await client_ws.send_json({
+                    "type": "extension.middle_tier_tool_response",
+                    "previous_item_id": tool_call.previous_id,
+                    "tool_name": item["name"],
+                    "tool_result": result.to_text()
+                })
+        except Exception as e:
+            logger.error(f"Error running tool {item.get('name')}: {e}")
+            self._tool_errors.labels(str(item.get("name"))).inc()
+            error = str(e)
+            await self._send_error_message(server_ws)
+        finally:
+            self._tool_calls_in_flight -= 1
+            # Failed and cancelled calls are timed too, so that a tool timing out doesn't vanish from the latencies
+            outcome = "error" if error is not None else "ok" if result is not None else "cancelled"
+            self._tool_seconds.labels(str(item.get("name")), outcome).observe((returned or time.perf_counter()) - started)
+            if span is not None:
+                self.tracer.end_tool(span, error)
+            if session.capture is not None:
+                session.capture.tool_result(item.get("call_id"), item.get("name"), item.get("arguments"),
+                                            result.to_text() if result is not None else None,
+                                            result.destination.name if result is not None else None,
+                                            time.perf_counter() - started, error)
+
+    async def _create_response_after(self, session: RTSession, tool_calls: list[asyncio.Task], server_ws: web.WebSocketResponse) -> None:
+        # Only ask for the next response once every tool output of this one has been sent
+        await asyncio.gather(*tool_calls, return_exceptions=True)
+        if self.tracer is not None:
+            self.tracer.on_response_create(session.id)
+        await server_ws.send_json({
+            "type": "response.create"
+        })
+
+    async def _send_error_message(self, server_ws: web.WebSocketResponse) -> None:
+        await server_ws.send_json({
+            "type": "conversation.item.create",
+            "item": {
+                "type": "message",
+                "role": "assistant",
+                "status": "completed",
+                "content": [{"type": "text", "text": "There was an error processing your request. Please try again."}],
+            }
+        })
 
-    async def _process_message_to_server(self, msg: str, ws: web.WebSocketResponse) -> Optional[str]:
+    async def _process_message_to_server(self, session: RTSession, msg: str, ws: web.WebSocketResponse) -> Optional[str]:
+        event_type = peek_event_type(msg.data)
+        self._frames_to_server.record(event_type, len(msg.data))
+        if event_type is not None and event_type not in _CLIENT_EVENTS_TO_PROCESS and event_type not in self.client_extension_handlers:
+            return msg.data
         message = json.loads(msg.data)
         updated_message = msg.data
         if message is not None:
+            handler = self.client_extension_handlers.get(message["type"])
+            if handler is not None:
+                # The realtime API would reject an event it doesn't know
+                try:
+                    await handler(session, message)
+                except Exception as e:
+                    logger.error(f"Error handling {message['type']}: {e}")
+                return None
             match message["type"]:
                 case "session.update":
-                    session = message["session"]
+                    rt_session = message["session"]
                     if self.system_message is not None:
-                        session["instructions"] = self.system_message
+                        rt_session["instructions"] = self.system_message
                     if self.temperature is not None:
-                        session["temperature"] = self.temperature
+                        rt_session["temperature"] = self.temperature
                     if self.max_tokens is not None:
-                        session["max_response_output_tokens"] = self.max_tokens
+                        rt_session["max_response_output_tokens"] = self.max_tokens
                     if self.disable_audio is not None:
-                        session["disable_audio"] = self.disable_audio
+                        rt_session["disable_audio"] = self.disable_audio
                     if self.voice_choice is not None:
-                        session["voice"] = self.voice_choice
-                    session["tool_choice"] = "auto" if len(self.tools) > 0 else "none"
-                    session["tools"] = [tool.schema for tool in self.tools.values()]
+                        rt_session["voice"] = self.voice_choice
+                    rt_session["tool_choice"] = "auto" if len(self.tools) > 0 else "none"
+                    rt_session["tools"] = [tool.schema for tool in self.tools.values()]
                     updated_message = json.dumps(message)
 
         return updated_message
 
-    async def _forward_messages(self, ws: web.WebSocketResponse):
-        async with aiohttp.ClientSession(base_url=self.endpoint) as session:
-            params = { "api-version": self.api_version, "deployment": self.deployment}
-            headers = {}
-            if "x-ms-client-request-id" in ws.headers:
-                headers["x-ms-client-request-id"] = ws.headers["x-ms-client-request-id"]
-            if self.key is not None:
-                headers = { "api-key": self.key }
-            else:
-                headers = { "Authorization": f"Bearer {self._token_provider()}" } # NOTE: no async version of token provider, maybe refresh token on a timer?
-            # avoid the websocket connection to be closed in case of errors
-            # this allows the client to reconnect to the server and not sending again the session.update event
-            async with session.ws_connect("/openai/realtime", 
-                                          headers=headers, 
-                                          params=params,
-                                          autoclose=False) as target_ws:
-                async def from_client_to_server():
-                    async for msg in ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            new_msg = await self._process_message_to_server(msg, ws)
-                            if new_msg is not None:
-                                await target_ws.send_str(new_msg)
-                        else:
-                            logger.error("Error: unexpected message type:", msg.type)
-                    
-                    # Means it is gracefully closed by the client then time to close the target_ws
-                    if target_ws:
-                        logger.info("Closing OpenAI's realtime socket connection.")
-                        await target_ws.close()
-                        
-                async def from_server_to_client():
-                    async for msg in target_ws:
-                        if msg.type == aiohttp.WSMsgType.TEXT:
-                            new_msg = await self._process_message_to_client(msg, ws, target_ws)
-                            if new_msg is not None:
-                                await ws.send_str(new_msg)
-                        else:
-                            logger.error("Error: unexpected message type:", msg.type)
+    async def _connect_upstream(self) -> aiohttp.ClientWebSocketResponse:
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession(base_url=self.endpoint)
+        params = { "api-version": self.api_version, "deployment": self.deployment}
+        if self.key is not None:
+            headers = { "api-key": self.key }
+        else:
+            headers = { "Authorization": f"Bearer {await self._token_provider()}" }
+        # avoid the websocket connection to be closed in case of errors
+        # this allows the client to reconnect to the server and not sending again the session.update event
+        return await self._http_session.ws_connect("/openai/realtime", 
+                                                   headers=headers, 
+                                                   params=params,
+                                                   autoclose=False,
+                                                   # aiohttp closes the socket when a ping isn't answered within half of it
+                                                   heartbeat=UPSTREAM_HEARTBEAT_SECONDS)
 
-                try:
-                    await asyncio.gather(from_client_to_server(), 
-                                         from_server_to_client())
-                except ConnectionResetError:
-                    # Ignore the errors resulting from the client disconnecting the socket
-                    pass
-                except Exception as e:
-                    logger.error(f"Error when processing the message: {e}")
-                    pass
+    async def _forward_messages(self, session: RTSession, ws: web.WebSocketResponse):
+        upstream = await self.upstream_pool.claim()
+        target_ws = upstream.ws
+
+        async def from_client_to_server():
+            async for msg in ws:
+                session.touch()
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    if session.capture is not None:
+                        session.capture.client_frame(msg.data)
+                    new_msg = await self._process_message_to_server(session, msg, ws)
+                    if new_msg is not None:
+                        await target_ws.send_str(new_msg)
+                else:
+                    logger.error("Error: unexpected message type:", msg.type)
+            
+            # Means it is gracefully closed by the client then time to close the target_ws
+            if target_ws:
+                logger.info("Closing OpenAI's realtime socket connection.")
+                await target_ws.close()
+                
+        async def from_server_to_client():
+            async def relay(msg):
+                session.touch()
+                if msg.type == aiohttp.WSMsgType.TEXT:
+                    if session.capture is not None:
+                        session.capture.server_frame(msg.data)
+                    new_msg = await self._process_message_to_client(session, msg, ws, target_ws)
+                    if new_msg is not None:
+                        await ws.send_str(new_msg)
+                else:
+                    logger.error("Error: unexpected message type:", msg.type)
+
+            # Events received before this connection was claimed, normally "session.created"
+            for msg in upstream.buffered:
+                await relay(msg)
+            async for msg in target_ws:
+                await relay(msg)
+
+        try:
+            await asyncio.gather(from_client_to_server(), 
+                                 from_server_to_client())
+        except ConnectionResetError:
+            # Ignore the errors resulting from the client disconnecting the socket
+            pass
+        except Exception as e:
+            logger.error(f"Error when processing the message: {e}")
+            pass
+        finally:
+            if not target_ws.closed:
+                await target_ws.close()
 
     async def _websocket_handler(self, request: web.Request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
-        await self._forward_messages(ws)
+        session = self.sessions.create(ws)
+        self._sessions_total.inc()
+        if self.recorder is not None:
+            session.capture = self.recorder.open(session.id)
+        # Tools invoked on behalf of this connection find their session with get_current_session()
+        _current_session.set(session)
+        try:
+            await self._forward_messages(session, ws)
+        finally:
+            session.cancel_tasks()
+            self.sessions.remove(session)
+            if self.tracer is not None:
+                self.tracer.on_session_closed(session.id)
+            if session.capture is not None:
+                session.capture.close()
+            for listener in self.session_closed_listeners:
+                try:
+                    await listener(session)
+                except Exception as e:
+                    logger.error(f"Error closing session {session.id}: {e}")
         return ws
+
+    async def _start_upstream_pool(self, app: web.Application):
+        await self.upstream_pool.start()
+
+    async def _close_sessions(self, app: web.Application):
+        await self.sessions.close()
+
+    async def _close_upstream(self, app: web.Application):
+        await self.upstream_pool.close()
+        if self._http_session is not None:
+            await self._http_session.close()
     
     def attach_to_app(self, app, path):
         app.router.add_get(path, self._websocket_handler)
+        app.on_startup.append(self._start_upstream_pool)
+        app.on_shutdown.append(self._close_sessions)
+        app.on_cleanup.append(self._close_upstream)
+        app.cleanup_ctx.extend(self.cleanup_ctx)
@@ -0,0 +1,14 @@
+from retrieval import estimate_tokens, format_chunks, pack_chunks
+
+def _chunks(count: int, words: int) -> list[tuple[str, str, str]]:
+    return [(f"doc{n}_pages_{n * 2}", f"Document {n}", " ".join(f"word{n}{w}" for w in range(words))) for n in range(count)]
+
+def test_formatted_output_is_within_budget():
+    for budget in (40, 100, 333, 1500):
+        for words in (5, 60, 400):
+            packed = pack_chunks(_chunks(12, words), budget)
+            assert estimate_tokens(format_chunks(packed)) <= budget, (budget, words)
+
+def test_chunks_within_budget_are_kept_whole():
+    chunks = _chunks(3, 10)
+    assert pack_chunks(chunks, sum(estimate_tokens(format_chunks([chunk])) for chunk in chunks)) == chunks
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timezone
+
+from azure.core.exceptions import HttpResponseError, ServiceRequestError
+
+from agents.ragtools import SearchResultCache, _invalidate_on_indexer_run
+
+class _LastResult:
+    def __init__(self, end_time: datetime):
+        self.end_time = end_time
+
+class _Status:
+    def __init__(self, end_time: datetime):
+        self.last_result = _LastResult(end_time)
+
+class _FakeIndexerClient:
+    """Answers the status reads from a script, raising its exceptions, and repeats the last answer."""
+    def __init__(self, script: list):
+        self.script = script
+        self.calls = 0
+
+    async def get_indexer_status(self, name: str):
+        result = self.script[min(self.calls, len(self.script) - 1)]
+        self.calls += 1
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def close(self) -> None:
+        pass
+
+def _watch(indexer_client: _FakeIndexerClient, cache: SearchResultCache, calls: int) -> None:
+    """Runs the indexer watch until it read the status calls times, or for at most a second."""
+    async def run():
+        cleanup_ctx = _invalidate_on_indexer_run(indexer_client, "indexer", cache, interval=0.001, max_retry_interval=0.01)(None)
+        await cleanup_ctx.__anext__()
+        for _ in range(1000):
+            if indexer_client.calls >= calls:
+                break
+            await asyncio.sleep(0.001)
+        await cleanup_ctx.aclose()
+
+    asyncio.run(run())
+
+def _status_error(status_code: int) -> HttpResponseError:
+    error = HttpResponseError(f"Status {status_code}")
+    error.status_code = status_code
+    return error
+
+def test_indexer_run_after_failed_status_reads_clears_cache():
+    first_run = _Status(datetime(2026, 1, 1, tzinfo=timezone.utc))
+    second_run = _Status(datetime(2026, 1, 2, tzinfo=timezone.utc))
+    indexer_client = _FakeIndexerClient([first_run, ServiceRequestError("Connection reset"), _status_error(503), second_run])
+    cache = SearchResultCache(max_size=8, ttl=60)
+    cache.put(("query",), [("1", "title", "content")])
+    _watch(indexer_client, cache, calls=4)
+    assert indexer_client.calls >= 4
+    assert cache.get(("query",)) is None
+
+def test_missing_indexer_stops_watching():
+    indexer_client = _FakeIndexerClient([_status_error(404)])
+    cache = SearchResultCache(max_size=8, ttl=60)
+    _watch(indexer_client, cache, calls=2)
+    assert indexer_client.calls == 1
@@ -0,0 +1,46 @@
+import asyncio
+
+from aiohttp import ClientResponseError, RequestInfo
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+from utils import DurableQueue, PartialDeliveryError, WriteBehindQueue
+
+def _response_error(status: int) -> ClientResponseError:
+    url = URL("http://logic.app/create")
+    return ClientResponseError(RequestInfo(url, "POST", CIMultiDictProxy(CIMultiDict()), url), (), status=status)
+
+def test_rejected_dedupe_key_can_be_queued_again(tmp_path):
+    async def run():
+        async def deliver(key, payloads):
+            error = _response_error(400)
+            raise PartialDeliveryError(0, error) from error
+
+        outbox = WriteBehindQueue(DurableQueue(tmp_path / "outbox.db"), deliver, max_delay=0.0)
+        await outbox.start()
+        assert await outbox.put("session", {"text": "Order gloves"}, dedupe_key="gloves")
+        outbox.flush("session")
+        while len(outbox) > 0:
+            await asyncio.sleep(0.01)
+        assert outbox.dropped == 1
+        # The task was never created, dictating it again must queue it
+        assert await outbox.put("session", {"text": "Order gloves"}, dedupe_key="gloves")
+        await outbox.close(timeout=0.1)
+
+    asyncio.run(run())
+
+def test_delivered_dedupe_key_is_not_queued_again(tmp_path):
+    async def run():
+        async def deliver(key, payloads):
+            pass
+
+        outbox = WriteBehindQueue(DurableQueue(tmp_path / "outbox.db"), deliver, max_delay=0.0)
+        await outbox.start()
+        assert await outbox.put("session", {"text": "Order gloves"}, dedupe_key="gloves")
+        outbox.flush("session")
+        while len(outbox) > 0:
+            await asyncio.sleep(0.01)
+        assert not await outbox.put("session", {"text": "Order gloves"}, dedupe_key="gloves")
+        await outbox.close(timeout=0.1)
+
+    asyncio.run(run())
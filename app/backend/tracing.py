@@ -0,0 +1,334 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Optional
+
+import aiohttp
+from aiohttp import web
+
+from utils import MetricsRegistry
+
+logger = logging.getLogger("voiceassistant")
+
+SERVICE_NAME = "voicerag-middle-tier"
+SCOPE_NAME = "rtmt"
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_CLIENT = 3
+
+# Server events that move a turn forward, looked up for every relayed frame
+TRACED_SERVER_EVENTS = frozenset({
+    "input_audio_buffer.speech_started",
+    "input_audio_buffer.speech_stopped",
+    "conversation.item.input_audio_transcription.completed",
+    "response.created",
+    "response.audio.delta",
+})
+
+def _new_id(length: int) -> str:
+    return os.urandom(length).hex()
+
+def _attribute_value(value: Any) -> dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def _attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+    return [{"key": key, "value": _attribute_value(value)} for key, value in attributes.items()]
+
+class Span:
+    """A timed operation of a turn, serialized like an OpenTelemetry span in OTLP JSON."""
+    __slots__ = ("trace_id", "span_id", "parent_span_id", "name", "kind", "start_ns", "end_ns", "attributes", "events", "error")
+
+    def __init__(self, trace_id: str, name: str, parent_span_id: str = "", kind: int = SPAN_KIND_INTERNAL,
+                 start_ns: Optional[int] = None, attributes: Optional[dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_span_id = parent_span_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns if start_ns is not None else time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes or {}
+        self.events: list[tuple[str, int]] = []
+        self.error: Optional[str] = None
+
+    def add_event(self, name: str, timestamp_ns: Optional[int] = None) -> None:
+        self.events.append((name, timestamp_ns if timestamp_ns is not None else time.time_ns()))
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is None:
+            self.end_ns = end_ns if end_ns is not None else time.time_ns()
+
+    def to_otlp(self) -> dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": _attributes(self.attributes),
+            "events": [{"name": name, "timeUnixNano": str(timestamp)} for name, timestamp in self.events],
+            # OTLP status codes: 1 is ok, 2 is error
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_span_id:
+            span["parentSpanId"] = self.parent_span_id
+        return span
+
+def otlp_request(spans: list[Span]) -> dict[str, Any]:
+    """Body of an OTLP/HTTP JSON ExportTraceServiceRequest carrying the spans."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": SERVICE_NAME})},
+            "scopeSpans": [{"scope": {"name": SCOPE_NAME}, "spans": [span.to_otlp() for span in spans]}]
+        }]
+    }
+
+class SpanExporter(ABC):
+    @abstractmethod
+    async def export(self, spans: list[Span]) -> None:
+        """Send a batch of finished spans, raising if they couldn't be delivered."""
+
+    async def close(self) -> None:
+        pass
+
+class FileSpanExporter(SpanExporter):
+    """Appends every batch as one OTLP JSON line, e.g. to inspect locally or to ship with a log collector."""
+    path: Path
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _write(self, line: str) -> None:
+        with self.path.open("a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+    async def export(self, spans: list[Span]) -> None:
+        await asyncio.to_thread(self._write, json.dumps(otlp_request(spans), separators=(",", ":")))
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """Posts the batches to an OpenTelemetry collector, e.g. http://localhost:4318/v1/traces."""
+    url: str
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def export(self, spans: list[Span]) -> None:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+        async with self._session.post(self.url, json=otlp_request(spans)) as response:
+            response.raise_for_status()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+class _Turn:
+    root: Span
+    spans: list[Span]
+    transcription: Optional[Span]
+    response: Optional[Span]
+    speech_stopped_ns: Optional[int]
+    first_audio_ns: Optional[int]
+    tool_calls: int
+    # Tool spans not ended yet, the turn is only exported once they are
+    open_tools: int
+    finished_ns: Optional[int]
+
+    def __init__(self, root: Span, speech_stopped_ns: Optional[int]):
+        self.root = root
+        self.spans = [root]
+        self.transcription = None
+        self.response = None
+        self.speech_stopped_ns = speech_stopped_ns
+        self.first_audio_ns = None
+        self.tool_calls = 0
+        self.open_tools = 0
+        self.finished_ns = None
+
+    def child(self, name: str, kind: int = SPAN_KIND_INTERNAL, start_ns: Optional[int] = None, **attributes: Any) -> Span:
+        span = Span(self.root.trace_id, name, self.root.span_id, kind, start_ns, attributes)
+        self.spans.append(span)
+        return span
+
+class TurnTracer:
+    """
+    One trace per voice turn, from the moment the user stops speaking to the end of the answer, showing where
+    the time to the first audio byte goes.
+
+    The root "turn" span starts at input_audio_buffer.speech_stopped (or at response.created for turns
+    without speech), has a child span for the transcription, every tool call and every model response, and
+    events for the transcription, response.create and the first response.audio.delta. Its
+    "turn.first_audio_ms" attribute is the latency the user hears. Turns end with the first response.done
+    that doesn't call tools, when the next turn starts, or when the session closes. Speech starting while
+    the answer plays is a barge-in and ends the turn as interrupted, but not speech starting before the first
+    answer audio (e.g. while the tools run): the model still answers the pending turn then, and it is only
+    interrupted if the user speech ends, starting the next turn, before the answer is done.
+
+    Tool calls still running when their turn ends keep their real duration: the turn is exported once the
+    last of them returns.
+
+    Finished turns are batched and exported in the background every export_interval seconds, so tracing
+    only costs a set lookup per relayed frame.
+    """
+    export_interval: float
+    max_queued_spans: int
+    exported: int
+    dropped: int
+
+    def __init__(self, exporter: SpanExporter, metrics: Optional[MetricsRegistry] = None,
+                 export_interval: float = 1.0, max_queued_spans: int = 10000):
+        self.exporter = exporter
+        self.export_interval = export_interval
+        self.max_queued_spans = max_queued_spans
+        self.exported = 0
+        self.dropped = 0
+        self._turns: dict[str, _Turn] = {}
+        # Turn of every tool span not ended yet
+        self._open_tools: dict[Span, _Turn] = {}
+        self._queue: list[Span] = []
+        self._task: Optional[asyncio.Task] = None
+        self._first_audio_seconds = None
+        if metrics is not None:
+            self._first_audio_seconds = metrics.histogram(
+                "rtmt_turn_first_audio_seconds", "Time from the end of the user speech to the first audio of the answer.")
+
+    def _start(self, session_id: str, timestamp_ns: int, speech: bool) -> _Turn:
+        self._finish(session_id, interrupted=True)
+        root = Span(_new_id(16), "turn", start_ns=timestamp_ns, attributes={"session.id": session_id})
+        turn = self._turns[session_id] = _Turn(root, timestamp_ns if speech else None)
+        if speech:
+            root.add_event("input_audio_buffer.speech_stopped", timestamp_ns)
+            turn.transcription = turn.child("transcription", start_ns=timestamp_ns)
+        return turn
+
+    def on_server_event(self, session_id: str, event_type: str) -> None:
+        """Called with the relayed server events in TRACED_SERVER_EVENTS."""
+        turn = self._turns.get(session_id)
+        if event_type == "response.audio.delta":
+            if turn is not None and turn.first_audio_ns is None:
+                turn.first_audio_ns = time.time_ns()
+                turn.root.add_event("response.audio.delta.first", turn.first_audio_ns)
+            return
+        now = time.time_ns()
+        if event_type == "input_audio_buffer.speech_stopped":
+            self._start(session_id, now, speech=True)
+        elif event_type == "input_audio_buffer.speech_started":
+            # Barge-in: the answer being played is abandoned
+            if turn is not None and turn.first_audio_ns is not None:
+                self._finish(session_id, interrupted=True)
+        elif event_type == "conversation.item.input_audio_transcription.completed":
+            if turn is not None and turn.transcription is not None:
+                turn.transcription.end(now)
+                turn.root.add_event(event_type, now)
+        elif event_type == "response.created":
+            if turn is None:
+                turn = self._start(session_id, now, speech=False)
+            turn.response = turn.child("model.response", SPAN_KIND_CLIENT, now)
+
+    def on_response_create(self, session_id: str) -> None:
+        """Called when the middle tier asks for the next response after the tool calls."""
+        if (turn := self._turns.get(session_id)) is not None:
+            turn.root.add_event("response.create")
+
+    def on_response_done(self, session_id: str, calls_tools: bool) -> None:
+        turn = self._turns.get(session_id)
+        if turn is None:
+            return
+        if turn.response is not None:
+            turn.response.attributes["response.calls_tools"] = calls_tools
+            turn.response.end()
+            turn.response = None
+        if not calls_tools:
+            self._finish(session_id)
+
+    def start_tool(self, session_id: str, name: str, call_id: str) -> Optional[Span]:
+        if (turn := self._turns.get(session_id)) is None:
+            return None
+        turn.tool_calls += 1
+        turn.open_tools += 1
+        span = turn.child(f"tool {name}", **{"tool.name": name, "tool.call_id": call_id})
+        self._open_tools[span] = turn
+        return span
+
+    def end_tool(self, span: Span, error: Optional[str] = None) -> None:
+        span.error = error
+        span.end()
+        if (turn := self._open_tools.pop(span, None)) is not None:
+            turn.open_tools -= 1
+            if turn.finished_ns is not None and turn.open_tools == 0:
+                self._enqueue(turn)
+
+    def on_session_closed(self, session_id: str) -> None:
+        self._finish(session_id, interrupted=True)
+
+    def _finish(self, session_id: str, interrupted: bool = False) -> None:
+        turn = self._turns.pop(session_id, None)
+        if turn is None:
+            return
+        now = time.time_ns()
+        root = turn.root
+        root.attributes["turn.interrupted"] = interrupted
+        root.attributes["turn.tool_calls"] = turn.tool_calls
+        if turn.speech_stopped_ns is not None and turn.first_audio_ns is not None:
+            first_audio_seconds = (turn.first_audio_ns - turn.speech_stopped_ns) / 1e9
+            root.attributes["turn.first_audio_ms"] = round(first_audio_seconds * 1000, 1)
+            if self._first_audio_seconds is not None:
+                self._first_audio_seconds.observe(first_audio_seconds)
+        turn.finished_ns = now
+        for span in turn.spans:
+            if span is not root and span not in self._open_tools:
+                span.end(now)
+        if turn.open_tools == 0:
+            self._enqueue(turn)
+
+    def _enqueue(self, turn: _Turn) -> None:
+        # The turn lasts until its last tool call returned
+        turn.root.end(max([turn.finished_ns] + [span.end_ns for span in turn.spans if span.end_ns is not None]))
+        if len(self._queue) + len(turn.spans) > self.max_queued_spans:
+            # The exporter can't keep up, keep the memory bounded
+            self.dropped += len(turn.spans)
+            return
+        self._queue.extend(turn.spans)
+
+    async def _export(self) -> None:
+        if not self._queue:
+            return
+        spans, self._queue = self._queue, []
+        try:
+            await self.exporter.export(spans)
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            logger.warning(f"Can't export {len(spans)} spans: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.export_interval)
+            await self._export()
+
+    async def cleanup_ctx(self, app: web.Application):
+        self._task = asyncio.create_task(self._run())
+        yield
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        for session_id in list(self._turns):
+            self._finish(session_id, interrupted=True)
+        # Tool calls still running at shutdown won't return
+        for span in list(self._open_tools):
+            self.end_tool(span, "Not finished at shutdown")
+        await self._export()
+        await self.exporter.close()
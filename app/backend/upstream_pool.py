@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+import aiohttp
+
+logger = logging.getLogger("voiceassistant")
+
+class UpstreamConnection:
+    """A realtime websocket to Azure OpenAI with the events it received before a client claimed it."""
+    ws: aiohttp.ClientWebSocketResponse
+    # Events received while warming up (normally just "session.created"), to be relayed to the client first
+    buffered: list[aiohttp.WSMessage]
+    opened_at: float
+    # Time from starting the connection to receiving the first "session.created"
+    session_created_seconds: float
+    # Reads the socket while it waits in the pool, see UpstreamPool._watch
+    watcher: Optional[asyncio.Task] = None
+
+    def __init__(self, ws: aiohttp.ClientWebSocketResponse, buffered: list[aiohttp.WSMessage], opened_at: float, session_created_seconds: float):
+        self.ws = ws
+        self.buffered = buffered
+        self.opened_at = opened_at
+        self.session_created_seconds = session_created_seconds
+        self.watcher = None
+
+    def age(self) -> float:
+        return time.monotonic() - self.opened_at
+
+class UpstreamPoolStats:
+    claims: int = 0
+    hits: int = 0
+    connects: int = 0
+    connect_failures: int = 0
+    discarded: int = 0
+    last_session_created_seconds: Optional[float] = None
+    total_session_created_seconds: float = 0.0
+
+    def record_session_created(self, seconds: float) -> None:
+        self.connects += 1
+        self.last_session_created_seconds = seconds
+        self.total_session_created_seconds += seconds
+
+    def mean_session_created_seconds(self) -> Optional[float]:
+        return self.total_session_created_seconds / self.connects if self.connects > 0 else None
+
+class UpstreamPool:
+    """
+    Keeps a few realtime websockets connected ahead of time so that a new client doesn't pay the TLS, auth and
+    realtime handshake before its first turn. Sockets older than max_idle_age or found unhealthy are discarded,
+    and the pool is refilled in the background. With size 0 every claim opens a fresh connection.
+
+    Idle sockets are read in the background, so that the pongs answering the heartbeat of the websocket (the
+    heartbeat argument of ws_connect, which connect should set) are processed and aiohttp closes a half-open
+    socket that stops answering. A socket closed that way, or by the server, is discarded.
+    """
+    size: int
+    max_idle_age: float
+    health_check_interval: float
+    session_created_timeout: float
+    stats: UpstreamPoolStats
+    # Called with the seconds every new connection took to get "session.created", e.g. to record metrics
+    connect_listeners: list[Callable[[float], None]]
+
+    def __init__(self, connect: Callable[[], Awaitable[aiohttp.ClientWebSocketResponse]], size: int, max_idle_age: float,
+                 health_check_interval: float = 15.0, session_created_timeout: float = 10.0):
+        self._connect = connect
+        self.size = size
+        self.max_idle_age = max_idle_age
+        self.health_check_interval = health_check_interval
+        self.session_created_timeout = session_created_timeout
+        self.stats = UpstreamPoolStats()
+        self.connect_listeners = []
+        self._idle: deque[UpstreamConnection] = deque()
+        self._opening = 0
+        self._maintenance: Optional[asyncio.Task] = None
+        self._refill: Optional[asyncio.Task] = None
+
+    def idle_count(self) -> int:
+        return len(self._idle)
+
+    async def start(self) -> None:
+        if self.size > 0 and self._maintenance is None:
+            self._maintenance = asyncio.create_task(self._maintain())
+
+    async def close(self) -> None:
+        for task in (self._maintenance, self._refill):
+            if task is not None:
+                task.cancel()
+        self._maintenance = self._refill = None
+        while self._idle:
+            connection = self._idle.popleft()
+            await self._stop_watching(connection)
+            await connection.ws.close()
+
+    async def claim(self) -> UpstreamConnection:
+        """Take a healthy pre-connected socket if there is one, otherwise connect right away."""
+        self.stats.claims += 1
+        connection = None
+        while self._idle:
+            candidate = self._idle.popleft()
+            await self._stop_watching(candidate)
+            if self._is_healthy(candidate):
+                connection = candidate
+                break
+            await self._discard(candidate)
+        self._schedule_refill()
+        if connection is not None:
+            self.stats.hits += 1
+            return connection
+        return await self._open()
+
+    async def _open(self) -> UpstreamConnection:
+        started = time.monotonic()
+        ws = await self._connect()
+        try:
+            # The realtime API opens every connection with "session.created", waiting for it also proves the socket works
+            first = await ws.receive(timeout=self.session_created_timeout)
+        except BaseException:
+            await ws.close()
+            raise
+        if first.type != aiohttp.WSMsgType.TEXT:
+            await ws.close()
+            raise ConnectionError(f"Realtime connection closed during the handshake: {first.type}")
+        seconds = time.monotonic() - started
+        self.stats.record_session_created(seconds)
+        for listener in self.connect_listeners:
+            listener(seconds)
+        logger.info("Realtime connection ready in %.0f ms", seconds * 1000)
+        return UpstreamConnection(ws, [first], started, seconds)
+
+    def _is_healthy(self, connection: UpstreamConnection) -> bool:
+        if connection.ws.closed or connection.ws.exception() is not None:
+            return False
+        if connection.watcher is not None and connection.watcher.done():
+            # The socket was closed while idle, e.g. by the heartbeat
+            return False
+        return connection.age() < self.max_idle_age
+
+    async def _watch(self, connection: UpstreamConnection) -> None:
+        while True:
+            msg = await connection.ws.receive()
+            if msg.type != aiohttp.WSMsgType.TEXT:
+                logger.info(f"Idle realtime connection lost: {msg.type}")
+                return
+            # Relayed to the client that claims the connection
+            connection.buffered.append(msg)
+
+    def _add_idle(self, connection: UpstreamConnection) -> None:
+        connection.watcher = asyncio.create_task(self._watch(connection))
+        self._idle.append(connection)
+
+    async def _stop_watching(self, connection: UpstreamConnection) -> None:
+        if connection.watcher is not None and not connection.watcher.done():
+            connection.watcher.cancel()
+            await asyncio.gather(connection.watcher, return_exceptions=True)
+
+    async def _discard(self, connection: UpstreamConnection) -> None:
+        await self._stop_watching(connection)
+        self.stats.discarded += 1
+        if not connection.ws.closed:
+            await connection.ws.close()
+
+    def _schedule_refill(self) -> None:
+        if self.size > 0 and (self._refill is None or self._refill.done()):
+            self._refill = asyncio.create_task(self._fill())
+
+    async def _fill(self) -> None:
+        while len(self._idle) + self._opening < self.size:
+            self._opening += 1
+            try:
+                self._add_idle(await self._open())
+            except Exception as e:
+                # Leave the remaining slots to the next health check rather than hammering the endpoint
+                self.stats.connect_failures += 1
+                logger.warning(f"Could not pre-connect realtime socket: {e}")
+                return
+            finally:
+                self._opening -= 1
+
+    async def _maintain(self) -> None:
+        while True:
+            for _ in range(len(self._idle)):
+                if not self._idle:
+                    # Claimed by clients while we were checking
+                    break
+                connection = self._idle.popleft()
+                if self._is_healthy(connection):
+                    self._idle.append(connection)
+                else:
+                    await self._discard(connection)
+            self._schedule_refill()
+            await asyncio.sleep(self.health_check_interval)
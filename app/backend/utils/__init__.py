@@ -1,3 +1,10 @@
+from .durable_queue import DurableQueue, QueueEntry
+from .expression import ExpressionError, evaluate_expression
+from .http_client import ToolHttpClient
+from .metrics import EventLoopLagMonitor, MetricsRegistry
+from .token_manager import AsyncTokenManager
+from .ttl_cache import TTLCache
 from .utils import decode_url_string, is_float
+from .write_behind import PartialDeliveryError, WriteBehindQueue
 
-__all__ = ['decode_url_string', 'is_float']
+__all__ = ['AsyncTokenManager', 'DurableQueue', 'EventLoopLagMonitor', 'ExpressionError', 'MetricsRegistry', 'PartialDeliveryError', 'QueueEntry', 'TTLCache', 'ToolHttpClient', 'WriteBehindQueue', 'decode_url_string', 'evaluate_expression', 'is_float']
@@ -0,0 +1,119 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+class QueueEntry:
+    id: int
+    key: str
+    payload: Any
+    size: int
+    created_at: float
+    dedupe_key: Optional[str]
+
+    def __init__(self, id: int, key: str, payload: Any, size: int, created_at: float, dedupe_key: Optional[str] = None):
+        self.id = id
+        self.key = key
+        self.payload = payload
+        self.size = size
+        self.created_at = created_at
+        self.dedupe_key = dedupe_key
+
+class DurableQueue:
+    """
+    FIFO of JSON payloads spooled to a SQLite file, so that work acknowledged to the user survives a worker
+    restart until it has been delivered. Entries are grouped by key (e.g. the file a note is appended to) and
+    kept in insertion order within a key.
+
+    Entries put with a dedupe key are only queued once: while the key is queued, and for dedupe_retention
+    seconds after its entry was delivered, putting it again is a no-op.
+
+    Calls are blocking but short, run them with asyncio.to_thread from the event loop. A single connection is
+    shared by the threads under a lock, and every write is committed before the call returns.
+    """
+    path: Path
+    dedupe_retention: float
+
+    def __init__(self, path: Path | str, dedupe_retention: float = 24 * 3600):
+        self.path = Path(path)
+        self.dedupe_retention = dedupe_retention
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                dedupe_key TEXT
+            )""")
+        # Spools created before dedupe keys existed
+        if "dedupe_key" not in [row[1] for row in self._connection.execute("PRAGMA table_info(entries)")]:
+            self._connection.execute("ALTER TABLE entries ADD COLUMN dedupe_key TEXT")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS entries_key ON entries (key, id)")
+        self._connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS entries_dedupe_key ON entries (dedupe_key)")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS delivered (
+                dedupe_key TEXT PRIMARY KEY,
+                delivered_at REAL NOT NULL
+            )""")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def put(self, key: str, payload: Any, size: int = 0, dedupe_key: Optional[str] = None) -> Optional[int]:
+        """ID of the new entry, None if the dedupe key is queued or was delivered recently."""
+        with self._lock:
+            if dedupe_key is not None and self._connection.execute(
+                    "SELECT 1 FROM delivered WHERE dedupe_key = ? AND delivered_at >= ?",
+                    (dedupe_key, time.time() - self.dedupe_retention)).fetchone():
+                return None
+            cursor = self._connection.execute(
+                "INSERT OR IGNORE INTO entries (key, payload, size, created_at, dedupe_key) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(payload), size, time.time(), dedupe_key))
+            return cursor.lastrowid if cursor.rowcount else None
+
+    def peek(self, key: str, limit: int) -> list[QueueEntry]:
+        """Oldest entries of a key, left in the queue until removed."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT id, key, payload, size, created_at, dedupe_key FROM entries WHERE key = ? ORDER BY id LIMIT ?",
+                (key, limit)).fetchall()
+        return [QueueEntry(id, key, json.loads(payload), size, created_at, dedupe_key)
+                for id, key, payload, size, created_at, dedupe_key in rows]
+
+    def remove(self, ids: list[int]) -> None:
+        """Remove delivered entries, their dedupe keys are kept for dedupe_retention seconds."""
+        now = time.time()
+        placeholders = ", ".join("?" * len(ids))
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.execute(
+                f"INSERT OR REPLACE INTO delivered SELECT dedupe_key, ? FROM entries WHERE id IN ({placeholders}) AND dedupe_key IS NOT NULL",
+                [now, *ids])
+            self._connection.execute(f"DELETE FROM entries WHERE id IN ({placeholders})", ids)
+            self._connection.execute("DELETE FROM delivered WHERE delivered_at < ?", (now - self.dedupe_retention,))
+            self._connection.execute("COMMIT")
+
+    def discard(self, ids: list[int]) -> None:
+        """Remove entries that won't be delivered, their dedupe keys can be queued again right away."""
+        placeholders = ", ".join("?" * len(ids))
+        with self._lock:
+            self._connection.execute(f"DELETE FROM entries WHERE id IN ({placeholders})", ids)
+
+    def keys(self) -> dict[str, tuple[int, int]]:
+        """Number of entries and total size of every key with entries, e.g. to resume after a restart."""
+        with self._lock:
+            rows = self._connection.execute("SELECT key, COUNT(*), SUM(size) FROM entries GROUP BY key").fetchall()
+        return {key: (count, size) for key, count, size in rows}
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
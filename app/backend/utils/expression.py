@@ -0,0 +1,422 @@
+import ast
+import math
+import operator
+import re
+from typing import Any, Callable, Optional
+
+import numpy as np
+
+# Longest expression and list accepted, the model reads whole expressions out of the user's speech
+MAX_EXPRESSION_LENGTH = 500
+MAX_LIST_LENGTH = 1000
+MAX_EXPONENT = 100
+
+class ExpressionError(ValueError):
+    """The expression can't be evaluated, the message is meant to be read back to the model."""
+
+# Exponents of kg, m, s, mol and K
+Dimensions = tuple[float, float, float, float, float]
+_DIMENSIONLESS: Dimensions = (0, 0, 0, 0, 0)
+_MASS: Dimensions = (1, 0, 0, 0, 0)
+_LENGTH: Dimensions = (0, 1, 0, 0, 0)
+_VOLUME: Dimensions = (0, 3, 0, 0, 0)
+_TIME: Dimensions = (0, 0, 1, 0, 0)
+_AMOUNT: Dimensions = (0, 0, 0, 1, 0)
+_TEMPERATURE: Dimensions = (0, 0, 0, 0, 1)
+_CONCENTRATION: Dimensions = (0, -3, 0, 1, 0)
+_MASS_CONCENTRATION: Dimensions = (1, -3, 0, 0, 0)
+_MOLAR_MASS: Dimensions = (1, 0, 0, -1, 0)
+
+# Unit name -> (size in SI units, dimensions)
+UNITS: dict[str, tuple[float, Dimensions]] = {
+    "kg": (1.0, _MASS), "g": (1e-3, _MASS), "mg": (1e-6, _MASS), "ug": (1e-9, _MASS), "µg": (1e-9, _MASS),
+    "m": (1.0, _LENGTH), "cm": (1e-2, _LENGTH), "mm": (1e-3, _LENGTH),
+    "L": (1e-3, _VOLUME), "mL": (1e-6, _VOLUME), "uL": (1e-9, _VOLUME), "µL": (1e-9, _VOLUME),
+    "l": (1e-3, _VOLUME), "ml": (1e-6, _VOLUME), "ul": (1e-9, _VOLUME),
+    "s": (1.0, _TIME), "min": (60.0, _TIME), "h": (3600.0, _TIME),
+    "mol": (1.0, _AMOUNT), "mmol": (1e-3, _AMOUNT), "umol": (1e-6, _AMOUNT), "µmol": (1e-6, _AMOUNT),
+    "M": (1e3, _CONCENTRATION), "mM": (1.0, _CONCENTRATION), "uM": (1e-3, _CONCENTRATION),
+    "µM": (1e-3, _CONCENTRATION), "nM": (1e-6, _CONCENTRATION),
+    "K": (1.0, _TEMPERATURE),
+}
+
+# Unit used for results of these dimensions when the expression doesn't mention one
+_DISPLAY_UNITS: dict[Dimensions, str] = {
+    _MASS: "g", _LENGTH: "cm", _VOLUME: "mL", _TIME: "s", _AMOUNT: "mol", _TEMPERATURE: "K",
+    _CONCENTRATION: "M", _MASS_CONCENTRATION: "g/L", _MOLAR_MASS: "g/mol",
+}
+_COMPOUND_UNITS: dict[str, tuple[float, Dimensions]] = {
+    "g/L": (1.0, _MASS_CONCENTRATION), "g/mol": (1e-3, _MOLAR_MASS),
+}
+
+# Standard atomic weights (g/mol) of the elements found in lab reagents
+ATOMIC_WEIGHTS = {
+    "H": 1.008, "He": 4.0026, "Li": 6.94, "Be": 9.0122, "B": 10.81, "C": 12.011, "N": 14.007, "O": 15.999,
+    "F": 18.998, "Ne": 20.180, "Na": 22.990, "Mg": 24.305, "Al": 26.982, "Si": 28.085, "P": 30.974, "S": 32.06,
+    "Cl": 35.45, "Ar": 39.948, "K": 39.098, "Ca": 40.078, "Sc": 44.956, "Ti": 47.867, "V": 50.942, "Cr": 51.996,
+    "Mn": 54.938, "Fe": 55.845, "Co": 58.933, "Ni": 58.693, "Cu": 63.546, "Zn": 65.38, "Ga": 69.723,
+    "Ge": 72.630, "As": 74.922, "Se": 78.971, "Br": 79.904, "Kr": 83.798, "Rb": 85.468, "Sr": 87.62,
+    "Mo": 95.95, "Pd": 106.42, "Ag": 107.87, "Cd": 112.41, "Sn": 118.71, "I": 126.90, "Ba": 137.33,
+    "Pt": 195.08, "Au": 196.97, "Hg": 200.59, "Pb": 207.2,
+}
+
+_FORMULA_TOKEN = re.compile(r"([A-Z][a-z]?)|(\d+)|([(\[])|([)\]])")
+_HYDRATE_SEPARATOR = re.compile(r"[.·*]")
+
+def molar_mass_of(formula: str) -> float:
+    """Molar mass in g/mol of a formula such as "C6H6", "Ca(OH)2" or "CuSO4·5H2O"."""
+    return sum(_molar_mass_of_part(part, formula) for part in _HYDRATE_SEPARATOR.split(formula.replace(" ", "")))
+
+def _molar_mass_of_part(part: str, formula: str) -> float:
+    coefficient = re.match(r"\d*", part).group()
+    # Masses of the enclosing groups, and of the last element or group which a count multiplies
+    stack = [0.0]
+    last = 0.0
+    position = len(coefficient)
+    while position < len(part):
+        match = _FORMULA_TOKEN.match(part, position)
+        if match is None:
+            raise ExpressionError(f"Can't read the formula {formula}")
+        element, count, opening, closing = match.groups()
+        if element is not None:
+            if element not in ATOMIC_WEIGHTS:
+                raise ExpressionError(f"Unknown element {element} in {formula}")
+            last = ATOMIC_WEIGHTS[element]
+            stack[-1] += last
+        elif count is not None:
+            stack[-1] += last * (int(count) - 1)
+        elif opening is not None:
+            stack.append(0.0)
+        else:
+            if len(stack) == 1:
+                raise ExpressionError(f"Unbalanced parentheses in {formula}")
+            last = stack.pop()
+            stack[-1] += last
+        position = match.end()
+    if len(stack) != 1 or stack[0] == 0:
+        raise ExpressionError(f"Can't read the formula {formula}")
+    return stack[0] * int(coefficient or 1)
+
+class Quantity:
+    """A number or an array of numbers in SI units, with their dimensions."""
+    value: float | np.ndarray
+    dimensions: Dimensions
+
+    def __init__(self, value: float | np.ndarray, dimensions: Dimensions = _DIMENSIONLESS):
+        self.value = value
+        self.dimensions = dimensions
+
+    def _check_same(self, other: "Quantity", operation: str) -> None:
+        if self.dimensions != other.dimensions:
+            raise ExpressionError(f"Can't {operation} {_describe(self.dimensions)} and {_describe(other.dimensions)}")
+
+    def __add__(self, other: "Quantity") -> "Quantity":
+        self._check_same(other, "add")
+        return Quantity(self.value + other.value, self.dimensions)
+
+    def __sub__(self, other: "Quantity") -> "Quantity":
+        self._check_same(other, "subtract")
+        return Quantity(self.value - other.value, self.dimensions)
+
+    def __mul__(self, other: "Quantity") -> "Quantity":
+        return Quantity(self.value * other.value, tuple(a + b for a, b in zip(self.dimensions, other.dimensions)))
+
+    def __truediv__(self, other: "Quantity") -> "Quantity":
+        if np.any(np.asarray(other.value) == 0):
+            raise ExpressionError("Division by zero")
+        return Quantity(self.value / other.value, tuple(a - b for a, b in zip(self.dimensions, other.dimensions)))
+
+    def __mod__(self, other: "Quantity") -> "Quantity":
+        self._check_same(other, "take the remainder of")
+        if np.any(np.asarray(other.value) == 0):
+            raise ExpressionError("Division by zero")
+        return Quantity(self.value % other.value, self.dimensions)
+
+    def __pow__(self, other: "Quantity") -> "Quantity":
+        if other.dimensions != _DIMENSIONLESS or isinstance(other.value, np.ndarray):
+            raise ExpressionError("Exponents must be plain numbers")
+        if abs(other.value) > MAX_EXPONENT:
+            raise ExpressionError(f"Exponents are limited to {MAX_EXPONENT}")
+        return Quantity(self.value ** other.value, tuple(d * other.value for d in self.dimensions))
+
+    def __neg__(self) -> "Quantity":
+        return Quantity(-self.value, self.dimensions)
+
+def _describe(dimensions: Dimensions) -> str:
+    names = {_DIMENSIONLESS: "plain numbers", _MASS: "a mass", _LENGTH: "a length", _VOLUME: "a volume",
+             _TIME: "a time", _AMOUNT: "an amount", _TEMPERATURE: "a temperature", _CONCENTRATION: "a concentration",
+             _MASS_CONCENTRATION: "a mass concentration", _MOLAR_MASS: "a molar mass"}
+    return names.get(dimensions, "a quantity in " + _si_unit(dimensions))
+
+def _si_unit(dimensions: Dimensions) -> str:
+    parts = []
+    for symbol, exponent in zip(("kg", "m", "s", "mol", "K"), dimensions):
+        if exponent == 1:
+            parts.append(symbol)
+        elif exponent != 0:
+            parts.append(f"{symbol}^{exponent:g}")
+    return "·".join(parts)
+
+def _unit(name: str) -> Optional[tuple[float, Dimensions]]:
+    return UNITS.get(name) or _COMPOUND_UNITS.get(name)
+
+def _number(value: Any) -> Quantity:
+    # NumPy scalars rather than floats, so errors like overflows are raised under np.errstate
+    return Quantity(value if isinstance(value, np.ndarray) else np.float64(value))
+
+def _scalar(quantity: Quantity, what: str) -> float:
+    if isinstance(quantity.value, np.ndarray):
+        raise ExpressionError(f"{what} must be a single value")
+    return quantity.value
+
+def _dilution(c1: Optional[Quantity] = None, v1: Optional[Quantity] = None,
+              c2: Optional[Quantity] = None, v2: Optional[Quantity] = None) -> Quantity:
+    """C1·V1 = C2·V2, solved for the one value left out."""
+    given = {"c1": c1, "v1": v1, "c2": c2, "v2": v2}
+    missing = [name for name, value in given.items() if value is None]
+    if len(missing) != 1:
+        raise ExpressionError("dilution needs exactly three of c1, v1, c2 and v2")
+    if missing[0] == "c1":
+        return c2 * v2 / v1
+    if missing[0] == "v1":
+        return c2 * v2 / c1
+    if missing[0] == "c2":
+        return c1 * v1 / v2
+    return c1 * v1 / c2
+
+def _percent(part: Quantity, whole: Quantity) -> Quantity:
+    """How many percent part is of whole."""
+    part._check_same(whole, "compare")
+    return Quantity((part / whole).value * 100)
+
+def _percent_of(percent: Quantity, whole: Quantity) -> Quantity:
+    return Quantity(percent.value / 100, percent.dimensions) * whole
+
+def _convert(quantity: Quantity, unit: str) -> Quantity:
+    # Only used through to(value, "unit"), the target unit is picked up by the formatting
+    if _unit(unit) is None:
+        raise ExpressionError(f"Unknown unit {unit}")
+    if _unit(unit)[1] != quantity.dimensions:
+        raise ExpressionError(f"Can't convert {_describe(quantity.dimensions)} to {unit}")
+    return quantity
+
+def _elementwise(name: str, function: Callable[[Any], Any]) -> Callable[[Quantity], Quantity]:
+    def apply(quantity: Quantity) -> Quantity:
+        if quantity.dimensions != _DIMENSIONLESS:
+            raise ExpressionError(f"{name} needs a plain number")
+        return Quantity(function(quantity.value))
+    return apply
+
+def _reduction(function: Callable[[np.ndarray], Any]) -> Callable[..., Quantity]:
+    def apply(*quantities: Quantity) -> Quantity:
+        if not quantities:
+            raise ExpressionError("Missing values")
+        dimensions = quantities[0].dimensions
+        if any(q.dimensions != dimensions for q in quantities):
+            raise ExpressionError("Values must all have the same unit")
+        values = np.concatenate([np.atleast_1d(q.value) for q in quantities])
+        return Quantity(float(function(values)), dimensions)
+    return apply
+
+FUNCTIONS: dict[str, Callable[..., Quantity]] = {
+    "sqrt": lambda q: q ** Quantity(0.5),
+    "abs": lambda q: Quantity(np.abs(q.value), q.dimensions),
+    # Quantities are kept in SI units, rounding them would round grams as kilograms
+    "round": lambda q, digits=Quantity(0.0): _elementwise("round", lambda v: np.round(v, int(_scalar(digits, "digits"))))(q),
+    "log": _elementwise("log", np.log),
+    "log10": _elementwise("log10", np.log10),
+    "exp": _elementwise("exp", np.exp),
+    "sum": _reduction(np.sum),
+    "mean": _reduction(np.mean),
+    "min": _reduction(np.min),
+    "max": _reduction(np.max),
+    "dilution": _dilution,
+    "percent": _percent,
+    "percent_of": _percent_of,
+}
+
+CONSTANTS = {"pi": math.pi, "e": math.e}
+
+_BINARY_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv,
+    ast.Mod: operator.mod, ast.Pow: operator.pow,
+}
+
+# A number directly followed by a unit, as in "250 mL" or "0.1M", is one quantity: "250 mL / 2 L" is (250*mL)/(2*L)
+_NUMBER = r"(?<![\w.])(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?(?![eE][+-]?\d)"
+_QUANTITY = re.compile(rf"({_NUMBER})\s*(?!in\b)([A-Za-zµ]\w*)\b(?!\s*\()")
+# "2(3 + 4)", "(250*0.1) mL" and "[1, 2, 5] mM" multiply too
+_IMPLICIT_MULTIPLICATION = re.compile(rf"({_NUMBER}|[)\]])\s*(?!in\b)(?=[A-Za-zµ(])")
+_STRING = re.compile(r"(\"[^\"]*\"|'[^']*')")
+# "3e" is more likely a cut exponent than 3 times e, and "2pi" can't be told apart from a typo, so constants
+# have to be multiplied explicitly
+_NUMBER_THEN_CONSTANT = re.compile(rf"({_NUMBER})\s*({'|'.join(CONSTANTS)})\b(?!\s*\()")
+
+def _insert_multiplications(source: str) -> str:
+    # Formulas in quotes are left alone, the 5 of "CuSO4·5H2O" isn't a factor
+    parts = _STRING.split(source)
+    for part in parts[::2]:
+        if (match := _NUMBER_THEN_CONSTANT.search(part)) is not None:
+            number, constant = match.groups()
+            exponent = f" or {number}e2 for an exponent" if constant == "e" else ""
+            raise ExpressionError(f"Ambiguous {match.group(0)!r}, write {number}*{constant} for a product{exponent}")
+    return "".join(part if i % 2 else _IMPLICIT_MULTIPLICATION.sub(r"\1*", _QUANTITY.sub(r"(\1*\2)", part))
+                   for i, part in enumerate(parts))
+
+class _Evaluator(ast.NodeVisitor):
+    def __init__(self):
+        # Units mentioned, in order, used to express the result
+        self.units: list[str] = []
+        self.target_unit: Optional[str] = None
+
+    def generic_visit(self, node: ast.AST) -> Quantity:
+        raise ExpressionError(f"Unsupported syntax: {type(node).__name__}")
+
+    def visit_Expression(self, node: ast.Expression) -> Quantity:
+        return self.visit(node.body)
+
+    def visit_Constant(self, node: ast.Constant) -> Quantity:
+        if isinstance(node.value, bool) or not isinstance(node.value, (int, float)):
+            raise ExpressionError(f"Unsupported value {node.value!r}")
+        return _number(node.value)
+
+    def visit_Name(self, node: ast.Name) -> Quantity:
+        unit = _unit(node.id)
+        if unit is not None:
+            self.units.append(node.id)
+            return Quantity(np.float64(unit[0]), unit[1])
+        if node.id in CONSTANTS:
+            return _number(CONSTANTS[node.id])
+        raise ExpressionError(f"Unknown name {node.id}")
+
+    def visit_List(self, node: ast.List) -> Quantity:
+        if not node.elts or len(node.elts) > MAX_LIST_LENGTH:
+            raise ExpressionError(f"Lists must have between 1 and {MAX_LIST_LENGTH} values")
+        items = [self.visit(element) for element in node.elts]
+        if any(isinstance(item.value, np.ndarray) for item in items):
+            raise ExpressionError("Lists can't be nested")
+        if any(item.dimensions != items[0].dimensions for item in items):
+            raise ExpressionError("List values must all have the same unit")
+        return Quantity(np.array([item.value for item in items], dtype=np.float64), items[0].dimensions)
+
+    visit_Tuple = visit_List
+
+    def visit_UnaryOp(self, node: ast.UnaryOp) -> Quantity:
+        operand = self.visit(node.operand)
+        if isinstance(node.op, ast.USub):
+            return -operand
+        if isinstance(node.op, ast.UAdd):
+            return operand
+        raise ExpressionError(f"Unsupported operator {type(node.op).__name__}")
+
+    def visit_BinOp(self, node: ast.BinOp) -> Quantity:
+        function = _BINARY_OPERATORS.get(type(node.op))
+        if function is None:
+            raise ExpressionError(f"Unsupported operator {type(node.op).__name__}")
+        left, right = self.visit(node.left), self.visit(node.right)
+        try:
+            return function(left, right)
+        except ValueError as e:
+            if isinstance(e, ExpressionError):
+                raise
+            raise ExpressionError("Lists must have the same length") from e
+
+    def visit_Compare(self, node: ast.Compare) -> Quantity:
+        # "250 mL in L" converts the result to the unit after "in"
+        if len(node.ops) != 1 or not isinstance(node.ops[0], ast.In):
+            raise ExpressionError("Comparisons aren't supported, use 'in' to convert units")
+        return self._to(self.visit(node.left), node.comparators[0])
+
+    def _to(self, quantity: Quantity, unit_node: ast.AST) -> Quantity:
+        unit = _unit_name(unit_node)
+        if unit is None:
+            raise ExpressionError("Convert to a unit such as mL, g/L or mmol")
+        self.target_unit = unit
+        if _unit(unit) is None:
+            raise ExpressionError(f"Unknown unit {unit}")
+        return _convert(quantity, unit)
+
+    def visit_Call(self, node: ast.Call) -> Quantity:
+        if not isinstance(node.func, ast.Name):
+            raise ExpressionError("Unsupported function call")
+        name = node.func.id
+        if name == "molar_mass":
+            if len(node.args) != 1 or node.keywords or not isinstance(node.args[0], (ast.Constant, ast.Name)):
+                raise ExpressionError('Use molar_mass("NaCl") with the formula in quotes')
+            formula = node.args[0].value if isinstance(node.args[0], ast.Constant) else node.args[0].id
+            if not isinstance(formula, str):
+                raise ExpressionError('Use molar_mass("NaCl") with the formula in quotes')
+            self.units.append("g/mol")
+            return Quantity(np.float64(molar_mass_of(formula) * 1e-3), _MOLAR_MASS)
+        if name == "to":
+            if len(node.args) != 2 or node.keywords:
+                raise ExpressionError('Use to(value, "unit")')
+            return self._to(self.visit(node.args[0]), node.args[1])
+        function = FUNCTIONS.get(name)
+        if function is None:
+            raise ExpressionError(f"Unknown function {name}")
+        args = [self.visit(arg) for arg in node.args]
+        kwargs = {keyword.arg: self.visit(keyword.value) for keyword in node.keywords}
+        try:
+            return function(*args, **kwargs)
+        except TypeError as e:
+            raise ExpressionError(f"Wrong arguments for {name}") from e
+
+def _unit_name(node: ast.AST) -> Optional[str]:
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value.replace(" ", "")
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div):
+        numerator, denominator = _unit_name(node.left), _unit_name(node.right)
+        return f"{numerator}/{denominator}" if numerator and denominator else None
+    return None
+
+def _format_number(value: float) -> str:
+    return f"{value:.6g}"
+
+def format_quantity(quantity: Quantity, units: list[str], target_unit: Optional[str] = None) -> str:
+    """Express the quantity in the target unit, else in the last unit of the same dimensions mentioned."""
+    unit = target_unit
+    if unit is None and quantity.dimensions != _DIMENSIONLESS:
+        unit = next((u for u in reversed(units) if _unit(u)[1] == quantity.dimensions), None) \
+            or _DISPLAY_UNITS.get(quantity.dimensions)
+    if quantity.dimensions == _DIMENSIONLESS:
+        scale, suffix = 1.0, ""
+    elif unit is not None:
+        scale, suffix = _unit(unit)[0], f" {unit}"
+    else:
+        scale, suffix = 1.0, f" {_si_unit(quantity.dimensions)}"
+    if isinstance(quantity.value, np.ndarray):
+        return ", ".join(_format_number(v) for v in quantity.value / scale) + suffix
+    return _format_number(quantity.value / scale) + suffix
+
+def evaluate_expression(expression: str) -> str:
+    """
+    Evaluate an arithmetic expression with units, chemistry helpers and lists, e.g. "(250*0.1)/3 + 2",
+    "dilution(c1=1 M, c2=0.1 M, v2=250 mL)" or "[1, 2, 5] mM * 10 mL in umol", and describe the result.
+
+    Only numbers, units, lists, the operators + - * / % ** and the functions in FUNCTIONS are accepted, the
+    expression is never handed to eval.
+    """
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise ExpressionError(f"Expressions are limited to {MAX_EXPRESSION_LENGTH} characters")
+    source = _insert_multiplications(expression.replace("^", "**").replace("×", "*").replace("÷", "/"))
+    try:
+        tree = ast.parse(source.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ExpressionError(f"Can't parse {expression}") from e
+    except RecursionError as e:
+        raise ExpressionError("The expression is nested too deeply") from e
+    evaluator = _Evaluator()
+    with np.errstate(all="raise"):
+        try:
+            result = evaluator.visit(tree)
+        except (OverflowError, FloatingPointError) as e:
+            raise ExpressionError(f"The result is out of range: {e}") from e
+        except RecursionError as e:
+            # e.g. "------1", each sign is a level of the tree
+            raise ExpressionError("The expression is nested too deeply") from e
+    if not np.all(np.isfinite(result.value)):
+        raise ExpressionError("The result is out of range")
+    return format_quantity(result, evaluator.units, evaluator.target_unit)
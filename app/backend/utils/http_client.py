@@ -0,0 +1,60 @@
+from typing import Any, AsyncIterator, Optional
+
+import aiohttp
+from aiohttp import web
+
+class ToolHttpClient:
+    """
+    Application-scoped HTTP client shared by the tools that call external HTTP backends (e.g. the Logic Apps).
+
+    Connections are kept alive and pooled with per-host limits, DNS lookups are cached, and every request
+    gets the timeout configured for the tool that issued it.
+    """
+    default_timeout: float
+    tool_timeouts: dict[str, float]
+
+    def __init__(self,
+                 default_timeout: float = 15.0,
+                 tool_timeouts: Optional[dict[str, float]] = None,
+                 limit: int = 100,
+                 limit_per_host: int = 10,
+                 ttl_dns_cache: int = 300,
+                 keepalive_timeout: float = 60.0):
+        self.default_timeout = default_timeout
+        self.tool_timeouts = tool_timeouts or {}
+        self._limit = limit
+        self._limit_per_host = limit_per_host
+        self._ttl_dns_cache = ttl_dns_cache
+        self._keepalive_timeout = keepalive_timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        return self._ensure_session()
+
+    def _ensure_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._limit,
+                                             limit_per_host=self._limit_per_host,
+                                             ttl_dns_cache=self._ttl_dns_cache,
+                                             keepalive_timeout=self._keepalive_timeout)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def timeout(self, tool_name: str) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(total=self.tool_timeouts.get(tool_name, self.default_timeout))
+
+    def post(self, tool_name: str, url: str, **kwargs: Any):
+        """POST on behalf of a tool, to be used as `async with client.post(...) as response:`."""
+        return self.session.post(url, timeout=self.timeout(tool_name), **kwargs)
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def cleanup_ctx(self, app: web.Application) -> AsyncIterator[None]:
+        """Ties the client to the app lifecycle, register with `app.cleanup_ctx.append(client.cleanup_ctx)`."""
+        self._ensure_session()
+        yield
+        await self.close()
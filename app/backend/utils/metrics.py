@@ -0,0 +1,206 @@
+import asyncio
+import math
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Iterator, Optional
+
+from aiohttp import web
+
+# Default buckets in seconds, from a millisecond to half a minute for tool calls and handshakes
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Label values beyond this many per metric are recorded as "other", e.g. event types made up by a client
+MAX_LABEL_SETS = 256
+OTHER_LABEL = "other"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class _Metric(ABC):
+    name: str
+    help: str
+    type: str
+    label_names: tuple[str, ...]
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._children: dict[tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Child of the metric for the label values, created on first use. Keep it to record without lookups."""
+        child = self._children.get(values)
+        if child is None:
+            if len(self._children) >= MAX_LABEL_SETS:
+                values = (OTHER_LABEL,) * len(self.label_names)
+                child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """Holder of the values recorded for one set of label values."""
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """Sample lines of the metric in the Prometheus text format."""
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self.samples()
+
+class _CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+class Counter(_Metric):
+    """Monotonic count, recorded with labels(...).inc() or inc() when it has no labels."""
+    type = "counter"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        super().__init__(name, help, label_names)
+        if not label_names:
+            # Exposed as zero until something is recorded
+            self.labels()
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterator[str]:
+        for values, child in self._children.items():
+            yield f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}"
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        # counts[i] observations fell in (bounds[i - 1], bounds[i]], the last slot is above every bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+class Histogram(_Metric):
+    """Distribution over fixed buckets, recorded with labels(...).observe(value) or observe(value)."""
+    type = "histogram"
+    buckets: tuple[float, ...]
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+        if not label_names:
+            self.labels()
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self) -> Iterator[str]:
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), child.counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}"
+            labels = _format_labels(self.label_names, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+class Gauge(_Metric):
+    """Value read when the metrics are scraped, e.g. the number of live sessions, so nothing is recorded."""
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, read: Callable[[], float], metric_type: str = "gauge"):
+        super().__init__(name, help)
+        self.read = read
+        # Counters kept by another component (e.g. the upstream pool) are exposed the same way
+        self.type = metric_type
+
+    def _new_child(self):
+        raise TypeError(f"Gauge {self.name} is read when scraped, it has no labels to record into")
+
+    def samples(self) -> Iterator[str]:
+        yield f"{self.name} {_format_value(self.read())}"
+
+class MetricsRegistry:
+    """
+    Metrics of a worker in the Prometheus text format, served by handle() on e.g. /metrics.
+
+    Recording only increments plain Python numbers of objects created up front, without locks (everything
+    runs on the event loop) or allocations once a label set has been seen, so it can be done for every frame.
+    """
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, label_names: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, label_names))
+
+    def histogram(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, label_names, buckets))
+
+    def gauge(self, name: str, help: str, read: Callable[[], float], metric_type: str = "gauge") -> Gauge:
+        return self.register(Gauge(name, help, read, metric_type))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self._metrics.values() for line in metric.render()) + "\n"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.render(), content_type="text/plain", headers={"Cache-Control": "no-store"})
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task sleeping interval seconds, i.e. how long a frame can wait
+    before being relayed because something blocks the loop.
+    """
+    interval: float
+
+    def __init__(self, registry: MetricsRegistry, interval: float = 0.5):
+        self.interval = interval
+        self.lag = registry.histogram("event_loop_lag_seconds", "Delay of the event loop in waking up a sleeping task.",
+                                      buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+        self._task: Optional[asyncio.Task] = None
+
+    async def _measure(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag.observe(max(time.monotonic() - expected, 0.0))
+
+    async def cleanup_ctx(self, app: web.Application):
+        self._task = asyncio.create_task(self._measure())
+        yield
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
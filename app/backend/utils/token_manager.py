@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from azure.core.credentials import AccessToken, TokenCredential
+
+logger = logging.getLogger("voiceassistant")
+
+class AsyncTokenManager:
+    """
+    Hands out cached Entra tokens without blocking the event loop.
+
+    Tokens are fetched from the wrapped (synchronous) credential on a worker thread and refreshed by a
+    background task ahead of their expiry, and concurrent requests for the same scopes share a single fetch.
+    The manager implements the async credential protocol, so it can be given to aio Azure SDK clients too.
+    """
+    credential: TokenCredential
+    # How long before expiry a token is refreshed
+    refresh_margin: float
+    # How long to wait before retrying a failed background refresh
+    retry_interval: float
+
+    def __init__(self, credential: TokenCredential, refresh_margin: float = 5 * 60, retry_interval: float = 30.0):
+        self.credential = credential
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self._tokens: dict[tuple[str, ...], AccessToken] = {}
+        self._inflight: dict[tuple[str, ...], asyncio.Future] = {}
+        self._refreshers: dict[tuple[str, ...], asyncio.Task] = {}
+
+    async def get_token(self, *scopes: str, claims: Optional[str] = None, **kwargs: Any) -> AccessToken:
+        if claims is not None or kwargs:
+            # Claims challenges and other options can't be served from the cache
+            return await asyncio.to_thread(self.credential.get_token, *scopes, claims=claims, **kwargs)
+        token = self._tokens.get(scopes)
+        if token is not None and token.expires_on > time.time() + 30:
+            return token
+        return await self._fetch(scopes)
+
+    def get_bearer_token_provider(self, *scopes: str) -> Callable[[], Awaitable[str]]:
+        async def get_bearer_token() -> str:
+            return (await self.get_token(*scopes)).token
+        return get_bearer_token
+
+    def warm_up(self, *scopes: str) -> None:
+        """Start fetching a token in the background so it is cached by the time the first request arrives."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running in the app's event loop yet, the first request will fetch the token
+            return
+        loop.create_task(self._warm_up(scopes))
+
+    async def _warm_up(self, scopes: tuple[str, ...]) -> None:
+        try:
+            await self.get_token(*scopes)
+        except Exception as e:
+            logger.warning(f"Could not warm up token: {e}")
+
+    async def _fetch(self, scopes: tuple[str, ...]) -> AccessToken:
+        inflight = self._inflight.get(scopes)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._fetch_now(scopes))
+            self._inflight[scopes] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(scopes, None))
+        # Shield the shared fetch so that one cancelled caller doesn't cancel it for all the others
+        return await asyncio.shield(inflight)
+
+    async def _fetch_now(self, scopes: tuple[str, ...]) -> AccessToken:
+        token = await asyncio.to_thread(self.credential.get_token, *scopes)
+        self._tokens[scopes] = token
+        refresher = self._refreshers.get(scopes)
+        if refresher is None or refresher.done():
+            self._refreshers[scopes] = asyncio.create_task(self._refresh(scopes))
+        return token
+
+    async def _refresh(self, scopes: tuple[str, ...]) -> None:
+        while True:
+            expires_on = self._tokens[scopes].expires_on
+            await asyncio.sleep(max(expires_on - time.time() - self.refresh_margin, 0))
+            try:
+                token = await self._fetch(scopes)
+            except Exception as e:
+                logger.warning(f"Could not refresh token, retrying in {self.retry_interval} seconds: {e}")
+                await asyncio.sleep(self.retry_interval)
+                continue
+            if token.expires_on <= expires_on:
+                # The credential still serves its cached token (azure-identity only refreshes close to expiry and
+                # throttles failed refreshes), don't ask again until the retry interval has passed
+                await asyncio.sleep(self.retry_interval)
+
+    async def close(self) -> None:
+        for refresher in self._refreshers.values():
+            refresher.cancel()
+        self._refreshers.clear()
+
+    async def __aenter__(self) -> "AsyncTokenManager":
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        await self.close()
@@ -0,0 +1,230 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from aiohttp import ClientResponseError, web
+
+from .durable_queue import DurableQueue, QueueEntry
+
+logger = logging.getLogger("voiceassistant")
+
+class PartialDeliveryError(Exception):
+    """Raised by a deliver function that got only the first payloads through, so that they aren't retried."""
+    delivered: int
+
+    def __init__(self, delivered: int, cause: Exception):
+        super().__init__(str(cause))
+        self.delivered = delivered
+
+def _is_permanent(error: Exception) -> bool:
+    """Whether a failed delivery would fail again however often it is retried: a 4xx other than timeout and throttling."""
+    cause = error.__cause__ if isinstance(error, PartialDeliveryError) else error
+    return isinstance(cause, ClientResponseError) and 400 <= cause.status < 500 and cause.status not in (408, 429)
+
+class _PendingKey:
+    entries: int
+    size: int
+    since: float
+    retry_at: float
+    failures: int
+    requested: bool
+    flushing: bool
+
+    def __init__(self, entries: int = 0, size: int = 0):
+        self.entries = entries
+        self.size = size
+        self.since = time.monotonic()
+        self.retry_at = 0.0
+        self.failures = 0
+        self.requested = False
+        self.flushing = False
+
+class WriteBehindQueue:
+    """
+    Write-behind buffer in front of a slow or flaky backend. put() returns as soon as the payload is spooled
+    to the DurableQueue, and a background worker hands the payloads of a key to deliver(key, payloads) in
+    order, coalescing everything queued for the key into one call of at most max_batch payloads.
+
+    A key is flushed once it has max_bytes queued, once its oldest payload waited max_delay seconds, or when
+    flush(key) is called (e.g. when the session writing to it closes). Failed deliveries are retried with
+    exponential backoff from retry_base up to retry_max seconds: whatever is left when the app stops stays in
+    the spool and is delivered after the next start. Only payloads the backend rejects for good (a 4xx other
+    than 408 and 429) are dropped, with an error logged and counted in dropped, and their dedupe keys can be
+    queued again.
+    """
+    max_delay: float
+    max_bytes: int
+    max_batch: int
+    retry_base: float
+    retry_max: float
+    delivered: int
+    deliveries: int
+    failures: int
+    dropped: int
+
+    def __init__(self,
+                 queue: DurableQueue,
+                 deliver: Callable[[str, list[Any]], Awaitable[None]],
+                 max_delay: float = 2.0,
+                 max_bytes: int = 4096,
+                 max_batch: int = 50,
+                 retry_base: float = 1.0,
+                 retry_max: float = 300.0):
+        self.queue = queue
+        self.deliver = deliver
+        self.max_delay = max_delay
+        self.max_bytes = max_bytes
+        self.max_batch = max_batch
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.delivered = 0
+        self.deliveries = 0
+        self.failures = 0
+        self.dropped = 0
+        self._pending: dict[str, _PendingKey] = {}
+        self._wakeup = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self._flushes: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        """Payloads not delivered yet."""
+        return sum(pending.entries for pending in self._pending.values())
+
+    async def put(self, key: str, payload: Any, size: int = 0, dedupe_key: Optional[str] = None) -> bool:
+        """Whether the payload was queued, False for a duplicate of a dedupe key (see DurableQueue)."""
+        if await asyncio.to_thread(self.queue.put, key, payload, size, dedupe_key) is None:
+            return False
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingKey()
+        pending.entries += 1
+        pending.size += size
+        self._wakeup.set()
+        return True
+
+    def flush(self, key: str) -> None:
+        """Deliver what is queued for the key without waiting for max_delay, backoff still applies."""
+        if (pending := self._pending.get(key)) is not None:
+            pending.requested = True
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        # Payloads spooled before a restart are delivered right away
+        for key, (entries, size) in (await asyncio.to_thread(self.queue.keys)).items():
+            pending = self._pending[key] = _PendingKey(entries, size)
+            pending.requested = True
+        if self._pending:
+            logger.info(f"Resuming delivery of {len(self)} spooled entries from {self.queue.path}")
+        self._worker = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = 5.0) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)
+            self._worker = None
+        if self._flushes:
+            await asyncio.wait(self._flushes, timeout=timeout)
+        # Last attempt for what is still queued, the rest waits in the spool for the next start
+        keys = [key for key, pending in self._pending.items() if not pending.flushing]
+        try:
+            await asyncio.wait_for(asyncio.gather(*(self._flush(key) for key in keys)), timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._flushes:
+            task.cancel()
+        await asyncio.gather(*self._flushes, return_exceptions=True)
+        if self._pending:
+            logger.warning(f"{len(self)} entries left in {self.queue.path} on shutdown")
+        await asyncio.to_thread(self.queue.close)
+
+    def cleanup_ctx(self):
+        async def cleanup_ctx(app: web.Application):
+            await self.start()
+            yield
+            await self.close()
+        return cleanup_ctx
+
+    def _next_flush_at(self, pending: _PendingKey) -> float:
+        ready_at = pending.since + self.max_delay
+        if pending.requested or pending.size >= self.max_bytes:
+            ready_at = 0.0
+        return max(ready_at, pending.retry_at)
+
+    async def _run(self) -> None:
+        while True:
+            now = time.monotonic()
+            due = []
+            next_at = float("inf")
+            for key, pending in self._pending.items():
+                if pending.flushing:
+                    continue
+                flush_at = self._next_flush_at(pending)
+                if flush_at <= now:
+                    due.append(key)
+                else:
+                    next_at = min(next_at, flush_at)
+            for key in due:
+                self._pending[key].flushing = True
+                task = asyncio.create_task(self._flush(key))
+                self._flushes.add(task)
+                task.add_done_callback(self._flushes.discard)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), None if next_at == float("inf") else next_at - now)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _flush(self, key: str) -> None:
+        pending = self._pending[key]
+        pending.flushing = True
+        try:
+            while pending.entries > 0:
+                entries = await asyncio.to_thread(self.queue.peek, key, self.max_batch)
+                if not entries:
+                    pending.entries = 0
+                    break
+                try:
+                    await self.deliver(key, [entry.payload for entry in entries])
+                except Exception as e:
+                    if isinstance(e, PartialDeliveryError) and e.delivered > 0:
+                        await asyncio.to_thread(self.queue.remove, [entry.id for entry in entries[:e.delivered]])
+                        self._delivered(pending, entries[:e.delivered])
+                        entries = entries[e.delivered:]
+                    if _is_permanent(e):
+                        # A partial delivery failed on its first undelivered payload, otherwise the whole batch was rejected
+                        rejected = entries[:1] if isinstance(e, PartialDeliveryError) else entries
+                        await asyncio.to_thread(self.queue.discard, [entry.id for entry in rejected])
+                        self._dropped(pending, rejected)
+                        logger.error(f"Dropping {len(rejected)} entries of {key} rejected by the backend: {e}")
+                        continue
+                    self.failures += 1
+                    pending.failures += 1
+                    delay = min(self.retry_max, self.retry_base * 2 ** (pending.failures - 1))
+                    pending.retry_at = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                    logger.warning(f"Can't deliver {len(entries)} entries of {key}, retrying in {delay:.1f} s: {e}")
+                    return
+                await asyncio.to_thread(self.queue.remove, [entry.id for entry in entries])
+                self._delivered(pending, entries)
+                pending.failures = 0
+                pending.retry_at = 0.0
+            if pending.entries <= 0:
+                del self._pending[key]
+            else:
+                pending.since = time.monotonic()
+                pending.requested = False
+        finally:
+            pending.flushing = False
+            self._wakeup.set()
+
+    def _delivered(self, pending: _PendingKey, entries: list[QueueEntry]) -> None:
+        self.deliveries += 1
+        self.delivered += len(entries)
+        pending.entries -= len(entries)
+        pending.size -= sum(entry.size for entry in entries)
+
+    def _dropped(self, pending: _PendingKey, entries: list[QueueEntry]) -> None:
+        self.dropped += len(entries)
+        pending.entries -= len(entries)
+        pending.size -= sum(entry.size for entry in entries)
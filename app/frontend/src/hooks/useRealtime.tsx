@@ -10,7 +10,10 @@ import {
     SessionUpdateCommand,
     ExtensionMiddleTierToolResponse,
     ResponseInputAudioTranscriptionCompleted,
-    InputTextCommand
+    InputTextCommand,
+    ExtensionMachineState,
+    MachineStateSubscribeCommand,
+    MachineStateUnsubscribeCommand
 } from "@/types";
 
 type Parameters = {
@@ -29,6 +32,7 @@ type Parameters = {
     onReceivedInputAudioBufferSpeechStarted?: (message: Message) => void;
     onReceivedResponseDone?: (message: ResponseDone) => void;
     onReceivedExtensionMiddleTierToolResponse?: (message: ExtensionMiddleTierToolResponse) => void;
+    onReceivedExtensionMachineState?: (message: ExtensionMachineState) => void;
     onReceivedResponseAudioTranscriptDelta?: (message: ResponseAudioTranscriptDelta) => void;
     onReceivedInputAudioTranscriptionCompleted?: (message: ResponseInputAudioTranscriptionCompleted) => void;
     onReceivedInputAudioBufferCleared?: () => void;
@@ -50,6 +54,7 @@ export default function useRealTime({
     onReceivedResponseAudioTranscriptDelta,
     onReceivedInputAudioBufferSpeechStarted,
     onReceivedExtensionMiddleTierToolResponse,
+    onReceivedExtensionMachineState,
     onReceivedInputAudioTranscriptionCompleted,
     onReceivedInputAudioBufferCleared,
     onReceivedError
@@ -138,6 +143,24 @@ export default function useRealTime({
         sendJsonMessage(command);
     };
 
+    // Live machine readings pushed by the middle tier, without going through the model
+    const subscribeMachineState = (minIntervalSeconds?: number) => {
+        const command: MachineStateSubscribeCommand = {
+            type: "extension.machine_state.subscribe",
+            ...(minIntervalSeconds ? { min_interval: minIntervalSeconds } : {})
+        };
+
+        sendJsonMessage(command);
+    };
+
+    const unsubscribeMachineState = () => {
+        const command: MachineStateUnsubscribeCommand = {
+            type: "extension.machine_state.unsubscribe"
+        };
+
+        sendJsonMessage(command);
+    };
+
     const onMessageReceived = (event: MessageEvent<any>) => {
         onWebSocketMessage?.(event);
 
@@ -168,6 +191,9 @@ export default function useRealTime({
             case "extension.middle_tier_tool_response":
                 onReceivedExtensionMiddleTierToolResponse?.(message as ExtensionMiddleTierToolResponse);
                 break;
+            case "extension.machine_state":
+                onReceivedExtensionMachineState?.(message as ExtensionMachineState);
+                break;
             // handle the case when the input audio buffer is cleared (as effect of the input_audio_buffer.clear command sent by the server on the stop keyword)
             case "input_audio_buffer.cleared":
                 onReceivedInputAudioBufferCleared?.();
@@ -178,5 +204,5 @@ export default function useRealTime({
         }
     };
 
-    return { startSession, addUserAudio, inputAudioBufferClear, addUserText };
+    return { startSession, addUserAudio, inputAudioBufferClear, addUserText, subscribeMachineState, unsubscribeMachineState };
 }
@@ -41,6 +41,15 @@ export type InputTextCommand = {
     text: string;
 };
 
+export type MachineStateSubscribeCommand = {
+    type: "extension.machine_state.subscribe";
+    min_interval?: number; // seconds between updates, the server enforces a minimum
+};
+
+export type MachineStateUnsubscribeCommand = {
+    type: "extension.machine_state.unsubscribe";
+};
+
 export type Message = {
     type: string;
 };
@@ -79,6 +88,20 @@ export type ExtensionMiddleTierToolResponse = {
     tool_result: string; // JSON string that needs to be parsed into ToolResult
 };
 
+export type MachinePositionState = {
+    deck: string;
+    position: string;
+    setpoint: number;
+    temperature: number;
+};
+
+export type ExtensionMachineState = {
+    type: "extension.machine_state";
+    version: number;
+    read_at: number | null; // unix time the temperatures were read from the machine
+    positions: MachinePositionState[]; // every position in the first event, then only the changed ones
+};
+
 export type ToolResult = {
     sources: { chunk_id: string; title: string; chunk: string }[];
 };
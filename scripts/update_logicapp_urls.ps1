@@ -93,6 +93,10 @@ foreach ($app in $logicApps) {
         $triggerName = "replaceFileContent"
         $envVar = "NOTEPAD_REPLACE_FILE_CONTENT_API_URL"
     }
+    elseif ($appName -like "*list-files*") {
+        $triggerName = "listFiles"
+        $envVar = "NOTEPAD_LIST_FILES_API_URL"
+    }
     elseif ($appName -like "*create-task*") {
         $triggerName = "createTask"
         $envVar = "TODOLIST_CREATE_TASK_API_URL"
@@ -69,6 +69,9 @@ while IFS= read -r app_info; do
     elif [[ "$app_name" == *"replace-file-content"* ]]; then
         trigger_name="replaceFileContent"
         env_var="NOTEPAD_REPLACE_FILE_CONTENT_API_URL"
+    elif [[ "$app_name" == *"list-files"* ]]; then
+        trigger_name="listFiles"
+        env_var="NOTEPAD_LIST_FILES_API_URL"
     elif [[ "$app_name" == *"create-task"* ]]; then
         trigger_name="createTask"
         env_var="TODOLIST_CREATE_TASK_API_URL"